@@ -1,4 +1,8 @@
 """Support shorthand import of our classes into the namespace.
 """
 from munger import Munger
+from munger import Document
 from xpathgen import XpathGen
+from batch import Batch
+from xslt import XsltGen
+from plan import Plan
@@ -0,0 +1,354 @@
+import os
+import re
+import time
+import lxml.html
+import lxml.etree
+
+import baip_munger.munger
+from logga.log import log
+
+__all__ = ['SHAPES', 'REWRITES', 'shapes', 'rewrites', 'load_samples',
+           'Analyser']
+
+# Known slow XPath shapes mapped to their description.
+SHAPES = {
+    'descendant-contains': ('leading // step filtered by contains(): '
+                            'every element of the document is tested'),
+    'descendant-wildcard': '//* visits every element of the document',
+    'predicate-descendant': ('descendant step inside a predicate: a '
+                             'subtree walk per candidate node'),
+}
+
+# Rewrites suggested by :func:`rewrites` mapped to their description.
+REWRITES = {
+    'exact-match': 'contains() test replaced by an equality test',
+    'absolute-path': 'leading // step replaced by its absolute path',
+    'named-tag': '* step replaced by the tag name it matches',
+    'child-step': ('descendant step in a predicate replaced by a child '
+                   'step'),
+}
+
+# contains(@attribute, 'literal') test.
+CONTAINS = re.compile(r"""contains\(\s*@([\w:.-]+)\s*,\s*"""
+                      r"""(?P<q>['"])([^'"]*)(?P=q)\s*\)""")
+
+# Timed evaluations of each expression per sample document.  The
+# fastest is kept.
+REPEAT = 3
+
+
+def _scan(expression):
+    """Split *expression* into its top level location steps.
+
+    **Returns:**
+        tuple of the form ``(<steps>, <nested>)`` where *steps* is a
+        list of ``(<separator>, <start>, <end>)`` tuples that give the
+        ``/`` or ``//`` separator before each step and the offsets of
+        the step (with its predicates) and *nested* is the list of
+        offsets of the ``//`` separators inside predicates
+
+    """
+    steps = []
+    nested = []
+    depth = 0
+    quote = None
+    separator = ''
+    start = 0
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '[(':
+            depth += 1
+        elif char in '])':
+            depth -= 1
+        elif char == '/':
+            double = expression[index:index + 2] == '//'
+            if depth:
+                if double:
+                    nested.append(index)
+            else:
+                if index > start or steps:
+                    steps.append((separator, start, index))
+                separator = '//' if double else '/'
+                start = index + len(separator)
+            if double:
+                index += 1
+        index += 1
+
+    steps.append((separator, start, len(expression)))
+
+    return (steps, nested)
+
+
+def shapes(expression):
+    """Identify the known slow shapes (keys of :data:`SHAPES`) of
+    *expression*.
+
+    """
+    found = []
+    steps, nested = _scan(expression)
+
+    separator, start, end = steps[0]
+    if separator == '//' and CONTAINS.search(expression[start:end]):
+        found.append('descendant-contains')
+
+    for separator, start, end in steps:
+        if separator == '//' and expression[start:end].startswith('*'):
+            found.append('descendant-wildcard')
+            break
+
+    if nested:
+        found.append('predicate-descendant')
+
+    return found
+
+
+def _evaluate(root, expression, context=None):
+    document = baip_munger.munger.Document(root)
+
+    return document.select(expression, context)
+
+
+def _tag_path(element):
+    tags = []
+    while element is not None:
+        tags.append(element.tag)
+        element = element.getparent()
+    tags.reverse()
+
+    return tags
+
+
+def rewrites(expression, roots, context=None):
+    """Generate cheaper candidate rewrites of *expression* from the
+    sample documents *roots*.
+
+    Candidates follow the structure that the sample documents share
+    (for example, the single tag that a ``//*`` step matches) so they
+    are only equivalent if :meth:`Analyser.same_nodes` confirms it.
+
+    **Returns:**
+        list of ``(<rewrite>, <rewritten expression>)`` tuples where
+        *rewrite* is a key of :data:`REWRITES`
+
+    """
+    candidates = []
+    steps, nested = _scan(expression)
+
+    separator, start, end = steps[0]
+    match = CONTAINS.search(expression, start, end)
+    if separator == '//' and match is not None:
+        exact = '@%s=%s%s%s' % (match.group(1),
+                                match.group('q'),
+                                match.group(3),
+                                match.group('q'))
+        rewritten = (expression[:match.start()] + exact +
+                     expression[match.end():])
+        candidates.append(('exact-match', rewritten))
+
+    if separator == '//' and not context and '|' not in expression:
+        paths = set()
+        for root in roots:
+            for node in _evaluate(root, expression[:end]):
+                if not isinstance(node, lxml.etree._Element):
+                    break
+                paths.add(tuple(_tag_path(node)[:-1]))
+        if len(paths) == 1:
+            prefix = ''.join('/%s' % x for x in paths.pop())
+            rewritten = prefix + '/' + expression[start:]
+            candidates.append(('absolute-path', rewritten))
+
+    for separator, start, end in steps:
+        if separator != '//' or not expression[start:end].startswith('*'):
+            continue
+        tags = set()
+        for root in roots:
+            for node in _evaluate(root, expression[:end], context):
+                tags.add(getattr(node, 'tag', None))
+        if len(tags) == 1 and isinstance(list(tags)[0], basestring):
+            rewritten = (expression[:start] + tags.pop() +
+                         expression[start + 1:])
+            candidates.append(('named-tag', rewritten))
+
+    for index in nested:
+        if expression[index - 1:index] == '.':
+            rewritten = expression[:index - 1] + expression[index + 2:]
+            candidates.append(('child-step', rewritten))
+
+    return candidates
+
+
+def load_samples(paths):
+    """Parse the HTML sample documents at *paths*.  Directories are
+    searched recursively.
+
+    **Returns:**
+        list of the sample root elements
+
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                files.extend(os.path.join(dirpath, x)
+                             for x in sorted(filenames))
+        else:
+            files.append(path)
+
+    roots = []
+    for sample_file in files:
+        try:
+            with open(sample_file) as html_fh:
+                roots.append(lxml.html.fromstring(html_fh.read()))
+        except (IOError, lxml.etree.ParserError) as err:
+            log.warn('Sample "%s" skipped: %s' % (sample_file, err))
+
+    log.info('Loaded %d sample documents' % len(roots))
+
+    return roots
+
+
+class Analyser(object):
+    """Rank the XPath expressions of an *actions* plan (as per
+    :meth:`baip_munger.XpathGen.parse_configuration`) by their cost
+    against a sample corpus and suggest cheaper rewrites.
+
+    Each expression is evaluated against the unmodified sample
+    documents, as for a dry run with ``simulate`` off.  Rules are
+    analysed regardless of their ``when`` guards.
+
+    """
+    def __init__(self, actions, repeat=REPEAT):
+        self.__actions = actions
+        self.__repeat = repeat
+
+    @property
+    def actions(self):
+        return self.__actions
+
+    @property
+    def repeat(self):
+        return self.__repeat
+
+    def cost(self, expression, roots, context=None):
+        """Time *expression* against each of the sample *roots*.
+
+        **Returns:**
+            tuple of the form ``(<seconds>, <matches>)`` where
+            *seconds* is the sum of the fastest evaluation per document
+
+        """
+        seconds = 0.0
+        matches = 0
+        for root in roots:
+            fastest = None
+            for _ in range(self.__repeat):
+                start = time.time()
+                nodes = _evaluate(root, expression, context)
+                elapsed = time.time() - start
+                if fastest is None or elapsed < fastest:
+                    fastest = elapsed
+            seconds += fastest
+            matches += len(nodes) if isinstance(nodes, list) else 1
+
+        return (seconds, matches)
+
+    @staticmethod
+    def same_nodes(expression, rewritten, roots, context=None):
+        """Check that *rewritten* selects the same nodes as
+        *expression* in each of the sample *roots*.
+
+        """
+        for root in roots:
+            try:
+                received = _evaluate(root, rewritten, context)
+            except lxml.etree.XPathError:
+                return False
+            if received != _evaluate(root, expression, context):
+                return False
+
+        return True
+
+    def analyse(self, roots):
+        """Analyse each distinct rule XPath of :attr:`actions` against
+        the sample *roots*.
+
+        **Returns:**
+            list of dictionaries, most expensive first, of the form::
+
+                {
+                    'rules': ['<rule_id>', ...],
+                    'xpath': '<expression>',
+                    'context': [...] or None,
+                    'seconds': <seconds>,
+                    'matches': <matches>,
+                    'shapes': ['<shape>', ...],
+                    'suggestions': [
+                        {
+                            'rewrite': '<rewrite>',
+                            'xpath': '<rewritten expression>',
+                            'seconds': <seconds>,
+                            'equivalent': <bool>,
+                        },
+                    ],
+                }
+
+            A suggestion is only *equivalent* if the samples match
+            *xpath* and it matched the same nodes in every sample
+            document
+
+        """
+        entries = {}
+        order = []
+        steps = baip_munger.munger.Munger.plan_steps(self.__actions)
+        for rule_id, _, rule, _ in steps:
+            xpath = rule.get('xpath')
+            if xpath is None:
+                continue
+            context = rule.get('context') or None
+            key = (xpath, tuple(context or ()))
+            if key not in entries:
+                entries[key] = {'rules': [],
+                                'xpath': xpath,
+                                'context': context}
+                order.append(key)
+            entries[key]['rules'].append(rule_id)
+
+        for key in order:
+            entry = entries[key]
+            xpath = entry['xpath']
+            context = entry['context']
+            entry['seconds'], entry['matches'] = self.cost(xpath,
+                                                           roots,
+                                                           context)
+            entry['shapes'] = shapes(xpath)
+
+            suggestions = []
+            seen = set([xpath])
+            for rewrite, rewritten in rewrites(xpath, roots, context):
+                if rewritten in seen:
+                    continue
+                seen.add(rewritten)
+                equivalent = (entry['matches'] > 0 and
+                              self.same_nodes(xpath,
+                                              rewritten,
+                                              roots,
+                                              context))
+                seconds = None
+                if equivalent:
+                    seconds = self.cost(rewritten, roots, context)[0]
+                suggestions.append({'rewrite': rewrite,
+                                    'xpath': rewritten,
+                                    'seconds': seconds,
+                                    'equivalent': equivalent})
+            entry['suggestions'] = suggestions
+
+            log.debug('XPath "%s" cost: %.6fs' % (xpath, entry['seconds']))
+
+        return sorted((entries[x] for x in order),
+                      key=lambda x: -x['seconds'])
@@ -0,0 +1,773 @@
+import os
+import time
+import fnmatch
+import collections
+import multiprocessing
+
+import baip_munger.munger
+import baip_munger.xslt
+import baip_munger.pool
+import baip_munger.shard
+import baip_munger.dedupe
+import baip_munger.metrics
+import baip_munger.profiling
+from logga.log import log
+
+__all__ = ['Batch']
+
+# Worker process state.  Set once per worker by _init_worker() so that
+# the action plan is shipped to each worker process only once.
+_WORKER = {}
+
+METRICS = baip_munger.metrics.REGISTRY
+DOCUMENTS_PER_SECOND = METRICS.gauge('baip_munger_batch_documents_per_second',
+                                     'Documents munged per second over the '
+                                     'last batch run')
+BYTES_PER_SECOND = METRICS.gauge('baip_munger_batch_bytes_per_second',
+                                 'Staged bytes read per second over the last '
+                                 'batch run')
+
+
+def _init_worker(actions, simulate, backend, profiling=None, output='html',
+                 block_size=None, limited=False):
+    _WORKER['actions'] = actions
+    _WORKER['simulate'] = simulate
+    _WORKER['munger'] = baip_munger.munger.Munger(atomic=True,
+                                                  output=output,
+                                                  block_size=block_size)
+
+    _WORKER['plan'] = actions
+    if backend == 'xslt':
+        if isinstance(actions, list):
+            _WORKER['plan'] = [baip_munger.xslt.XsltGen(x) for x in actions]
+        else:
+            _WORKER['plan'] = baip_munger.xslt.XsltGen(actions)
+
+
+def _init_pool_worker(*args):
+    # Discard the metric samples inherited from the parent on fork.
+    METRICS.snapshot(reset=True)
+    _init_worker(*args)
+
+    # Rule progress is only read by the parent to enforce its limits.
+    limited = args[6] if len(args) > 6 else False
+    if limited:
+        _WORKER['munger'].progress = baip_munger.pool.progress
+
+    profiling = args[3] if len(args) > 3 else None
+    if profiling:
+        baip_munger.profiling.start(**profiling)
+        baip_munger.pool.at_exit(baip_munger.profiling.stop)
+
+
+def _munge_worker(paths):
+    staged_file, munged_file = paths
+    munger = _WORKER['munger']
+
+    status = False
+    error = None
+    start = time.time()
+    try:
+        status = munger.munge(_WORKER['plan'], staged_file, munged_file)
+        if not status:
+            error = 'munge failed'
+    except Exception as err:
+        log.error('Munge "%s" failed: %s' % (staged_file, err))
+        error = str(err)
+    finally:
+        # The worker munger is reused, so release the written tree
+        # rather than hold it until the next document.
+        if munger.document is not None:
+            munger.document.close()
+
+    # Ship this document's metric samples back to the parent registry.
+    return (staged_file,
+            status,
+            METRICS.snapshot(reset=True),
+            time.time() - start,
+            error)
+
+
+def _dry_run_worker(staged_file):
+    munger = _WORKER['munger']
+
+    counts = None
+    try:
+        counts = munger.dry_run(_WORKER['actions'],
+                                staged_file,
+                                simulate=_WORKER['simulate'])
+    except Exception as err:
+        log.error('Dry run "%s" failed: %s' % (staged_file, err))
+
+    return (staged_file, counts)
+
+
+class Batch(object):
+    """Apply a single action plan across a corpus of staged HTML
+    documents.
+
+    Documents are processed by a :class:`baip_munger.pool.WorkerPool`
+    of *workers* processes.  If *workers* is ``1`` then processing
+    occurs within the current process.
+
+    *deadline* and *rule_timeout* limit the seconds spent on a single
+    document and on a single rule within a document.  A document that
+    exceeds either limit has its worker process killed and replaced
+    and is reported under ``quarantined`` together with the rule that
+    was running.  Limits are only enforced by the worker pool so they
+    force its use even if *workers* is ``1``.
+
+    *backend* is either ``python`` (the :class:`baip_munger.Munger`
+    engine) or ``xslt`` (the plan is compiled once per worker by
+    :class:`baip_munger.XsltGen`).
+
+    *actions* can also be a list of plans, one per rendition.  See
+    :meth:`munge`.
+
+    *shard* is a ``(<index>, <count>)`` tuple that restricts the
+    documents to one of *count* deterministic partitions of the corpus
+    by the *sharding* method (see :func:`baip_munger.shard.select`).
+
+    With *scheduling* ``size`` (the default) the worker pool munges the
+    documents largest first so that a giant document does not start
+    last and leave the other workers idle.  The largest is by file
+    size or, given a :class:`baip_munger.schedule.CostModel` as
+    *cost_model*, by predicted munge time.  The cost model learns from
+    each document munged.  The first *small_lane* workers are reserved
+    for the smallest documents.  ``fifo`` keeps the source order.
+
+    Munged documents are written atomically.  Used as a context
+    manager, the worker pool is kept warm across calls.
+
+    *profiling* is a dictionary of :func:`baip_munger.profiling.start`
+    keywords that each pool worker is profiled with.  Each worker
+    writes its own files when the pool stops.  Documents munged within
+    the current process are profiled by the caller.
+
+    With *output* ``changes`` each munged path receives the change set
+    of its document rather than the munged document (see
+    :attr:`baip_munger.Munger.output`).  With *output* ``splice`` the
+    unchanged source bytes of each document are kept.  Both need the
+    ``python`` *backend*.
+
+    With a *block_size* each staged document is parsed as it is read
+    (see :attr:`baip_munger.Munger.block_size`).
+
+    With *dedupe* set, staged documents with the same content are
+    munged only once.  The output of the others is written by hard
+    link, reflink or copy (see :func:`baip_munger.dedupe.clone`).
+
+    """
+    def __init__(self, actions, workers=None, patterns=None,
+                 backend='python', deadline=None, rule_timeout=None,
+                 shard=None, sharding='hash', scheduling='size',
+                 small_lane=0, cost_model=None, profiling=None,
+                 output='html', block_size=None, dedupe=False):
+        if output != 'html' and backend != 'python':
+            raise ValueError('%s output needs the python backend' %
+                             output.capitalize())
+
+        self.__actions = actions
+        self.__workers = workers
+        self.__backend = backend
+        self.__deadline = deadline
+        self.__rule_timeout = rule_timeout
+        self.__shard = shard
+        self.__sharding = sharding
+        self.__scheduling = scheduling
+        self.__small_lane = small_lane
+        self.__cost_model = cost_model
+        self.__profiling = profiling
+        self.__output = output
+        self.__block_size = block_size
+        self.__dedupe = dedupe
+        self.__pool = None
+        self.__patterns = ['*.htm', '*.html']
+
+        if patterns is not None:
+            self.__patterns = patterns
+
+    @property
+    def actions(self):
+        return self.__actions
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    @workers.setter
+    def workers(self, value):
+        self.__workers = value
+
+    @property
+    def backend(self):
+        return self.__backend
+
+    @property
+    def deadline(self):
+        return self.__deadline
+
+    @property
+    def rule_timeout(self):
+        return self.__rule_timeout
+
+    @property
+    def shard(self):
+        return self.__shard
+
+    @property
+    def sharding(self):
+        return self.__sharding
+
+    @property
+    def scheduling(self):
+        return self.__scheduling
+
+    @property
+    def small_lane(self):
+        return self.__small_lane
+
+    @property
+    def cost_model(self):
+        return self.__cost_model
+
+    @property
+    def profiling(self):
+        return self.__profiling
+
+    @property
+    def output(self):
+        return self.__output
+
+    @property
+    def block_size(self):
+        return self.__block_size
+
+    @property
+    def dedupe(self):
+        return self.__dedupe
+
+    @property
+    def patterns(self):
+        return self.__patterns
+
+    def __enter__(self):
+        if self._pooled():
+            self.__pool = self._pool(self._initargs(True))
+            self.__pool.__enter__()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__pool is not None:
+            self.__pool.__exit__(exc_type, exc_value, traceback)
+            self.__pool = None
+
+    def _pooled(self):
+        """Return ``True`` if documents are processed by the worker
+        pool rather than within the current process.
+
+        """
+        return self.workers != 1 or self._limited()
+
+    def _limited(self):
+        """Return ``True`` if the worker pool enforces a
+        :attr:`deadline` or :attr:`rule_timeout`.
+
+        """
+        return self.deadline is not None or self.rule_timeout is not None
+
+    def _initargs(self, simulate):
+        return (self.actions,
+                simulate,
+                self.backend,
+                self.profiling,
+                self.output,
+                self.block_size,
+                self._limited())
+
+    def _pool(self, initargs):
+        return baip_munger.pool.WorkerPool(processes=self.workers,
+                                           initializer=_init_pool_worker,
+                                           initargs=initargs,
+                                           deadline=self.deadline,
+                                           stage_budget=self.rule_timeout,
+                                           small_lane=self.small_lane)
+
+    def matches(self, filename):
+        """Return ``True`` if *filename* matches :attr:`patterns`.
+
+        """
+        for pattern in self.patterns:
+            if fnmatch.fnmatch(filename, pattern):
+                return True
+
+        return False
+
+    def source_files(self, staged_dir):
+        """Recursively search *staged_dir* for files that match
+        :attr:`patterns` and belong to :attr:`shard`.
+
+        **Args:**
+            *staged_dir*: top level directory of the staged documents
+
+        **Returns:**
+            sorted list of file paths relative to *staged_dir*
+
+        """
+        files = []
+
+        for dirpath, dirnames, filenames in os.walk(staged_dir):
+            for filename in filenames:
+                if self.matches(filename):
+                    path = os.path.join(dirpath, filename)
+                    files.append(os.path.relpath(path, staged_dir))
+
+        files.sort()
+
+        if self.shard is not None:
+            sizes = None
+            if self.sharding == 'size':
+                sizes = dict((x, os.path.getsize(os.path.join(staged_dir, x)))
+                             for x in files)
+            files = baip_munger.shard.select(files,
+                                             self.shard[0],
+                                             self.shard[1],
+                                             method=self.sharding,
+                                             sizes=sizes)
+
+        return files
+
+    def _execute(self, worker, items, simulate=True, quarantined=None):
+        """Run *worker* against each of *items* and yield the results
+        in completion order.
+
+        Items that exceed :attr:`deadline` or :attr:`rule_timeout` are
+        not yielded but appended to the *quarantined* list as a
+        dictionary of the form::
+
+            {'item': <item>, 'rule': <rule_id>, 'reason': <str>,
+             'elapsed': <seconds>}
+
+        """
+        initargs = self._initargs(simulate)
+        if not self._pooled():
+            _init_worker(*initargs)
+            for item in items:
+                yield worker(item)
+        else:
+            def on_timeout(item, stage, reason, elapsed):
+                if quarantined is not None:
+                    quarantined.append({'item': item,
+                                        'rule': stage,
+                                        'reason': reason,
+                                        'elapsed': elapsed})
+
+            pool = self.__pool
+            if pool is None or pool.initargs != initargs:
+                pool = self._pool(initargs)
+
+            for result in pool.imap_unordered(worker, items, on_timeout):
+                yield result
+
+    @staticmethod
+    def _quarantine_report(quarantined, staged_file):
+        """Convert the *quarantined* list built by :meth:`_execute` into
+        the report form keyed by ``file``.
+
+        """
+        report = []
+        for entry in quarantined:
+            entry = dict(entry)
+            entry['file'] = staged_file(entry.pop('item'))
+            report.append(entry)
+
+        report.sort(key=lambda x: x['file'])
+
+        return report
+
+    def _items(self, staged_dir, munged_dir):
+        """Pair each staged document under *staged_dir* with its munged
+        target (or targets) under *munged_dir* and create the target
+        directories.
+
+        """
+        munged_dirs = munged_dir
+        if not isinstance(munged_dir, list):
+            munged_dirs = [munged_dir]
+
+        items = []
+        for relpath in self.source_files(staged_dir):
+            munged_files = []
+            for munged_dir_path in munged_dirs:
+                munged_file = os.path.join(munged_dir_path, relpath)
+                munged_path = os.path.dirname(munged_file)
+                if not os.path.isdir(munged_path):
+                    os.makedirs(munged_path)
+                munged_files.append(munged_file)
+
+            if not isinstance(munged_dir, list):
+                munged_files = munged_files[0]
+
+            items.append((os.path.join(staged_dir, relpath), munged_files))
+
+        return items
+
+    def munge(self, staged_dir, munged_dir):
+        """Munge all documents under *staged_dir* and deposit them to
+        the same relative path under *munged_dir*.
+
+        If :attr:`actions` is a list of plans then *munged_dir* must be
+        a matching list of directories, one per rendition.  Each
+        document is parsed once for all renditions.
+
+        **Args:**
+            *staged_dir*: top level directory of the staged documents
+
+            *munged_dir*: top level directory of the munged documents
+            (or list of directories)
+
+        **Returns:**
+            dictionary of the form::
+
+                {'documents': <int>,
+                 'munged': <int>,
+                 'failed': [...],
+                 'quarantined': [{'file': <staged_file>,
+                                  'rule': <rule_id>,
+                                  'reason': <str>,
+                                  'elapsed': <seconds>}, ...]}
+
+            Partial output of a quarantined document is removed.  With
+            :attr:`dedupe` set the summary also holds the groups of
+            staged documents with the same content::
+
+                'duplicates': [{'digest': <sha1>,
+                                'file': <staged_file>,
+                                'copies': [<staged_file>, ...]}, ...]
+
+            Each of *copies* shares the outcome of *file*
+
+        """
+        return self.munge_files(self._items(staged_dir, munged_dir))
+
+    def _schedule(self, items, sizes):
+        """Order *items* by decreasing predicted cost.
+
+        """
+        def cost(item):
+            staged_file = item[0]
+            size = sizes[staged_file]
+            if self.cost_model is not None:
+                return self.cost_model.predict(staged_file, size)
+
+            return size
+
+        return sorted(items, key=cost, reverse=True)
+
+    @staticmethod
+    def _dedupe(items, sizes):
+        """Split *items* into those to munge and the duplicates of
+        each.
+
+        **Returns:**
+            tuple of the form ``(<items>, <copies>, <groups>)`` where
+            *copies* maps the staged file of each munged item to its
+            duplicate items and *groups* is the summary form as per
+            :meth:`munge`
+
+        """
+        by_file = dict((x[0], x) for x in items)
+        duplicates = baip_munger.dedupe.group([x[0] for x in items], sizes)
+
+        copies = {}
+        groups = []
+        for digest, staged_files in duplicates.iteritems():
+            copies[staged_files[0]] = [by_file[x] for x in staged_files[1:]]
+            groups.append({'digest': digest,
+                           'file': staged_files[0],
+                           'copies': staged_files[1:]})
+
+        skipped = set()
+        for duplicate_items in copies.itervalues():
+            skipped.update(x[0] for x in duplicate_items)
+        items = [x for x in items if x[0] not in skipped]
+
+        return (items, copies, groups)
+
+    @staticmethod
+    def _clone(item, duplicate_items, methods):
+        """Write the munged output of *item* to the munged paths of
+        each of *duplicate_items* and count the clone method used in
+        the *methods* dictionary.
+
+        **Returns:**
+            list of ``(<staged_file>, <error>)`` tuples where *error*
+            is ``None`` if the output was written
+
+        """
+        munged_files = item[1]
+        if not isinstance(munged_files, list):
+            munged_files = [munged_files]
+
+        results = []
+        for staged_file, targets in duplicate_items:
+            if not isinstance(targets, list):
+                targets = [targets]
+
+            error = None
+            try:
+                for munged_file, target in zip(munged_files, targets):
+                    method = baip_munger.dedupe.clone(munged_file, target)
+                    methods[method] = methods.get(method, 0) + 1
+            except (IOError, OSError) as err:
+                log.error('Copy of "%s" to "%s" failed: %s' %
+                          (item[0], staged_file, err))
+                error = str(err)
+            results.append((staged_file, error))
+
+        return results
+
+    def munge_files(self, items, on_result=None):
+        """Munge each ``(<staged_file>, <munged_file>)`` pair in
+        *items*.  *munged_file* can be a list of paths, one per
+        rendition.  Target directories must already exist.
+
+        If set, *on_result* is called for each document as
+        ``on_result(staged_file, status, elapsed, error)``.
+
+        **Returns:**
+            summary dictionary as per :meth:`munge`
+
+        """
+        sizes = {}
+        for staged_file, _ in items:
+            try:
+                sizes[staged_file] = os.path.getsize(staged_file)
+            except OSError:
+                sizes[staged_file] = 0
+
+        summary = {'documents': len(items), 'munged': 0, 'failed': []}
+
+        copies = {}
+        methods = {}
+        if self.dedupe:
+            items, copies, summary['duplicates'] = self._dedupe(items, sizes)
+        by_file = dict((x[0], x) for x in items)
+
+        if self.scheduling == 'size' and self._pooled():
+            items = self._schedule(items, sizes)
+
+        read_bytes = baip_munger.munger.BYTES.value(direction='read')
+        start = time.time()
+
+        quarantined = []
+        results = self._execute(_munge_worker,
+                                items,
+                                quarantined=quarantined)
+        for staged_file, status, metrics, seconds, error in results:
+            METRICS.merge(metrics)
+            if on_result is not None:
+                on_result(staged_file, status, seconds, error)
+            if status and self.cost_model is not None:
+                self.cost_model.observe(staged_file,
+                                        sizes[staged_file],
+                                        seconds)
+            if status:
+                summary['munged'] += 1
+            else:
+                summary['failed'].append(staged_file)
+
+            duplicate_items = copies.get(staged_file, [])
+            if status:
+                cloned = self._clone(by_file[staged_file],
+                                     duplicate_items,
+                                     methods)
+            else:
+                cloned = [(x[0], 'duplicate of %s: %s' % (staged_file,
+                                                          error))
+                          for x in duplicate_items]
+            for duplicate_file, duplicate_error in cloned:
+                if duplicate_error is None:
+                    summary['munged'] += 1
+                else:
+                    summary['failed'].append(duplicate_file)
+                if on_result is not None:
+                    on_result(duplicate_file,
+                              duplicate_error is None,
+                              0.0,
+                              duplicate_error)
+
+        elapsed = time.time() - start
+        if elapsed > 0:
+            read_bytes = (baip_munger.munger.BYTES.value(direction='read') -
+                          read_bytes)
+            DOCUMENTS_PER_SECOND.set(summary['munged'] / elapsed)
+            BYTES_PER_SECOND.set(read_bytes / elapsed)
+
+        for entry in list(quarantined):
+            for duplicate_item in copies.get(entry['item'][0], []):
+                duplicate = dict(entry)
+                duplicate['item'] = duplicate_item
+                quarantined.append(duplicate)
+
+        for entry in quarantined:
+            munged_files = entry['item'][1]
+            if not isinstance(munged_files, list):
+                munged_files = [munged_files]
+            for munged_file in munged_files:
+                temp_file = munged_file + baip_munger.munger.TEMP_SUFFIX
+                for path in (munged_file, temp_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        summary['quarantined'] = self._quarantine_report(quarantined,
+                                                         lambda x: x[0])
+        if on_result is not None:
+            for entry in summary['quarantined']:
+                on_result(entry['file'],
+                          False,
+                          entry['elapsed'],
+                          'quarantined (%s) at %s' % (entry['reason'],
+                                                      entry['rule']))
+
+        summary['failed'].sort()
+        log.info('Batch munge summary: %d of %d documents munged '
+                 '(%d quarantined)' %
+                 (summary['munged'],
+                  summary['documents'],
+                  len(summary['quarantined'])))
+        if copies:
+            log.info('Batch munge duplicates: %d groups, %s' %
+                     (len(copies),
+                      ', '.join('%d by %s' % (methods[x], x)
+                                for x in baip_munger.dedupe.METHODS
+                                if x in methods) or 'none written'))
+
+        return summary
+
+    def enqueue(self, queue, staged_dir, munged_dir):
+        """Add the documents under *staged_dir* to the
+        :class:`baip_munger.jobs.JobQueue` *queue*.  See :meth:`munge`
+        for *munged_dir*.
+
+        **Returns:**
+            number of new jobs
+
+        """
+        return queue.add(self._items(staged_dir, munged_dir))
+
+    def munge_queue(self, queue, chunk_size=None):
+        """Munge the ``pending`` jobs of the
+        :class:`baip_munger.jobs.JobQueue` *queue* and record each
+        outcome in the queue.
+
+        Jobs are claimed *chunk_size* at a time (default: four per
+        worker) so that other processes can pull from the same queue.
+        With :attr:`dedupe` set, duplicates are found within each
+        chunk.
+
+        **Returns:**
+            summary dictionary as per :meth:`munge` for the jobs
+            munged by this call
+
+        """
+        if chunk_size is None:
+            chunk_size = 4 * (self.workers or multiprocessing.cpu_count())
+
+        summary = {'documents': 0,
+                   'munged': 0,
+                   'failed': [],
+                   'quarantined': []}
+
+        warm = self.__pool is None
+        if warm:
+            self.__enter__()
+        try:
+            while True:
+                items = queue.claim(chunk_size)
+                if not items:
+                    break
+
+                result = self.munge_files(items, on_result=queue.finish)
+                if 'duplicates' in result:
+                    summary.setdefault('duplicates', [])
+                    summary['duplicates'].extend(result['duplicates'])
+                summary['documents'] += result['documents']
+                summary['munged'] += result['munged']
+                summary['failed'].extend(result['failed'])
+                summary['quarantined'].extend(result['quarantined'])
+        finally:
+            if warm:
+                self.__exit__(None, None, None)
+
+        summary['failed'].sort()
+        summary['quarantined'].sort(key=lambda x: x['file'])
+
+        return summary
+
+    def dry_run(self, staged_dir, simulate=True):
+        """Report per-rule match counts for all documents under
+        *staged_dir* without writing any output.
+
+        See :meth:`baip_munger.Munger.dry_run` for the meaning of
+        *simulate*.
+
+        **Args:**
+            *staged_dir*: top level directory of the staged documents
+            (or a single document)
+
+            *simulate*: apply tree changes between rules
+
+        **Returns:**
+            dictionary of the form::
+
+                {
+                    'documents': <int>,
+                    'failed': [...],
+                    'quarantined': [...],
+                    'rules': OrderedDict(
+                        '<rule_id>': {'xpath': '<xpath>',
+                                      'matches': <int>,
+                                      'documents': <int>},
+                        ...
+                    )
+                }
+
+            where *rules* is in plan order and includes rules that
+            never matched.  *quarantined* is as per :meth:`munge`
+
+        """
+        if os.path.isdir(staged_dir):
+            items = [os.path.join(staged_dir, x)
+                     for x in self.source_files(staged_dir)]
+        else:
+            items = [staged_dir]
+
+        rules = collections.OrderedDict()
+        plan = baip_munger.munger.Munger.plan_rules(self.actions)
+        for rule_id, method, rule in plan:
+            rules[rule_id] = {'xpath': rule.get('xpath'),
+                              'matches': 0,
+                              'documents': 0}
+
+        report = {'documents': len(items), 'failed': [], 'rules': rules}
+        quarantined = []
+        for staged_file, counts in self._execute(_dry_run_worker,
+                                                 items,
+                                                 simulate=simulate,
+                                                 quarantined=quarantined):
+            if counts is None:
+                report['failed'].append(staged_file)
+                continue
+
+            for rule_id, xpath, count in counts:
+                rules[rule_id]['matches'] += count
+                if count:
+                    rules[rule_id]['documents'] += 1
+
+        report['quarantined'] = self._quarantine_report(quarantined,
+                                                        lambda x: x)
+        report['failed'].sort()
+
+        return report
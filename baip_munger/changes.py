@@ -0,0 +1,137 @@
+import json
+import hashlib
+import lxml.html
+import lxml.etree
+
+__all__ = ['OPERATIONS', 'digest', 'dumps', 'loads', 'apply_changes']
+
+# Version of the change set format.
+VERSION = 1
+
+
+def _set(element, name, value):
+    element.attrib[name] = value
+
+
+def _delete(element, name):
+    element.attrib.pop(name)
+
+
+def _clear(element):
+    element.attrib.clear()
+
+
+def _rename(element, tag):
+    element.tag = tag
+
+
+def _text(element, text):
+    element.text = text
+
+
+def _tail(element, tail):
+    element.tail = tail
+
+
+def _replace(element, tag, attributes, text):
+    new_element = lxml.etree.Element(tag)
+    new_element.text = text
+    for name, value in attributes:
+        new_element.attrib[name] = value
+    element.getparent().replace(element, new_element)
+
+
+def _wrap(parent, first, count, tag, index):
+    new_element = lxml.etree.Element(tag)
+    new_element.extend(parent[first:first + count])
+    xml = lxml.etree.XML(lxml.etree.tostring(new_element))
+    parent.insert(index, xml)
+
+
+# Tree operations that a change set is made of.  Each is called with
+# the target node followed by the operation's arguments.
+OPERATIONS = {
+    'set': _set,
+    'delete': _delete,
+    'clear': _clear,
+    'rename': _rename,
+    'text': _text,
+    'tail': _tail,
+    'replace': _replace,
+    'wrap': _wrap,
+}
+
+
+def digest(html):
+    """SHA-1 hex digest of the source *html* that a change set
+    applies to.
+
+    """
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+
+    return hashlib.sha1(html).hexdigest()
+
+
+def dumps(changes, source):
+    """Serialise *changes* as compact JSON.
+
+    **Args:**
+        *changes*: list of ``[<operation>, <path>, <arg>, ...]`` lists
+        as recorded by :class:`baip_munger.Munger`
+
+        *source*: :func:`digest` of the original document
+
+    """
+    change_set = {'version': VERSION, 'source': source, 'changes': changes}
+
+    return json.dumps(change_set, separators=(',', ':'))
+
+
+def loads(data):
+    """Parse the change set serialised by :func:`dumps`.
+
+    **Returns:**
+        tuple of the form ``(<source>, <changes>)``
+
+    **Raises:**
+        :exc:`ValueError` if *data* is not a supported change set
+
+    """
+    change_set = json.loads(data)
+    if (not isinstance(change_set, dict) or
+            change_set.get('version') != VERSION):
+        raise ValueError('Not a version %d change set' % VERSION)
+
+    return (change_set['source'], change_set['changes'])
+
+
+def apply_changes(html, data):
+    """Rebuild the munged document from the original *html* and the
+    change set *data*.
+
+    Each change locates its node by the path recorded against the tree
+    as it stood when the change was made, so changes are replayed in
+    order.
+
+    **Returns:**
+        the munged HTML document as a string
+
+    **Raises:**
+        :exc:`ValueError` if *data* is not a change set of *html*
+
+    """
+    source, changes = loads(data)
+    if digest(html) != source:
+        raise ValueError('Change set does not match the source document')
+
+    root = lxml.html.fromstring(html)
+    tree = root.getroottree()
+    for change in changes:
+        operation, path, args = change[0], change[1], change[2:]
+        nodes = tree.xpath(path)
+        if not nodes:
+            raise ValueError('Change target "%s" not found' % path)
+        OPERATIONS[operation](nodes[0], *args)
+
+    return lxml.html.tostring(tree.getroot())
@@ -0,0 +1,131 @@
+import io
+import os
+import fcntl
+import shutil
+import hashlib
+import collections
+
+import baip_munger.feed
+from logga.log import log
+
+__all__ = ['METHODS', 'digest_file', 'group', 'clone']
+
+# Ways that a duplicate's output is written, cheapest first.
+METHODS = ['link', 'reflink', 'copy']
+
+# Linux FICLONE ioctl: share the extents of one file with another on
+# copy-on-write filesystems (btrfs, XFS).
+FICLONE = 0x40049409
+
+# Temporary suffix of a clone before it is moved into place.
+TEMP_SUFFIX = '.dup'
+
+
+def digest_file(path, block_size=baip_munger.feed.BLOCK_SIZE):
+    """SHA-1 hex digest of the file *path*, read in blocks of
+    *block_size* bytes.  Matches :func:`baip_munger.changes.digest` of
+    the file's content.
+
+    """
+    digest = hashlib.sha1()
+    with io.open(path, 'rb', buffering=0) as in_fh:
+        for block in baip_munger.feed.read_blocks(in_fh, block_size):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def group(paths, sizes=None):
+    """Group *paths* by the digest of their content.
+
+    Only files that share a size with another are read and hashed, so
+    a corpus without duplicates costs a ``stat`` per file.  Files that
+    cannot be read are left ungrouped.
+
+    **Args:**
+        *paths*: iterable of file paths
+
+        *sizes*: optional dictionary of *paths* mapped to their size
+
+    **Returns:**
+        :class:`collections.OrderedDict` of ``<digest>`` mapped to the
+        list of two or more paths with that content, ordered by their
+        first path
+
+    """
+    by_size = collections.OrderedDict()
+    for path in paths:
+        size = None
+        if sizes is not None:
+            size = sizes.get(path)
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError as err:
+                log.warn('Unable to size "%s": %s' % (path, err))
+                continue
+        by_size.setdefault(size, []).append(path)
+
+    groups = {}
+    for size, same_size in by_size.iteritems():
+        if len(same_size) < 2:
+            continue
+
+        for path in same_size:
+            try:
+                digest = digest_file(path)
+            except (IOError, OSError) as err:
+                log.warn('Unable to hash "%s": %s' % (path, err))
+                continue
+            groups.setdefault(digest, []).append(path)
+
+    duplicates = [(sorted(x), digest) for digest, x in groups.iteritems()
+                  if len(x) > 1]
+    duplicates.sort()
+
+    return collections.OrderedDict((d, p) for p, d in duplicates)
+
+
+def _reflink(source, target):
+    with open(source, 'rb') as source_fh:
+        with open(target, 'wb') as target_fh:
+            fcntl.ioctl(target_fh.fileno(), FICLONE, source_fh.fileno())
+
+
+def clone(source, target):
+    """Write the content of *source* to *target* by the cheapest of
+    :data:`METHODS` that the filesystem allows: a hard link, a reflink
+    or a copy.  *target* is replaced atomically.
+
+    A hard link shares the inode of *source*.  This is safe for munged
+    output because it is only ever replaced, never changed in place.
+
+    **Returns:**
+        the method used
+
+    """
+    temp_file = target + TEMP_SUFFIX
+    if os.path.lexists(temp_file):
+        os.remove(temp_file)
+
+    method = None
+    try:
+        os.link(source, temp_file)
+        method = 'link'
+    except OSError as err:
+        log.debug('Hard link "%s" failed: %s' % (target, err))
+
+    if method is None:
+        try:
+            _reflink(source, temp_file)
+            method = 'reflink'
+        except (IOError, OSError) as err:
+            log.debug('Reflink "%s" failed: %s' % (target, err))
+
+    if method is None:
+        shutil.copyfile(source, temp_file)
+        method = 'copy'
+
+    os.rename(temp_file, target)
+
+    return method
@@ -11,15 +11,42 @@ class Error(Exception):
 
 
 class MungerConfigError(Error):
+    """Configuration error identified by *code*.
+
+    Optional keyword *details* (for example, *section*, *description*
+    and *error*) are interpolated into the error message via the
+    code's ``detail`` template and are available as :attr:`details`.
+
+    """
     __error_msgs = {
         1000: {'message': 'Config file not found',
                'help': """A configuration file was provided but could not be sourced on the server"""},
         1001: {'message': 'No config elements have been defined',
-               'help': """A configuration file has not been parsed yet"""}
+               'help': """A configuration file has not been parsed yet"""},
+        1002: {'message': 'Config file is not well-formed XML',
+               'detail': '%(error)s',
+               'help': """The configuration file could not be parsed as XML"""},
+        1003: {'message': 'Config schema validation error',
+               'detail': 'Section %(section)s (%(description)s): %(error)s',
+               'help': """A Section does not conform to the munger.rng schema.  For example, a sectionReplaceTag without a newTag"""},
+        1004: {'message': 'Invalid XPath expression',
+               'detail': 'Section %(section)s (%(description)s): %(error)s',
+               'help': """A Section xpath element could not be compiled"""},
+        1005: {'message': 'Route registry error',
+               'detail': '%(error)s',
+               'help': """The template route registry could not be read or is missing a name or config"""},
+        1006: {'message': 'Invalid regular expression',
+               'detail': 'Section %(section)s (%(description)s): %(error)s',
+               'help': """A sectionRegexReplace regexPattern could not be compiled"""},
     }
 
-    def __init__(self, code=None):
+    def __init__(self, code=None, **details):
+        self.details = details
+
+        msg = None
         msg_code = MungerConfigError.__error_msgs.get(code)
         if msg_code is not None:
             msg = msg_code.get('message')
+            if details and msg_code.get('detail') is not None:
+                msg = '%s: %s' % (msg, msg_code.get('detail') % details)
         super(MungerConfigError, self).__init__(code=code, message=msg)
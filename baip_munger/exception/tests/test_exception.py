@@ -24,3 +24,39 @@ class TestMungerConfigError(unittest2.TestCase):
             expected = '1001: No config elements have been defined'
             msg = 'TestMungerConfigError code 1001: error'
             self.assertEqual(str(received), expected, msg)
+
+    def test_error_code_1003_with_details(self):
+        """Config schema validation error: code 1003 with details.
+        """
+        try:
+            raise baip_munger.exception.MungerConfigError(1003,
+                                                          section=2,
+                                                          description='Tag',
+                                                          error='Banana')
+        except baip_munger.exception.MungerConfigError as received:
+            expected = ('1003: Config schema validation error: '
+                        'Section 2 (Tag): Banana')
+            msg = 'TestMungerConfigError code 1003: error'
+            self.assertEqual(str(received), expected, msg)
+            msg = 'TestMungerConfigError code 1003: details error'
+            self.assertEqual(received.details.get('section'), 2, msg)
+
+    def test_error_code_1004(self):
+        """Invalid XPath expression: code 1004.
+        """
+        try:
+            raise baip_munger.exception.MungerConfigError(1004)
+        except baip_munger.exception.MungerConfigError as received:
+            expected = '1004: Invalid XPath expression'
+            msg = 'TestMungerConfigError code 1004: error'
+            self.assertEqual(str(received), expected, msg)
+
+    def test_error_code_1006(self):
+        """Invalid regular expression: code 1006.
+        """
+        try:
+            raise baip_munger.exception.MungerConfigError(1006)
+        except baip_munger.exception.MungerConfigError as received:
+            expected = '1006: Invalid regular expression'
+            msg = 'TestMungerConfigError code 1006: error'
+            self.assertEqual(str(received), expected, msg)
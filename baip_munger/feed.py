@@ -0,0 +1,266 @@
+import io
+import os
+import re
+import sys
+import time
+import mmap
+import Queue
+import hashlib
+import resource
+import threading
+import lxml.html
+import lxml.etree
+
+from logga.log import log
+
+__all__ = ['BLOCK_SIZE', 'read_blocks', 'map_blocks', 'read_ahead',
+           'parse_file', 'generate', 'peak_memory']
+
+# Bytes read from a staged file and fed to the parser at a time.
+BLOCK_SIZE = 1024 * 1024
+
+# Blocks that the reader thread may read ahead of the parser.
+READ_AHEAD = 4
+
+# Source that :func:`lxml.html.fromstring` parses as a whole document
+# rather than as a fragment.
+FULL_HTML = re.compile(r'\s*<(?:html|!doctype)', re.IGNORECASE)
+
+
+def read_blocks(html_fh, block_size=BLOCK_SIZE):
+    """Generator that reads the binary file object *html_fh* into a
+    single reusable buffer of *block_size* bytes.
+
+    **Returns:**
+        string copy of each block read
+
+    """
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    while True:
+        count = html_fh.readinto(buf)
+        if not count:
+            break
+        yield view[:count].tobytes()
+
+
+def map_blocks(html_fh, block_size=BLOCK_SIZE):
+    """As per :func:`read_blocks` but the blocks are sliced from a
+    read-only memory map of *html_fh*.
+
+    """
+    size = os.fstat(html_fh.fileno()).st_size
+    if not size:
+        return
+
+    mapped = mmap.mmap(html_fh.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        for offset in xrange(0, size, block_size):
+            yield mapped[offset:offset + block_size]
+    finally:
+        mapped.close()
+
+
+def read_ahead(blocks, depth=READ_AHEAD):
+    """Generator that consumes the *blocks* iterable in a reader thread
+    up to *depth* blocks ahead of the caller so that reads overlap with
+    the caller's processing of earlier blocks.
+
+    Errors raised by the reader are raised to the caller.
+
+    """
+    queue = Queue.Queue(depth)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for block in blocks:
+                queue.put((block, None))
+                if stop.is_set():
+                    return
+            queue.put((None, None))
+        except Exception:
+            queue.put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=reader, name='feed-reader')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            block, error = queue.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if block is None:
+                break
+            yield block
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        thread.join()
+
+
+def _tag_blocks(blocks):
+    """Generator that re-splits *blocks* after their last ``>`` so
+    that no block ends inside a tag.  The libxml2 push parser misreads
+    an end tag of a ``script`` element (or a conditional comment) that
+    is split across blocks.
+
+    """
+    pending = ''
+    for block in blocks:
+        if pending:
+            block = pending + block
+        end = block.rfind('>') + 1
+        if end:
+            pending = block[end:]
+            yield block[:end]
+        else:
+            pending = block
+
+    if pending:
+        yield pending
+
+
+def parse_file(html_file, block_size=BLOCK_SIZE, use_mmap=False):
+    """Parse *html_file* by feeding it to the lxml HTML feed parser in
+    blocks of *block_size* bytes as they are read.  Reads overlap with
+    parsing (see :func:`read_ahead`) and the whole file is never held
+    in memory as a string.
+
+    The tree matches that of :func:`lxml.html.fromstring`.  A file that
+    :func:`lxml.html.fromstring` would parse as a fragment (one that
+    does not open with a doctype or ``html`` element) is read whole
+    and parsed as such.
+
+    **Args:**
+        *html_file*: path to the HTML file to parse
+
+        *block_size*: bytes fed to the parser at a time
+
+        *use_mmap*: boolean flag which if set, will slice the blocks
+        from a memory map of the file rather than read them into a
+        reusable buffer
+
+    **Returns:**
+        tuple of the form ``(<root>, <size>, <source>)`` where *size*
+        is the number of bytes read and *source* is the
+        :func:`baip_munger.changes.digest` of the file
+
+    **Raises:**
+        :exc:`IOError` if *html_file* cannot be read and
+        :exc:`lxml.etree.ParserError` if it is empty
+
+    """
+    digest = hashlib.sha1()
+    size = 0
+    parser = None
+    fragments = None
+    with io.open(html_file, 'rb', buffering=0) as html_fh:
+        if use_mmap:
+            blocks = map_blocks(html_fh, block_size)
+        else:
+            blocks = read_blocks(html_fh, block_size)
+
+        for block in _tag_blocks(read_ahead(blocks)):
+            digest.update(block)
+            size += len(block)
+            if parser is None and fragments is None:
+                if FULL_HTML.match(block):
+                    parser = lxml.html.HTMLParser()
+                else:
+                    fragments = []
+
+            if parser is not None:
+                parser.feed(block)
+            else:
+                fragments.append(block)
+
+    if not size:
+        raise lxml.etree.ParserError('Document is empty')
+
+    if parser is not None:
+        root = parser.close()
+    else:
+        log.debug('Fragment "%s" parsed whole' % html_file)
+        root = lxml.html.fromstring(''.join(fragments))
+
+    return (root, size, digest.hexdigest())
+
+
+def generate(html_fh, size):
+    """Write an HTML document of at least *size* bytes of repeated
+    sections, paragraphs, lists and tables to *html_fh*.
+
+    **Returns:**
+        the number of bytes written
+
+    """
+    head = ('<!DOCTYPE html>\n<html><head><title>Generated</title>'
+            '</head><body>\n')
+    section = ('<div class="section" id="s%d"><h2>Section %d</h2>\n'
+               '<p class="MsoNormal"> Paragraph <b>%d</b> text. </p>\n'
+               '<p class="MsoListParagraphCxSpFirst">First</p>\n'
+               '<p class="MsoListParagraphCxSpLast">Last</p>\n'
+               '<table><tr><td>%d</td><td>cell</td></tr></table>\n'
+               '</div>\n')
+    tail = '</body></html>\n'
+
+    html_fh.write(head)
+    written = len(head)
+    index = 0
+    while written + len(tail) < size:
+        chunk = section % (index, index, index, index)
+        html_fh.write(chunk)
+        written += len(chunk)
+        index += 1
+    html_fh.write(tail)
+
+    return written + len(tail)
+
+
+def peak_memory(func, *args):
+    """Call *func* with *args* in a forked child process and measure
+    the child's peak memory.
+
+    **Returns:**
+        tuple of the form ``(<seconds>, <peak>)`` where *peak* is the
+        growth in KiB of the child's maximum resident set size over the
+        size it was forked at
+
+    **Raises:**
+        :exc:`RuntimeError` if *func* fails
+
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.time()
+            func(*args)
+            seconds = time.time() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, '%f %d' % (seconds, peak - base))
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    try:
+        result = os.read(read_fd, 64)
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+    if not result:
+        raise RuntimeError('Measurement of %s failed' % func.__name__)
+
+    seconds, peak = result.split()
+
+    return (float(seconds), int(peak))
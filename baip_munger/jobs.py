@@ -0,0 +1,201 @@
+import os
+import time
+import json
+import errno
+import sqlite3
+import contextlib
+
+from logga.log import log
+
+__all__ = ['JobQueue', 'STATES']
+
+# Job states in lifecycle order.
+STATES = ['pending', 'running', 'done', 'failed']
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    staged_file TEXT PRIMARY KEY,
+    munged_file TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    pid INTEGER,
+    started REAL,
+    finished REAL,
+    elapsed REAL,
+    error TEXT
+)"""
+
+INDEX = """CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)"""
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+
+    return True
+
+
+class JobQueue(object):
+    """Track the state of each document of a batch run in the SQLite
+    database at *path* so that an interrupted run can be resumed.
+
+    Each job moves from ``pending`` to ``running`` when claimed and on
+    to ``done`` or ``failed`` with its elapsed time and error text.
+    Several local processes can claim jobs from the same database.
+
+    """
+    def __init__(self, path):
+        self.__path = path
+        self.__conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute(SCHEMA)
+        self.__conn.execute(INDEX)
+
+    @property
+    def path(self):
+        return self.__path
+
+    def close(self):
+        self.__conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front so
+        that concurrent claims never interleave.
+
+        """
+        self.__conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except Exception:
+            self.__conn.execute('ROLLBACK')
+            raise
+        self.__conn.execute('COMMIT')
+
+    def clear(self):
+        """Remove all jobs.
+
+        """
+        self.__conn.execute('DELETE FROM jobs')
+
+    def add(self, items):
+        """Queue each ``(<staged_file>, <munged_file>)`` pair in *items*
+        as ``pending``.  Documents already known to the queue keep
+        their state.
+
+        **Returns:**
+            number of new jobs
+
+        """
+        before = self.__conn.total_changes
+        with self._transaction():
+            self.__conn.executemany('INSERT OR IGNORE INTO jobs '
+                                    '(staged_file, munged_file) '
+                                    'VALUES (?, ?)',
+                                    ((x, json.dumps(y)) for x, y in items))
+
+        return self.__conn.total_changes - before
+
+    def release_stale(self):
+        """Return ``running`` jobs whose owning process has gone back to
+        ``pending``.
+
+        **Returns:**
+            number of released jobs
+
+        """
+        released = 0
+        with self._transaction():
+            rows = self.__conn.execute('SELECT DISTINCT pid FROM jobs '
+                                       "WHERE state = 'running'")
+            for pid, in rows.fetchall():
+                if pid is not None and _alive(pid):
+                    continue
+                cursor = self.__conn.execute("UPDATE jobs "
+                                             "SET state = 'pending' "
+                                             "WHERE state = 'running' "
+                                             "AND pid IS ?", (pid,))
+                released += cursor.rowcount
+
+        if released:
+            log.info('Released %d stale running jobs' % released)
+
+        return released
+
+    def retry_failed(self):
+        """Return ``failed`` jobs to ``pending``.
+
+        **Returns:**
+            number of jobs to retry
+
+        """
+        with self._transaction():
+            cursor = self.__conn.execute("UPDATE jobs "
+                                         "SET state = 'pending' "
+                                         "WHERE state = 'failed'")
+
+        return cursor.rowcount
+
+    def claim(self, limit):
+        """Atomically move up to *limit* ``pending`` jobs to ``running``
+        for this process.
+
+        **Returns:**
+            list of ``(<staged_file>, <munged_file>)`` pairs
+
+        """
+        with self._transaction():
+            rows = self.__conn.execute('SELECT staged_file, munged_file '
+                                       'FROM jobs '
+                                       "WHERE state = 'pending' "
+                                       'ORDER BY staged_file '
+                                       'LIMIT ?', (limit,)).fetchall()
+            self.__conn.executemany("UPDATE jobs SET state = 'running', "
+                                    'attempts = attempts + 1, '
+                                    'pid = ?, started = ?, '
+                                    'finished = NULL, error = NULL '
+                                    'WHERE staged_file = ?',
+                                    ((os.getpid(), time.time(), x)
+                                     for x, _ in rows))
+
+        return [(x, json.loads(y)) for x, y in rows]
+
+    def finish(self, staged_file, status, elapsed=None, error=None):
+        """Record the outcome of the *staged_file* job.
+
+        """
+        state = 'done' if status else 'failed'
+        self.__conn.execute('UPDATE jobs SET state = ?, finished = ?, '
+                            'elapsed = ?, error = ? '
+                            'WHERE staged_file = ?',
+                            (state, time.time(), elapsed, error,
+                             staged_file))
+
+    def counts(self):
+        """Number of jobs in each of :data:`STATES`.
+
+        """
+        counts = dict((x, 0) for x in STATES)
+        rows = self.__conn.execute('SELECT state, COUNT(*) FROM jobs '
+                                   'GROUP BY state')
+        counts.update(rows.fetchall())
+
+        return counts
+
+    def jobs(self, state=None):
+        """Return the jobs, optionally in *state*, as dictionaries.
+
+        """
+        sql = ('SELECT staged_file, state, attempts, elapsed, error '
+               'FROM jobs')
+        args = ()
+        if state is not None:
+            sql += ' WHERE state = ?'
+            args = (state,)
+        sql += ' ORDER BY staged_file'
+
+        keys = ['staged_file', 'state', 'attempts', 'elapsed', 'error']
+
+        return [dict(zip(keys, x))
+                for x in self.__conn.execute(sql, args).fetchall()]
@@ -0,0 +1,315 @@
+import os
+import time
+import threading
+import BaseHTTPServer
+
+from logga.log import log
+
+__all__ = ['Registry', 'Counter', 'Gauge', 'Histogram', 'REGISTRY']
+
+# Default latency buckets in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return (unicode(value).replace('\\', '\\\\')
+                          .replace('"', '\\"')
+                          .replace('\n', '\\n'))
+
+
+def _labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (x, _escape(y)) for x, y in pairs)
+
+
+class Metric(object):
+    """Base class for a named metric with optional label names.
+
+    Samples are keyed by the tuple of label values in *labelnames*
+    order.
+
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), lock=None):
+        self.__name = name
+        self.__help = help
+        self.__labelnames = tuple(labelnames)
+        self._lock = lock or threading.Lock()
+        self._samples = {}
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def help(self):
+        return self.__help
+
+    @property
+    def labelnames(self):
+        return self.__labelnames
+
+    def _key(self, labels):
+        return tuple(labels.get(x, '') for x in self.labelnames)
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            samples = dict(self._samples)
+            if reset:
+                self._samples = {}
+
+        return samples
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._samples.get(self._key(labels), 0)
+
+    def merge(self, samples):
+        with self._lock:
+            for key, value in samples.iteritems():
+                self._samples[key] = self._samples.get(key, 0) + value
+
+    def expose(self):
+        lines = []
+        for key, value in sorted(self._samples.items()):
+            lines.append('%s%s %r' % (self.name,
+                                      _labels(self.labelnames, key),
+                                      float(value)))
+
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._samples[self._key(labels)] = value
+
+    def merge(self, samples):
+        with self._lock:
+            self._samples.update(samples)
+
+
+class Histogram(Metric):
+    """Cumulative histogram.  Each sample is a list of per-bucket
+    counts followed by the observation sum and count.
+
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), lock=None,
+                 buckets=BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames, lock)
+        self.__buckets = tuple(buckets)
+
+    @property
+    def buckets(self):
+        return self.__buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = [0] * (len(self.buckets) + 2)
+                self._samples[key] = sample
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def count(self, **labels):
+        sample = self._samples.get(self._key(labels))
+
+        return sample[-1] if sample is not None else 0
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            samples = dict((x, list(y)) for x, y in self._samples.items())
+            if reset:
+                self._samples = {}
+
+        return samples
+
+    def merge(self, samples):
+        with self._lock:
+            for key, value in samples.iteritems():
+                sample = self._samples.get(key)
+                if sample is None:
+                    self._samples[key] = list(value)
+                else:
+                    self._samples[key] = [x + y for x, y in zip(sample,
+                                                                value)]
+
+    def expose(self):
+        lines = []
+        for key, sample in sorted(self._samples.items()):
+            for index, bound in enumerate(self.buckets):
+                le = ('le', repr(float(bound)))
+                lines.append('%s_bucket%s %r' % (self.name,
+                                                 _labels(self.labelnames,
+                                                         key,
+                                                         le),
+                                                 float(sample[index])))
+            labels = _labels(self.labelnames, key, ('le', '+Inf'))
+            lines.append('%s_bucket%s %r' % (self.name,
+                                             labels,
+                                             float(sample[-1])))
+            labels = _labels(self.labelnames, key)
+            lines.append('%s_sum%s %r' % (self.name, labels,
+                                          float(sample[-2])))
+            lines.append('%s_count%s %r' % (self.name, labels,
+                                            float(sample[-1])))
+
+        return lines
+
+
+class Registry(object):
+    """In-process registry of :class:`Counter`, :class:`Gauge` and
+    :class:`Histogram` metrics that can be exported in the Prometheus
+    text exposition format.
+
+    Worker processes can ship their samples to the parent via
+    :meth:`snapshot` and :meth:`merge`.
+
+    """
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labelnames, **kwargs)
+                self.__metrics[name] = metric
+
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        return self._register(Histogram, name, help, labelnames,
+                              buckets=buckets)
+
+    def snapshot(self, reset=False):
+        """Return the samples of all metrics as a picklable dictionary.
+        If *reset* is ``True`` the samples are cleared.
+
+        """
+        return dict((x, y.snapshot(reset))
+                    for x, y in self.__metrics.items())
+
+    def merge(self, snapshot):
+        """Add the samples in *snapshot* as generated by
+        :meth:`snapshot` to this registry.  Metrics are only merged if
+        registered in this process.
+
+        """
+        for name, samples in snapshot.iteritems():
+            metric = self.__metrics.get(name)
+            if metric is not None:
+                metric.merge(samples)
+
+    def expose(self):
+        """Render all metrics in the Prometheus text exposition format.
+
+        """
+        lines = []
+        for name, metric in sorted(self.__metrics.items()):
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            lines.extend(metric.expose())
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically write the :meth:`expose` output to *path*
+        (suitable for the node exporter textfile collector).
+
+        """
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as out_fh:
+            out_fh.write(self.expose().encode('utf-8'))
+        os.rename(temp_path, path)
+
+    def serve(self, port, address=''):
+        """Serve the :meth:`expose` output over HTTP on *port* from a
+        daemon thread.
+
+        **Returns:**
+            the :class:`BaseHTTPServer.HTTPServer` instance.  Call its
+            ``shutdown()`` method to stop serving
+
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.expose().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics request: %s' % (format % args))
+
+        server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        log.info('Serving metrics on port %d' % server.server_port)
+
+        return server
+
+
+class Timer(object):
+    """Context manager that observes the elapsed wall time in seconds
+    against *histogram* with *labels*.
+
+    """
+    def __init__(self, histogram, **labels):
+        self.__histogram = histogram
+        self.__labels = labels
+        self.elapsed = None
+
+    def __enter__(self):
+        self.__start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.time() - self.__start
+        self.__histogram.observe(self.elapsed, **self.__labels)
+
+
+REGISTRY = Registry()
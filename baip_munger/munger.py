@@ -1,79 +1,413 @@
+import os
+import re
+import copy
+import time
+import multiprocessing.pool
 import lxml.html
 import lxml.etree
 import lxml.html.builder
 
+import baip_munger.metrics
+import baip_munger.plan
+import baip_munger.changes
+import baip_munger.splice
+import baip_munger.feed
 from logga.log import log
 
-__all__ = ['Munger']
+__all__ = ['Munger', 'Document', 'ACTIONS']
 
+# Action plan keys as produced by
+# :meth:`baip_munger.XpathGen.parse_configuration` mapped to the
+# :class:`Munger` method that actions each rule.  Order is significant
+# as it defines the sequence in which rules are applied to a document.
+ACTIONS = [(x.KEY, x.METHOD) for x in baip_munger.plan.ACTION_CLASSES]
+
+METRICS = baip_munger.metrics.REGISTRY
+DOCUMENTS = METRICS.counter('baip_munger_documents_total',
+                            'Documents processed by Munger.munge',
+                            ['status'])
+BYTES = METRICS.counter('baip_munger_bytes_total',
+                        'HTML bytes read from staged and written to munged',
+                        ['direction'])
+DOCUMENT_SECONDS = METRICS.histogram('baip_munger_document_seconds',
+                                     'Per-document Munger.munge latency')
+ACTION_SECONDS = METRICS.histogram('baip_munger_action_seconds',
+                                   'Time spent applying each action type',
+                                   ['action'])
+# Suffix of the temporary file used for atomic writes.
+TEMP_SUFFIX = '.tmp'
+
+# Munge output modes: the munged document, the change set that
+# rebuilds it from the staged document or the munged document spliced
+# into the staged document.
+OUTPUTS = ['html', 'changes', 'splice']
+
+ERRORS = METRICS.counter('baip_munger_errors_total',
+                         'Errors by munge stage or action type',
+                         ['stage'])
+SKIPPED = METRICS.counter('baip_munger_rules_skipped_total',
+                          'Rules skipped because a when guard failed')
+
+# Compiled XPath of each expression evaluated by the Munger.
+XPATHS = {}
+
+# Namespace prefixes available to config XPath expressions.  ``re``
+# selects the EXSLT regular expression functions (for example,
+# ``//p[re:test(., '^\s*\d+\.')]``).
+NAMESPACES = {'re': 'http://exslt.org/regular-expressions'}
+
+# Compiled regular expression of each regex_replace pattern.
+PATTERNS = {}
+
+# Attributes read by an XPath expression.
+ATTRIBUTE_REF = re.compile(r'(?:@|attribute::)\s*([\w.:-]+|\*)')
+
+# Munger methods that only change the text of the elements they match.
+TEXT_METHODS = ['strip_char', 'regex_replace']
+
+# Returns the nodes of the $nodes variable in document order without
+# duplicates.
+DOCUMENT_ORDER = lxml.etree.XPath('$nodes')
+
+
+def compile_xpath(expression):
+    """Return the compiled :class:`lxml.etree.XPath` of *expression*.
+    Each expression is compiled once per process.
+
+    """
+    compiled = XPATHS.get(expression)
+    if compiled is None:
+        compiled = lxml.etree.XPath(expression, namespaces=NAMESPACES)
+        XPATHS[expression] = compiled
+
+    return compiled
+
+
+def compile_pattern(pattern):
+    """Return the compiled Unicode regular expression of *pattern*.
+    Each pattern is compiled once per process.
+
+    **Raises:**
+        :exc:`re.error` if *pattern* is not a valid regular expression
+
+    """
+    compiled = PATTERNS.get(pattern)
+    if compiled is None:
+        compiled = re.compile(pattern, re.UNICODE)
+        PATTERNS[pattern] = compiled
+
+    return compiled
+
+
+def compile_guard(expression):
+    """Return the compiled :class:`lxml.etree.XPath` that tests guard
+    *expression*.
+
+    """
+    return compile_xpath('boolean(%s)' % expression)
+
+
+def evaluate_guards(root, guards):
+    """Evaluate each distinct expression of the *guards* tuples (as
+    per :meth:`Munger.plan_steps`) once against the document of *root*.
+
+    **Returns:**
+        dictionary of guard expressions mapped to their Boolean result
+
+    """
+    results = {}
+    tree = root.getroottree()
+    for expressions in guards:
+        for expression in expressions:
+            if expression not in results:
+                results[expression] = compile_guard(expression)(tree)
+
+    return results
+
+
+def read_attributes(xpath):
+    """Return the set of lower case attribute names that *xpath*
+    reads.  ``*`` stands for any attribute.
+
+    """
+    return set(x.lower() for x in ATTRIBUTE_REF.findall(xpath))
+
+
+def read_by_later(steps):
+    """Check for each rule of *steps* (as per :meth:`Munger.plan_steps`)
+    if the XPath expression of a later rule could select differently
+    once the rule is applied.
+
+    An ``update_element_attribute`` rule is only seen by later
+    expressions that read its attribute (or any attribute).  A text
+    change is only seen by later expressions with a predicate or a
+    function call.  Other rules change the tree structure and are seen
+    by any later rule.
+
+    **Returns:**
+        list of Booleans that matches *steps*
+
+    """
+    read = []
+    attributes = set()
+    text = False
+    later = False
+    for rule_id, method, rule, guards in reversed(list(steps)):
+        if method == 'update_element_attribute':
+            names = set([rule['attribute'].lower(), '*'])
+            read.append(bool(names & attributes))
+        elif method in TEXT_METHODS:
+            read.append(text)
+        else:
+            read.append(later)
+
+        later = True
+        for xpath in [rule['xpath']] + list(rule.get('context') or []):
+            attributes |= read_attributes(xpath)
+            text = text or '[' in xpath or '(' in xpath
+
+    read.reverse()
+
+    return read
+
+
+def _instrument(action, func, *args, **kwargs):
+    """Call *func* and record its elapsed time and errors against
+    the *action* label.
+
+    """
+    try:
+        with baip_munger.metrics.Timer(ACTION_SECONDS, action=action):
+            return func(*args, **kwargs)
+    except Exception:
+        ERRORS.inc(stage=action)
+        raise
+
+
+class Document(object):
+    """Parsed HTML document that the actions of a plan change in place.
+
+    A document holds all of the state of a munge: the tree, the
+    context matches cached by :meth:`select` and the tracked changes.
+    A compiled :class:`baip_munger.Plan` holds none, so one plan can be
+    applied to several documents at once (see
+    :meth:`baip_munger.Plan.apply`), for example from a thread per
+    document.
+
+    Used as a context manager the tree is released on exit (see
+    :meth:`close`)::
+
+        with baip_munger.Document(html) as document:
+            plan.apply(document)
+            munged = document.serialise()
+
+    **Args:**
+        *html*: HTML document as a string or a parsed root element
+
+        *output*: what the changes are tracked for, as per
+        :attr:`Munger.output`
+
+        *source*: :func:`baip_munger.changes.digest` of the source of a
+        parsed root element *html* (see :attr:`source`)
+
+    **Raises:**
+        :exc:`ValueError` on an unknown *output*
+
+    """
+    def __init__(self, html, output='html', source=None):
+        if output not in OUTPUTS:
+            raise ValueError('Unknown munge output "%s"' % output)
+
+        self.__output = output
+        self.__source = source
+        self.__splicer = None
+        self.__contexts = {}
+        self.__changes = []
+
+        if isinstance(html, lxml.etree._Element):
+            self.__root = html
+        else:
+            self.__root = lxml.html.fromstring(html)
+            self.__source = baip_munger.changes.digest(html)
+            if output == 'splice':
+                self.__splicer = baip_munger.splice.Splicer(html)
 
-class Munger(object):
     @property
     def root(self):
         return self.__root
 
-    @root.setter
-    def root(self, value):
-        if value is not None:
-            self.__root = lxml.html.fromstring(value)
+    @property
+    def output(self):
+        return self.__output
+
+    @property
+    def source(self):
+        """:func:`baip_munger.changes.digest` of the HTML string that
+        the document was parsed from.  ``None`` for a document built
+        from a root element without one.
+
+        """
+        return self.__source
 
-    def __init__(self, html=None):
+    @property
+    def changes(self):
+        """List of the ``[<operation>, <path>, <arg>, ...]`` tree
+        changes made to :attr:`root`, as replayed by
+        :func:`baip_munger.changes.apply_changes`.  Only recorded in
+        ``changes`` :attr:`output` mode.
+
+        """
+        return self.__changes
+
+    def copy(self):
+        """Copy of the document with its own deep copy of :attr:`root`
+        that shares the :attr:`source`.  Changes made to the copy are
+        tracked separately.
+
+        """
+        document = Document(copy.deepcopy(self.__root),
+                            self.__output,
+                            self.__source)
+        if self.__splicer is not None:
+            html = self.__splicer.html
+            document.__splicer = baip_munger.splice.Splicer(html)
+
+        return document
+
+    def close(self):
+        """Release the tree, the cached context matches and the tracked
+        changes.  The document can no longer be munged.
+
+        """
         self.__root = None
+        self.__splicer = None
+        self.__contexts = {}
+        self.__changes = []
 
-        if html is not None:
-            self.root = html
+    def __enter__(self):
+        return self
 
-    def dump_root(self, pretty_print=False):
-        root = str()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        if self.root is not None:
-            root = lxml.html.tostring(self.__root,
-                                      pretty_print=pretty_print)
+    def clear_contexts(self):
+        """Drop the context matches cached by :meth:`select`.
 
-        return root
+        """
+        self.__contexts = {}
 
-    @staticmethod
-    def remove_section(html, xpath, root_tag):
-        """Remove a section from *html* based on the *xpath* expression.
+    def _change(self, operation, node, *args):
+        """Apply the :data:`baip_munger.changes.OPERATIONS`
+        *operation* to *node* and record it in :attr:`changes`.
 
-        If *root_tag* is a nested ancestor of the *xpath* expression match
-        then the section removal will stem from this level.
+        """
+        if self.__output == 'changes':
+            path = node.getroottree().getpath(node)
+            self.__changes.append([operation, path] + list(args))
+        elif self.__splicer is not None:
+            self.__splicer.touch(node, operation)
 
-        **Args:**
-            *html*: HTML document as a string
+        baip_munger.changes.OPERATIONS[operation](node, *args)
 
-            *xpath*: standard XPath expression used to query against *html*
+    def serialise(self):
+        """Serialise :attr:`root`.
 
-            *root_tag*: tag name of the ancestor element to remove if
-            a match/matches are produced by *xpath*
+        In ``splice`` :attr:`output` mode with a :attr:`root` parsed
+        from a string only the changed parts of the tree are serialised
+        and the other bytes are copied from the source document (see
+        :class:`baip_munger.splice.Splicer`).  Otherwise as per
+        :meth:`Munger.dump_root`.
+
+        """
+        if self.__splicer is not None:
+            return self.__splicer.serialise(self.__root)
+
+        return lxml.html.tostring(self.__root)
+
+    def _attached(self, element):
+        """Check if *element* is still part of the :attr:`root` tree.
+
+        """
+        while element is not None:
+            if element is self.__root:
+                return True
+            element = element.getparent()
+
+        return False
+
+    def _context(self, context):
+        """Return the elements matched by the *context* chain of XPath
+        expressions where each expression is evaluated relative to the
+        matches of the one before.
+
+        Matches are cached for the current :attr:`root` and reused by
+        later rules that share the *context*.  The context is located
+        again if an earlier rule removed any of the cached matches from
+        the tree.
+
+        """
+        if isinstance(context, basestring):
+            context = [context]
+        key = tuple(context)
+
+        nodes = self.__contexts.get(key)
+        if nodes is None or not all(self._attached(x) for x in nodes):
+            nodes = [self.__root]
+            for expression in context:
+                nodes = self._relative(expression, nodes)
+            self.__contexts[key] = nodes
+            log.debug('Context %s matches: %d' % (key, len(nodes)))
+
+        return nodes
+
+    @staticmethod
+    def _relative(xpath, nodes):
+        """Evaluate *xpath* relative to each of *nodes*.
 
         **Returns:**
-            the resultant HTML document as a string
+            list of matched elements in document order
 
         """
-        root = lxml.html.fromstring(html)
+        relative = compile_xpath(xpath)
+        if len(nodes) == 1:
+            return relative(nodes[0])
 
-        log.debug('Section removal XPath: "%s"' % xpath)
+        matches = []
+        for node in nodes:
+            matches.extend(relative(node))
 
-        for element in root.xpath(xpath):
-            log.debug('Removing element tag: "%s"' % element.tag)
-            if element.tag == root_tag:
-                element.getparent().remove(element)
+        if not matches:
+            return matches
 
-            for ancestor in element.iterancestors():
-                log.debug('Removing ancestor tag: "%s"' % ancestor.tag)
-                ancestor.getparent().remove(ancestor)
-                if ancestor.tag == root_tag:
-                    break
+        return DOCUMENT_ORDER(matches[0], nodes=matches)
 
-        return lxml.html.tostring(root)
+    def select(self, xpath, context=None):
+        """Return the elements of :attr:`root` that match *xpath*.
+
+        **Args:**
+            *xpath*: standard XPath expression used to query against
+            :attr:`root`
+
+            *context*: if not ``None``, list of XPath expressions
+            (outermost first) that locate the nodes *xpath* is relative
+            to
+
+        **Returns:**
+            list of matched elements in document order
+
+        """
+        if context:
+            return self._relative(xpath, self._context(context))
+
+        return compile_xpath(xpath)(self.__root)
 
     def update_element_attribute(self,
                                  xpath,
                                  attribute,
                                  value=None,
                                  old_value=None,
-                                 add=False):
+                                 add=False,
+                                 context=None):
         """Update element *attribute* from *xpath* expression search.
 
         If *value* is ``None`` then the attribute will be deleted.
@@ -96,6 +430,9 @@ class Munger(object):
             *add*: boolean flag which if set, will add the attribute
             if it already not part of the tag definition
 
+            *context*: if not ``None``, context XPath expressions that
+            *xpath* is relative to (see :meth:`select`)
+
         """
         def update_attr(element, attribute, value, old_value):
             log.debug('Updating attr "%s" from tag "%s" with "%s"' %
@@ -103,9 +440,9 @@ class Munger(object):
 
             if old_value is not None:
                 if element.attrib[attribute] == old_value:
-                    element.attrib[attribute] = value
+                    self._change('set', element, attribute, value)
             else:
-                element.attrib[attribute] = value
+                self._change('set', element, attribute, value)
 
         def recursive_update_attr(element, attribute, value, old_value):
             if element.attrib.get(attribute) is not None:
@@ -121,22 +458,22 @@ class Munger(object):
 
         log.debug('Update attribute XPath: "%s"' % xpath)
 
-        for tag in self.root.xpath(xpath):
+        for tag in self.select(xpath, context):
             if value is None:
                 if add:
                     log.debug('Adding attr "%s" from tag "%s"' %
                               (attribute, tag.tag))
-                    tag.attrib[attribute] = str()
+                    self._change('set', tag, attribute, str())
                 elif tag.attrib.get(attribute):
                     log.debug('Removing attr "%s" from tag "%s"' %
                               (attribute, tag.tag))
-                    tag.attrib.pop(attribute)
+                    self._change('delete', tag, attribute)
             else:
                 if add:
                     log.debug('Adding attr "%s" from tag "%s" with "%s"' %
                               (attribute, tag.tag, value))
 
-                    tag.attrib[attribute] = value
+                    self._change('set', tag, attribute, value)
                 # else tag.attrib.get(attribute) is not None:
                 else:
                     recursive_update_attr(tag,
@@ -144,42 +481,62 @@ class Munger(object):
                                           value,
                                           old_value)
 
-    def replace_tag(self, xpath, new_tag, new_tag_attributes=None):
+    def replace_tag(self, xpath, new_tag, new_tag_attributes=None,
+                    flatten=False, context=None):
         """Replace element tag from *xpath* expression search to
         *new_tag*.
 
+        By default the matched element is renamed in place so that its
+        child markup and tail text are preserved.  If *flatten* is
+        ``True`` the element is swapped for a new *new_tag* element
+        that holds only the text content of the match (the tail is
+        dropped).
+
         **Args:**
             *xpath*: standard XPath expression used to query against *html*
 
             *new_tag*: new element tag name to replace
 
             *new_tag_attributes*: list of tuples representing attributes
-            name|value pairs to add to the new tag
+            name|value pairs to add to the new tag.  These replace the
+            existing attributes
+
+            *flatten*: boolean flag which if set, will replace the
+            element with a text only copy
+
+            *context*: if not ``None``, context XPath expressions that
+            *xpath* is relative to (see :meth:`select`)
 
         """
         log.info('Replace element tag XPath: "%s"' % xpath)
 
-        for tag in self.root.xpath(xpath):
+        attributes = []
+        if new_tag_attributes is not None:
+            for name, value in new_tag_attributes:
+                if value is None:
+                    value = str()
+                attributes.append((name, value))
+
+        for tag in self.select(xpath, context):
             log.debug('Replacing element tag "%s" with "%s"' %
                       (tag.tag, new_tag))
-            new_element = lxml.etree.Element(new_tag)
-            new_element.text = tag.text_content()
-
-            if new_tag_attributes is not None and len(new_tag_attributes):
-                for new_tag_attribute in new_tag_attributes:
-                    name, value = new_tag_attribute
-                    if value is None:
-                        value = str()
-                    new_element.attrib[name] = value
+            if not flatten:
+                self._change('rename', tag, new_tag)
+                if attributes:
+                    self._change('clear', tag)
+                    for name, value in attributes:
+                        self._change('set', tag, name, value)
             else:
-                log.debug('Copying over existing attributes: "%s"' %
-                          tag.attrib)
-                for key, value in tag.attrib.iteritems():
-                    new_element.attrib[key] = value
-
-            tag.getparent().replace(tag, new_element)
-
-    def insert_tag(self, xpath, new_tag):
+                if not attributes:
+                    log.debug('Copying over existing attributes: "%s"' %
+                              tag.attrib)
+                self._change('replace',
+                             tag,
+                             new_tag,
+                             attributes or tag.attrib.items(),
+                             tag.text_content())
+
+    def insert_tag(self, xpath, new_tag, context=None):
         """Insert *new_tag* element tag from *xpath* expression search.
 
         Workflow is:
@@ -196,23 +553,27 @@ class Munger(object):
             *new_tag*: new element tag name to replace as a string.
             Method will convert to a :mod:`lxml.etree.Element`
 
-        """
-        def build_xml(new_tag, tags_to_extend):
-            new_element = lxml.etree.Element(new_tag)
-            new_element.extend(tags_to_extend)
-            xml = lxml.etree.XML(lxml.etree.tostring(new_element))
-
-            return xml
+            *context*: if not ``None``, context XPath expressions that
+            *xpath* is relative to (see :meth:`select`)
 
-        def child_xml_insert(start_index, node_count, parent_element, xml):
+        """
+        def wrap(parent_element, tags_to_extend, insert_index):
+            log.info('Child element insert of %d "%s" at index: %d' %
+                     (len(tags_to_extend), new_tag, insert_index))
+            self._change('wrap',
+                         parent_element,
+                         parent_element.index(tags_to_extend[0]),
+                         len(tags_to_extend),
+                         new_tag,
+                         insert_index)
+
+        def child_xml_insert(start_index, node_count, parent_element):
             insert_index = start_index - node_count + 1
-            log.info('Child element insert "%s ..." at index: %d' %
-                     (lxml.html.tostring(xml), insert_index))
-            parent_element.insert(insert_index, xml)
+            wrap(parent_element, tags_to_extend, insert_index)
 
         log.info('Insert element tag XPath: "%s"' % xpath)
 
-        tags = self.root.xpath(xpath)
+        tags = self.select(xpath, context)
         current_parent = None
         prev_index = None
         tags_to_extend = []
@@ -247,17 +608,15 @@ class Munger(object):
             else:
                 log.debug('Parent change: inserting')
 
-            xml = build_xml(new_tag, tags_to_extend)
             if parent != current_parent:
-                current_parent.insert(prev_index - 1, xml)
+                wrap(current_parent, tags_to_extend, prev_index - 1)
                 current_parent = parent
                 log.debug('Set current parent %s:"%s"' %
                           (current_parent, current_parent.tag))
             else:
                 child_xml_insert(prev_index,
                                  len(tags_to_extend),
-                                 current_parent,
-                                 xml)
+                                 current_parent)
 
             # Reset our control variables.
             prev_index = parent.index(tag)
@@ -269,13 +628,11 @@ class Munger(object):
 
         # Insert the laggards (if any).
         if len(tags_to_extend):
-            xml = build_xml(new_tag, tags_to_extend)
             child_xml_insert(prev_index,
                              len(tags_to_extend),
-                             current_parent,
-                             xml)
+                             current_parent)
 
-    def strip_char(self, xpath, chars):
+    def strip_char(self, xpath, chars, context=None):
         """Strip *chars* from *xpath* expression search.
 
         **Args:**
@@ -283,78 +640,655 @@ class Munger(object):
 
             *chars*: characters to strip from the element tag text
 
+            *context*: if not ``None``, context XPath expressions that
+            *xpath* is relative to (see :meth:`select`)
+
         """
         log.info('Strip chars XPath expression: "%s"' % xpath)
 
-        for tag in self.root.xpath(xpath):
+        for tag in self.select(xpath, context):
             for child_tag in tag.iter():
                 if child_tag.text is not None:
                     log.debug('Stipping "%s" from tag "%s" text: "%s"' %
                               (chars, child_tag.tag, child_tag.text))
-                    child_tag.text = child_tag.text.strip(chars)
+                    text = child_tag.text.strip(chars)
+                    if text != child_tag.text:
+                        self._change('text', child_tag, text)
                     log.debug('Resultant text: "%s"' % child_tag.text)
                     if child_tag.tail is not None:
                         log.debug('Stipping tail text: "%s" from "%s"' %
                                   (chars, child_tag.tail))
-                        child_tag.tail = child_tag.tail.strip(chars)
+                        tail = child_tag.tail.strip(chars)
+                        if tail != child_tag.tail:
+                            self._change('tail', child_tag, tail)
                         log.debug('Resultant tail text: "%s"' %
                                   child_tag.tail)
 
+    def regex_replace(self, xpath, pattern, replacement='', context=None):
+        """Replace each match of the regular expression *pattern* in the
+        text of the *xpath* expression matches with *replacement*.
+
+        The text of each element and the tail of each node in a matched
+        subtree (including the match's own tail, as per
+        :meth:`strip_char`) are rewritten in a single walk.  A subtree
+        within an earlier match is not rewritten twice.
+
+        **Args:**
+            *xpath*: standard XPath expression used to query against *html*
+
+            *pattern*: Python regular expression (compiled once per
+            process with :data:`re.UNICODE`, see :func:`compile_pattern`)
+
+            *replacement*: replacement string as per :func:`re.sub`
+
+            *context*: if not ``None``, context XPath expressions that
+            *xpath* is relative to (see :meth:`select`)
+
+        """
+        log.info('Regex replace XPath expression: "%s"' % xpath)
+
+        compiled = compile_pattern(pattern)
+        visited = set()
+        for tag in self.select(xpath, context):
+            if tag in visited:
+                continue
+            for node in tag.iter():
+                visited.add(node)
+                if node.text is not None and isinstance(node.tag, basestring):
+                    text = compiled.sub(replacement, node.text)
+                    if text != node.text:
+                        self._change('text', node, text)
+                if node.tail is not None:
+                    tail = compiled.sub(replacement, node.tail)
+                    if tail != node.tail:
+                        self._change('tail', node, tail)
+
+
+class Munger(object):
+    @property
+    def root(self):
+        if self.__document is None:
+            return None
+
+        return self.__document.root
+
+    @root.setter
+    def root(self, value):
+        if value is not None:
+            self.__document = Document(value, self.__output)
+
+    @property
+    def document(self):
+        """The :class:`Document` of :attr:`root`.  Replaced by each
+        munge.
+
+        """
+        return self.__document
+
+    @property
+    def progress(self):
+        return self.__progress
+
+    @progress.setter
+    def progress(self, value):
+        self.__progress = value
+
+    @property
+    def atomic(self):
+        return self.__atomic
+
+    @atomic.setter
+    def atomic(self, value):
+        self.__atomic = value
+
+    @property
+    def output(self):
+        """What :meth:`munge` writes: ``html`` (the munged document),
+        ``changes`` (the change set of :attr:`changes`) or ``splice``
+        (the munged document with the unchanged parts copied from the
+        source, see :meth:`serialise`).
+
+        """
+        return self.__output
+
+    @property
+    def block_size(self):
+        """If set, the bytes per block that :meth:`munge` feeds
+        staged files to the parser in as they are read rather than
+        reading them whole first.
+
+        """
+        return self.__block_size
+
+    @property
+    def changes(self):
+        """List of the tree changes made to :attr:`root` since it was
+        set (see :attr:`Document.changes`).
+
+        """
+        if self.__document is None:
+            return []
+
+        return self.__document.changes
+
+    def __init__(self, html=None, progress=None, atomic=False,
+                 output='html', block_size=None):
+        if output not in OUTPUTS:
+            raise ValueError('Unknown munge output "%s"' % output)
+
+        self.__document = None
+        self.__progress = progress
+        self.__atomic = atomic
+        self.__output = output
+        self.__block_size = block_size
+
+        if html is not None:
+            self.root = html
+
+    def _report(self, stage):
+        """Pass the current *stage* (for example,
+        ``read``, a rule id or ``write``)
+        to the :attr:`progress` callable, if set.
+
+        """
+        if self.__progress is not None:
+            self.__progress(stage)
+
+    def serialise(self):
+        """Serialise :attr:`root` as per :meth:`Document.serialise`.
+
+        """
+        return self.__document.serialise()
+
+    def dump_root(self, pretty_print=False):
+        root = str()
+
+        if self.root is not None:
+            root = lxml.html.tostring(self.root,
+                                      pretty_print=pretty_print)
+
+        return root
+
+    def select(self, xpath, context=None):
+        """Return the elements of :attr:`root` that match *xpath* (see
+        :meth:`Document.select`).
+
+        """
+        return self.__document.select(xpath, context)
+
+    @staticmethod
+    def remove_section(html, xpath, root_tag):
+        """Remove a section from *html* based on the *xpath* expression.
+
+        If *root_tag* is a nested ancestor of the *xpath* expression match
+        then the section removal will stem from this level.
+
+        **Args:**
+            *html*: HTML document as a string
+
+            *xpath*: standard XPath expression used to query against *html*
+
+            *root_tag*: tag name of the ancestor element to remove if
+            a match/matches are produced by *xpath*
+
+        **Returns:**
+            the resultant HTML document as a string
+
+        """
+        root = lxml.html.fromstring(html)
+
+        log.debug('Section removal XPath: "%s"' % xpath)
+
+        for element in root.xpath(xpath):
+            log.debug('Removing element tag: "%s"' % element.tag)
+            if element.tag == root_tag:
+                element.getparent().remove(element)
+
+            for ancestor in element.iterancestors():
+                log.debug('Removing ancestor tag: "%s"' % ancestor.tag)
+                ancestor.getparent().remove(ancestor)
+                if ancestor.tag == root_tag:
+                    break
+
+        return lxml.html.tostring(root)
+
+    def update_element_attribute(self,
+                                 xpath,
+                                 attribute,
+                                 value=None,
+                                 old_value=None,
+                                 add=False,
+                                 context=None):
+        """Update element *attribute* of :attr:`root` as per
+        :meth:`Document.update_element_attribute`.
+
+        """
+        self.__document.update_element_attribute(xpath,
+                                                 attribute,
+                                                 value=value,
+                                                 old_value=old_value,
+                                                 add=add,
+                                                 context=context)
+
+    def replace_tag(self, xpath, new_tag, new_tag_attributes=None,
+                    flatten=False, context=None):
+        """Replace element tags of :attr:`root` as per
+        :meth:`Document.replace_tag`.
+
+        """
+        self.__document.replace_tag(xpath,
+                                    new_tag,
+                                    new_tag_attributes=new_tag_attributes,
+                                    flatten=flatten,
+                                    context=context)
+
+    def insert_tag(self, xpath, new_tag, context=None):
+        """Insert *new_tag* elements into :attr:`root` as per
+        :meth:`Document.insert_tag`.
+
+        """
+        self.__document.insert_tag(xpath, new_tag, context=context)
+
+    def strip_char(self, xpath, chars, context=None):
+        """Strip *chars* from the elements of :attr:`root` as per
+        :meth:`Document.strip_char`.
+
+        """
+        self.__document.strip_char(xpath, chars, context=context)
+
+    def regex_replace(self, xpath, pattern, replacement='', context=None):
+        """Replace *pattern* matches in the text of :attr:`root` as per
+        :meth:`Document.regex_replace`.
+
+        """
+        self.__document.regex_replace(xpath,
+                                      pattern,
+                                      replacement=replacement,
+                                      context=context)
+
+    @staticmethod
+    def plan_rules(actions):
+        """Generator that flattens the *actions* plan into the sequence
+        in which the rules are applied to a document.
+
+        **Args:**
+            *actions*:
+                the processing actions as generated by the
+                :method:`baip_munger.XpathGen.parse_configuration` method
+
+        **Returns:**
+            tuples of the form ``(<rule_id>, <method_name>, <rule>)``
+            where *rule_id* identifies the rule within the plan (for
+            example, ``replace_tags[0]``) and *method_name* is the
+            :class:`Munger` method that actions the *rule* keywords.
+            ``when`` guards are dropped (see :meth:`plan_steps`)
+
+        """
+        for rule_id, method, rule, _ in Munger.plan_steps(actions):
+            yield (rule_id, method, rule)
+
+    @staticmethod
+    def plan_steps(actions):
+        """As per :meth:`plan_rules` but also yields the ``when``
+        guard expressions that must all hold for a rule to be applied.
+
+        **Returns:**
+            tuples of the form ``(<rule_id>, <method_name>, <rule>,
+            <guards>)`` where *rule* no longer holds the ``when`` key
+            and *guards* is a tuple of XPath expressions
+
+        """
+        if isinstance(actions, baip_munger.plan.Plan):
+            for action in actions:
+                yield (action.rule_id,
+                       action.METHOD,
+                       action.keywords(),
+                       action.when)
+            return
+
+        for action, method in ACTIONS:
+            rules = actions.get(action)
+            if rules is None:
+                continue
+
+            for index, rule in enumerate(rules):
+                guards = ()
+                if 'when' in rule:
+                    rule = dict(rule)
+                    guards = tuple(rule.pop('when'))
+                yield ('%s[%d]' % (action, index), method, rule, guards)
+
+    def apply(self, actions):
+        """Apply *actions* to the :attr:`root` tree.
+
+        **Args:**
+            *actions*:
+                the processing actions as generated by the
+                :method:`baip_munger.XpathGen.parse_configuration` method
+                or a compiled plan that provides a ``transform(root)``
+                method (such as :class:`baip_munger.XsltGen`)
+
+        Rules are applied as per :meth:`baip_munger.Plan.apply`.
+
+        **Raises:**
+            :exc:`ValueError` if a compiled plan is applied in
+            ``changes`` or ``splice`` :attr:`output` mode
+
+        """
+        transform = getattr(actions, 'transform', None)
+        if transform is not None:
+            if self.__output != 'html':
+                raise ValueError('Changes are not tracked through a '
+                                 'compiled plan')
+            self._report('transform')
+            root = _instrument('transform', transform, self.root)
+            self.__document = Document(root, self.__output)
+        else:
+            plan = baip_munger.plan.Plan.from_dict(actions)
+            plan.apply(self.__document, progress=self._report)
+
+    def dry_run(self, actions, staged_file, simulate=True):
+        """Evaluate each rule's XPath expression from *actions* against
+        *staged_file* without serialising or writing the result.
+
+        If *simulate* is ``True`` then each rule is also applied to the
+        in-memory tree so that later rules are evaluated against the
+        tree they would see during a real :meth:`munge`.  Only the
+        rules whose changes a later rule could read are applied (see
+        :func:`read_by_later`).  If *simulate* is ``False`` then all
+        XPath expressions are evaluated against the original
+        document.
+
+        **Args:**
+            *actions*:
+                the processing actions as generated by the
+                :method:`baip_munger.XpathGen.parse_configuration` method
+
+            *staged_file*:
+                absolute path to the HTML file to process
+
+            *simulate*:
+                boolean flag which if set, will apply the tree changes
+                of each rule before evaluating the next
+
+        **Returns:**
+            list of tuples of the form ``(<rule_id>, <xpath>, <count>)``
+            in plan order, including rules that produce no matches.
+            Rules whose ``when`` guard fails report no matches.
+            ``None`` if *staged_file* could not be read
+
+        """
+        log.info('Dry run source file: "%s" ...' % staged_file)
+
+        self.__document = None
+        self._report('read')
+        try:
+            with open(staged_file, 'r') as html_fh:
+                self.root = html_fh.read()
+        except IOError as e:
+            log.error(str(e))
+            return None
+
+        rules = list(self.plan_steps(actions))
+        passed = evaluate_guards(self.root, (x[3] for x in rules))
+        read = read_by_later(rules)
+
+        counts = []
+        for index, (rule_id, method, rule, guards) in enumerate(rules):
+            if not all(passed[x] for x in guards):
+                log.debug('Dry run rule %s skipped: guard failed' % rule_id)
+                counts.append((rule_id, rule.get('xpath'), 0))
+                continue
+
+            self._report(rule_id)
+            count = len(self.select(rule.get('xpath'),
+                                    rule.get('context')))
+            log.debug('Dry run rule %s matches: %d' % (rule_id, count))
+            counts.append((rule_id, rule.get('xpath'), count))
+
+            if simulate and count and read[index]:
+                getattr(self, method)(**rule)
+
+        return counts
+
     def munge(self, actions, staged_file, munged_file):
         """Munge *staged_file* and deposit to *munged_file*
 
+        Several renditions of *staged_file* can be produced from a
+        single parse by passing a list of *actions* plans and a
+        matching list of *munged_file* paths.  Each plan is applied to
+        its own copy of the parsed tree and the renditions are munged
+        and written in parallel threads.
+
         **Args:**
             *actions*:
                 the processing actions as generated by the
                 :method:`baip_munger.XpathGen.parse_configuration` method
+                (or a list of actions, one per rendition)
 
             *staged_file*:
                 absolute path to the HTML file to process
 
             *munged_file*:
-                absolute path to the HTML file to process
+                absolute path to the HTML file to process (or a list of
+                paths, one per rendition)
 
         **Returns:**
             Booelan ``True`` on success.  ``False`` otherwise
 
+        **Raises:**
+            :exc:`ValueError` if a list of *actions* and a list of
+            *munged_file* paths differ in length
+
+        In ``changes`` :attr:`output` mode the change set that
+        rebuilds the munged document from *staged_file* is written to
+        *munged_file* instead of the munged document (see
+        :func:`baip_munger.changes.apply_changes`).
+
+        With a :attr:`block_size` *staged_file* is parsed as it is read
+        (see :meth:`_feed`).
+
+        The munged tree is kept as :attr:`document` after it is written
+        so that it can still be inspected through :attr:`root`.  It is
+        released by the next munge or by closing :attr:`document`.
+
         """
+        if (isinstance(munged_file, (list, tuple)) and
+                len(actions) != len(munged_file)):
+            raise ValueError('%d rendition plans for %d munged files' %
+                             (len(actions), len(munged_file)))
+
         log.info('Munging source file: "%s" ...' % staged_file)
 
         munge_status = False
+        start = time.time()
 
         try:
-            with open(staged_file, 'r') as html_fh:
-                self.root = html_fh.read()
-        except IOError as e:
-            log.error(str(e))
+            self.__document = None
+            self._report('read')
+            try:
+                if self.__block_size and self.__output != 'splice':
+                    self._feed(staged_file)
+                else:
+                    with open(staged_file, 'r') as html_fh:
+                        html = html_fh.read()
+                    BYTES.inc(len(html), direction='read')
+                    self.root = html
+            except IOError as e:
+                ERRORS.inc(stage='read')
+                log.error(str(e))
+
+            if self.root is not None:
+                if isinstance(munged_file, (list, tuple)):
+                    renditions = zip(actions, munged_file)
+                    munge_status = self.munge_renditions(renditions)
+                else:
+                    self.apply(actions)
+                    self._report('write')
+                    self._write_output(munged_file)
+                    munge_status = True
+        finally:
+            DOCUMENT_SECONDS.observe(time.time() - start)
+            if munge_status:
+                DOCUMENTS.inc(status='munged')
+            else:
+                DOCUMENTS.inc(status='failed')
 
-        if self.root is not None:
-            replace_tags_actions = actions.get('replace_tags')
-            if replace_tags_actions is not None:
-                for rule in replace_tags_actions:
-                    self.replace_tag(**rule)
+        log.info('Munge status: %s' % munge_status)
 
-            insert_tags_actions = actions.get('insert_tags')
-            if insert_tags_actions is not None:
-                for rule in insert_tags_actions:
-                    self.insert_tag(**rule)
+        return munge_status
+
+    def _feed(self, staged_file):
+        """Parse *staged_file* into :attr:`root` in blocks of
+        :attr:`block_size` bytes as per
+        :func:`baip_munger.feed.parse_file`.  Not used in ``splice``
+        :attr:`output` mode as the splice needs the whole source.
+
+        """
+        root, size, source = baip_munger.feed.parse_file(staged_file,
+                                                         self.__block_size)
+        BYTES.inc(size, direction='read')
+        self.__document = Document(root, self.__output, source)
 
-            attribute_actions = actions.get('attributes')
-            if attribute_actions is not None:
-                for rule in attribute_actions:
-                    self.update_element_attribute(**rule)
+    def munge_html(self, actions, html):
+        """Munge the in-memory *html* document.
 
-            strip_chars_actions = actions.get('strip_chars')
-            if strip_chars_actions is not None:
-                for rule in strip_chars_actions:
-                    self.strip_char(**rule)
+        **Args:**
+            *actions*:
+                the processing actions as generated by the
+                :method:`baip_munger.XpathGen.parse_configuration` method
 
-            log.info('Writing out munged content to "%s"' % munged_file)
-            with open(munged_file, 'w') as out_fh:
-                out_fh.write(self.dump_root())
+            *html*: HTML document as a string
 
-            munge_status = True
+        **Returns:**
+            the munged HTML document as a string.  ``None`` on failure
 
-        log.info('Munge status: %s' % munge_status)
+        Only the string is kept: the munged tree is released once it is
+        serialised.
 
-        return munge_status
+        """
+        munged = None
+        start = time.time()
+
+        try:
+            BYTES.inc(len(html), direction='read')
+            self.__document = None
+            self._report('parse')
+            try:
+                self.root = html
+            except (lxml.etree.ParserError, ValueError) as err:
+                ERRORS.inc(stage='parse')
+                log.error('HTML parse failed: %s' % err)
+
+            if self.root is not None:
+                self.apply(actions)
+                munged = self.serialise()
+                BYTES.inc(len(munged), direction='written')
+        finally:
+            if self.__document is not None:
+                self.__document.close()
+            DOCUMENT_SECONDS.observe(time.time() - start)
+            if munged is not None:
+                DOCUMENTS.inc(status='munged')
+            else:
+                DOCUMENTS.inc(status='failed')
+
+        return munged
+
+    def munge_renditions(self, renditions):
+        """Apply each rendition's actions to a copy of :attr:`root`
+        and write the result.  :attr:`root` is not modified.
+
+        **Args:**
+            *renditions*: list of tuples of the form
+            ``(<actions>, <munged_file>)``
+
+        **Returns:**
+            Boolean ``True`` if all renditions were written
+
+        """
+        def munge_rendition(rendition):
+            actions, munged_file = rendition
+
+            munger = Munger(atomic=self.atomic,
+                            output=self.output,
+                            block_size=self.block_size)
+            munger.__document = self.__document.copy()
+            try:
+                munger.apply(actions)
+                munger._write_output(munged_file)
+            finally:
+                munger.document.close()
+
+            return True
+
+        if not renditions:
+            return False
+
+        log.info('Munging %d renditions' % len(renditions))
+        self._report('renditions')
+
+        pool = multiprocessing.pool.ThreadPool(len(renditions))
+        try:
+            statuses = pool.map(munge_rendition, renditions)
+        finally:
+            pool.close()
+            pool.join()
+
+        return all(statuses)
+
+    def _write_output(self, munged_file):
+        """Write :attr:`root` or its :attr:`changes` to *munged_file*
+        as per :attr:`output`.
+
+        """
+        if self.__output == 'changes':
+            self.write_changes(self.__document.changes,
+                               self.__document.source,
+                               munged_file,
+                               self.atomic)
+        elif self.__output == 'splice':
+            log.info('Writing out spliced content to "%s"' % munged_file)
+            self._write_file(self.serialise(), munged_file, self.atomic)
+        else:
+            self.write(self.root, munged_file, self.atomic)
+
+    @staticmethod
+    def write_changes(changes, source, munged_file, atomic=False):
+        """Write the *changes* change set of the document with
+        :func:`baip_munger.changes.digest` *source* to *munged_file*.
+        *atomic* is as per :meth:`write`.
+
+        """
+        log.info('Writing out %d changes to "%s"' %
+                 (len(changes), munged_file))
+        Munger._write_file(baip_munger.changes.dumps(changes, source),
+                           munged_file,
+                           atomic)
+
+    @staticmethod
+    def write(root, munged_file, atomic=False):
+        """Serialise the *root* tree to *munged_file*.
+
+        If *atomic* is ``True`` then the content is written to a
+        temporary file alongside *munged_file* and renamed into place
+        so that readers never see a partial document.
+
+        """
+        log.info('Writing out munged content to "%s"' % munged_file)
+        Munger._write_file(lxml.html.tostring(root), munged_file, atomic)
+
+    @staticmethod
+    def _write_file(html, munged_file, atomic):
+        out_file = munged_file
+        if atomic:
+            out_file = munged_file + TEMP_SUFFIX
+        try:
+            with open(out_file, 'w') as out_fh:
+                out_fh.write(html)
+            if atomic:
+                os.rename(out_file, munged_file)
+        except (IOError, OSError):
+            ERRORS.inc(stage='write')
+            raise
+        BYTES.inc(len(html), direction='written')
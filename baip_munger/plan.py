@@ -0,0 +1,447 @@
+import json
+import marshal
+import hashlib
+
+import baip_munger.munger
+from logga.log import log
+
+__all__ = ['Action', 'ReplaceTag', 'InsertTag', 'UpdateAttribute',
+           'StripChars', 'RegexReplace', 'ACTION_CLASSES', 'ACTION_TYPES',
+           'Plan', 'loads']
+
+# Version of the :meth:`Plan.dumps` serialisation.
+VERSION = 1
+
+# Marks an action field that has no default.
+REQUIRED = object()
+
+
+def _tuple(value):
+    if value is None:
+        return ()
+
+    return tuple(tuple(x) if isinstance(x, list) else x for x in value)
+
+
+class Action(object):
+    """Immutable rule of an action plan.
+
+    Each subclass actions one plan key (:attr:`KEY`) with one
+    :class:`baip_munger.Munger` method (:attr:`METHOD`) whose keywords
+    other than *xpath* and *context* are declared by :attr:`FIELDS`.
+    Unknown or missing keywords raise :exc:`TypeError`.
+
+    For compatibility with code written against plain rule
+    dictionaries an action also supports read-only item access to the
+    keys of :meth:`to_dict`.
+
+    **Args:**
+        *xpath*: XPath expression that locates the elements to action
+
+        *rule_id*: stable identifier of the rule within its plan (for
+        example, ``replace_tags[0]``)
+
+        *section*: location of the source ``Section`` within the
+        configuration
+
+        *when*: XPath guard expressions that must all hold for the
+        rule to apply
+
+        *context*: XPath expressions (outermost first) that *xpath* is
+        relative to
+
+    """
+    __slots__ = ('rule_id', 'section', 'xpath', 'when', 'context',
+                 'values', 'digest')
+
+    KEY = None
+    METHOD = None
+    FIELDS = ()
+
+    def __init__(self, xpath, rule_id=None, section=None, when=None,
+                 context=None, **kwargs):
+        values = []
+        for name, default in self.FIELDS:
+            value = kwargs.pop(name, default)
+            if value is REQUIRED:
+                raise TypeError('%s requires "%s"' %
+                                (type(self).__name__, name))
+            if isinstance(value, list):
+                value = _tuple(value)
+            values.append(value)
+        if kwargs:
+            raise TypeError('%s got unexpected keywords: %s' %
+                            (type(self).__name__, ', '.join(sorted(kwargs))))
+
+        content = (self.KEY, xpath, _tuple(when), _tuple(context),
+                   tuple(values))
+
+        # Hash a canonical JSON encoding so that equal str and unicode
+        # values share a digest on any interpreter.
+        canonical = json.dumps(content, sort_keys=True)
+        digest = hashlib.sha1(canonical).hexdigest()
+
+        set_attr = super(Action, self).__setattr__
+        set_attr('rule_id', rule_id)
+        set_attr('section', section)
+        set_attr('xpath', xpath)
+        set_attr('when', content[2])
+        set_attr('context', content[3])
+        set_attr('values', content[4])
+        set_attr('digest', digest)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __getattr__(self, name):
+        if name == 'values':
+            raise AttributeError(name)
+
+        for (field, _), value in zip(self.FIELDS, self.values):
+            if field == name:
+                return value
+
+        raise AttributeError(name)
+
+    def record(self):
+        """Tuple of primitives that :meth:`from_record` rebuilds the
+        action from.
+
+        """
+        return (self.KEY, self.rule_id, self.section, self.xpath,
+                self.when, self.context, self.values)
+
+    @staticmethod
+    def from_record(record):
+        key, rule_id, section, xpath, when, context, values = record
+        cls = ACTION_TYPES[key]
+        kwargs = dict(zip([x for x, _ in cls.FIELDS], values))
+
+        return cls(xpath, rule_id=rule_id, section=section, when=when,
+                   context=context, **kwargs)
+
+    def __reduce__(self):
+        return (Action.from_record, (self.record(),))
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.record() == self.record()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.record())
+
+    def __repr__(self):
+        return '<%s %s %r>' % (type(self).__name__, self.rule_id, self.xpath)
+
+    def keywords(self):
+        """Keywords of the :attr:`METHOD` call that applies the rule.
+
+        """
+        keywords = {'xpath': self.xpath}
+        for (name, _), value in zip(self.FIELDS, self.values):
+            if value is None or value is False:
+                continue
+            if isinstance(value, tuple):
+                value = list(value)
+            keywords[name] = value
+        if self.context:
+            keywords['context'] = list(self.context)
+
+        return keywords
+
+    def to_dict(self):
+        """Plain rule dictionary as produced by
+        :meth:`baip_munger.XpathGen.parse_configuration`.
+
+        """
+        rule = self.keywords()
+        if self.when:
+            rule['when'] = list(self.when)
+
+        return rule
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __contains__(self, key):
+        return key in self.to_dict()
+
+    def get(self, key, default=None):
+        return self.to_dict().get(key, default)
+
+    def keys(self):
+        return self.to_dict().keys()
+
+
+class ReplaceTag(Action):
+    """Rename the matched elements (``sectionReplaceTag``).
+
+    """
+    __slots__ = ()
+    KEY = 'replace_tags'
+    METHOD = 'replace_tag'
+    FIELDS = (('new_tag', REQUIRED),
+              ('new_tag_attributes', ()),
+              ('flatten', False))
+
+
+class InsertTag(Action):
+    """Wrap runs of matched elements in a new parent
+    (``sectionInsertTag``).
+
+    """
+    __slots__ = ()
+    KEY = 'insert_tags'
+    METHOD = 'insert_tag'
+    FIELDS = (('new_tag', REQUIRED),)
+
+
+class UpdateAttribute(Action):
+    """Add, update or delete an attribute of the matched elements
+    (``sectionAddAttribute``, ``sectionUpdateAttribute`` and
+    ``sectionDeleteAttribute``).
+
+    """
+    __slots__ = ()
+    KEY = 'attributes'
+    METHOD = 'update_element_attribute'
+    FIELDS = (('attribute', REQUIRED),
+              ('value', None),
+              ('old_value', None),
+              ('add', False))
+
+
+class StripChars(Action):
+    """Strip characters from the text of the matched elements
+    (``sectionStripChars``).
+
+    """
+    __slots__ = ()
+    KEY = 'strip_chars'
+    METHOD = 'strip_char'
+    FIELDS = (('chars', REQUIRED),)
+
+
+class RegexReplace(Action):
+    """Replace regular expression matches in the text of the matched
+    elements (``sectionRegexReplace``).
+
+    """
+    __slots__ = ()
+    KEY = 'regex_replaces'
+    METHOD = 'regex_replace'
+    FIELDS = (('pattern', REQUIRED),
+              ('replacement', ''))
+
+
+# Action classes in the order that their rules are applied to a
+# document.
+ACTION_CLASSES = (ReplaceTag, InsertTag, UpdateAttribute, StripChars,
+                  RegexReplace)
+
+# Action class of each plan key.
+ACTION_TYPES = dict((x.KEY, x) for x in ACTION_CLASSES)
+
+# Plan keys in the order that their rules are applied.
+ORDER = [x.KEY for x in ACTION_CLASSES]
+
+
+class Plan(object):
+    """Immutable action plan: the :class:`Action` rules of each plan
+    key in the order that they are applied to a document.
+
+    A plan is hashable, compares by content and pickles to the compact
+    :meth:`dumps` form, so it is cheap to ship to worker processes and
+    to cache by :attr:`digest`.  For compatibility it also supports the
+    read-only mapping interface of the plain dictionary returned by
+    :meth:`baip_munger.XpathGen.parse_configuration`.
+
+    **Args:**
+        *rules*: dictionary of plan keys mapped to their sequence of
+        :class:`Action` objects
+
+    """
+    __slots__ = ('rules', 'digest')
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = {}
+
+        ordered = []
+        for key in ORDER:
+            actions = tuple(rules.get(key, ()))
+            for action in actions:
+                if action.KEY != key:
+                    raise TypeError('%r is not a "%s" action' %
+                                    (action, key))
+            ordered.append((key, actions))
+        unknown = set(rules) - set(ORDER)
+        if unknown:
+            raise TypeError('Unknown plan keys: %s' %
+                            ', '.join(sorted(unknown)))
+
+        digest = hashlib.sha1()
+        for key, actions in ordered:
+            for action in actions:
+                digest.update(action.digest)
+
+        set_attr = super(Plan, self).__setattr__
+        set_attr('rules', tuple(ordered))
+        set_attr('digest', digest.hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Plan is immutable')
+
+    @classmethod
+    def from_dict(cls, actions):
+        """Build a :class:`Plan` from the plain *actions* dictionary
+        form of :meth:`baip_munger.XpathGen.parse_configuration`.
+
+        **Raises:**
+            :exc:`TypeError` on unknown plan keys or rule keywords
+
+        """
+        if isinstance(actions, Plan):
+            return actions
+
+        rules = {}
+        for key, items in actions.iteritems():
+            action_type = ACTION_TYPES.get(key)
+            if action_type is None:
+                raise TypeError('Unknown plan key "%s"' % key)
+            rules[key] = [action_type(rule_id='%s[%d]' % (key, index),
+                                      **item)
+                          for index, item in enumerate(items)]
+
+        return cls(rules)
+
+    def to_dict(self):
+        """Plain dictionary form of the plan.
+
+        """
+        return dict((x, [y.to_dict() for y in actions])
+                    for x, actions in self.rules)
+
+    def __iter__(self):
+        """Iterate over the plan's :class:`Action` objects in the order
+        that they are applied.
+
+        """
+        for _, actions in self.rules:
+            for action in actions:
+                yield action
+
+    def __len__(self):
+        return sum(len(x) for _, x in self.rules)
+
+    def dumps(self):
+        """Compact binary serialisation of the plan.
+
+        """
+        return marshal.dumps((VERSION, tuple(x.record() for x in self)))
+
+    def __reduce__(self):
+        return (loads, (self.dumps(),))
+
+    def __eq__(self, other):
+        return isinstance(other, Plan) and other.rules == self.rules
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return '<Plan %s: %d rules>' % (self.digest[:12], len(self))
+
+    def apply(self, document, progress=None):
+        """Apply the plan's rules in order to *document*.
+
+        The plan holds no per-document state so it can be applied to
+        several documents at once, for example from a thread per
+        document.
+
+        Rule ``when`` guards are evaluated once against the document
+        before any rule is applied.  Rules with a failed guard are
+        skipped.
+
+        **Args:**
+            *document*: :class:`baip_munger.Document` that is changed
+            in place
+
+            *progress*: if not ``None``, callable that is passed the
+            rule id of each rule before it is applied
+
+        **Returns:**
+            *document*
+
+        """
+        munger = baip_munger.munger
+
+        document.clear_contexts()
+        passed = munger.evaluate_guards(document.root,
+                                        (x.when for x in self))
+        for action in self:
+            if not all(passed[x] for x in action.when):
+                log.debug('Rule %s skipped: guard failed' % action.rule_id)
+                munger.SKIPPED.inc()
+                continue
+            if progress is not None:
+                progress(action.rule_id)
+            munger._instrument(action.METHOD,
+                               getattr(document, action.METHOD),
+                               **action.keywords())
+
+        return document
+
+    def get(self, key, default=None):
+        for name, actions in self.rules:
+            if name == key:
+                return list(actions)
+
+        return default
+
+    def __getitem__(self, key):
+        actions = self.get(key)
+        if actions is None:
+            raise KeyError(key)
+
+        return actions
+
+    def __contains__(self, key):
+        return key in ORDER
+
+    def keys(self):
+        return list(ORDER)
+
+    def iteritems(self):
+        for key, actions in self.rules:
+            yield (key, list(actions))
+
+
+def loads(data):
+    """Rebuild the :class:`Plan` serialised by :meth:`Plan.dumps`.
+
+    **Raises:**
+        :exc:`ValueError` if *data* is not a serialised plan
+
+    """
+    try:
+        version, records = marshal.loads(data)
+    except (EOFError, TypeError, ValueError):
+        raise ValueError('Not a serialised plan')
+    if version != VERSION:
+        raise ValueError('Unsupported plan version %s' % version)
+
+    rules = {}
+    for record in records:
+        action = Action.from_record(record)
+        rules.setdefault(action.KEY, []).append(action)
+
+    return Plan(rules)
@@ -0,0 +1,279 @@
+import time
+import select
+import collections
+import multiprocessing
+
+from logga.log import log
+
+__all__ = ['WorkerPool', 'progress', 'at_exit']
+
+# Parent poll interval (seconds) while waiting on worker messages.
+POLL_INTERVAL = 0.05
+
+# Worker process state.  Holds the pipe back to the parent.
+_WORKER = {}
+
+
+def progress(stage):
+    """Report the current *stage* of a task (for example, the rule
+    being applied) to the :class:`WorkerPool` parent.  A no-op outside
+    of a worker process.
+
+    """
+    conn = _WORKER.get('conn')
+    if conn is not None:
+        conn.send(('progress', stage))
+
+
+def at_exit(func):
+    """Call *func* when the current worker process is stopped by its
+    :class:`WorkerPool`.  Workers killed for overrunning a limit do not
+    call *func*.  A no-op outside of a worker process.
+
+    """
+    if 'conn' in _WORKER:
+        _WORKER.setdefault('at_exit', []).append(func)
+
+
+def _worker_main(conn, initializer, initargs):
+    """Worker process loop.  ``(<func>, <item>)`` tasks arrive over
+    *conn* and the result of ``func(item)`` is sent back.  A ``None``
+    task stops the worker.
+
+    """
+    _WORKER['conn'] = conn
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        func, item = task
+        conn.send(('result', func(item)))
+
+    for func in _WORKER.get('at_exit', []):
+        func()
+
+
+class Worker(object):
+    """Parent side handle of a :class:`WorkerPool` process.
+
+    """
+    def __init__(self, initializer, initargs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main,
+                                               args=(child_conn,
+                                                     initializer,
+                                                     initargs))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+        self.item = None
+        self.started = None
+        self.stage = None
+        self.stage_started = None
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def assign(self, func, item):
+        self.item = item
+        self.started = self.stage_started = time.time()
+        self.stage = None
+        self.conn.send((func, item))
+
+    def release(self):
+        item = self.item
+        self.item = None
+
+        return item
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """Pool of worker processes that enforces a per-task *deadline* and
+    a per-stage *stage_budget* (both in seconds, ``None`` for no
+    limit).
+
+    Tasks report the stage they are in by calling :func:`progress`.
+    A worker that exceeds either limit is killed and replaced.  Other
+    workers carry on unaffected.
+
+    The first *small_lane* workers are reserved for the smallest
+    items: they take items from the end of the list passed to
+    :meth:`imap_unordered` while the other workers take items from the
+    front.  Pass items ordered largest first so that large items start
+    early and small items are never stuck behind them.
+
+    Workers are started on demand and stopped at the end of each
+    :meth:`imap_unordered` call unless the pool is used as a context
+    manager, in which case they stay warm until the context exits.
+
+    """
+    def __init__(self,
+                 processes=None,
+                 initializer=None,
+                 initargs=(),
+                 deadline=None,
+                 stage_budget=None,
+                 small_lane=0):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.__processes = processes
+        self.__initializer = initializer
+        self.__initargs = initargs
+        self.__deadline = deadline
+        self.__stage_budget = stage_budget
+        self.__small_lane = small_lane
+        self.__workers = []
+        self.__persistent = False
+
+    def __enter__(self):
+        self.__persistent = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__persistent = False
+        self.close()
+
+    @property
+    def processes(self):
+        return self.__processes
+
+    @property
+    def initargs(self):
+        return self.__initargs
+
+    @property
+    def deadline(self):
+        return self.__deadline
+
+    @property
+    def stage_budget(self):
+        return self.__stage_budget
+
+    @property
+    def small_lane(self):
+        return self.__small_lane
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def close(self):
+        """Stop all worker processes.
+
+        """
+        for worker in self.__workers:
+            if worker.item is not None:
+                worker.kill()
+            else:
+                worker.stop()
+        self.__workers = []
+
+    def _expired(self, worker, now):
+        if (self.deadline is not None and
+                now - worker.started > self.deadline):
+            return 'deadline'
+
+        if (self.stage_budget is not None and
+                now - worker.stage_started > self.stage_budget):
+            return 'stage budget'
+
+        return None
+
+    def imap_unordered(self, func, items, on_timeout=None):
+        """Apply *func* to each of *items* and yield the results in
+        completion order.
+
+        Items that time out are not yielded but passed to the
+        *on_timeout* callback as ``on_timeout(item, stage, reason,
+        elapsed)`` where *stage* is the last stage reported by the
+        task.
+
+        """
+        pending = collections.deque(items)
+        workers = self.__workers
+        while len(workers) < min(self.processes, len(pending)):
+            workers.append(Worker(self.__initializer, self.__initargs))
+
+        completed = False
+        try:
+            while True:
+                for index, worker in enumerate(workers):
+                    if worker.item is None and pending:
+                        if index < self.small_lane:
+                            worker.assign(func, pending.pop())
+                        else:
+                            worker.assign(func, pending.popleft())
+
+                busy = [x for x in workers if x.item is not None]
+                if not busy:
+                    break
+
+                ready, _, _ = select.select(busy, [], [], POLL_INTERVAL)
+                for worker in ready:
+                    try:
+                        kind, value = worker.conn.recv()
+                    except EOFError:
+                        kind, value = ('died', None)
+
+                    if kind == 'progress':
+                        worker.stage = value
+                        worker.stage_started = time.time()
+                    elif kind == 'result':
+                        worker.release()
+                        yield value
+                    else:
+                        self._replace(worker, 'worker died', on_timeout)
+
+                now = time.time()
+                for worker in busy:
+                    if worker.item is None:
+                        continue
+
+                    reason = self._expired(worker, now)
+                    if reason is not None:
+                        self._replace(worker, reason, on_timeout)
+            completed = True
+        finally:
+            if not completed or not self.__persistent:
+                self.close()
+
+    def _replace(self, worker, reason, on_timeout):
+        """Kill *worker*, report its task via the *on_timeout* callback
+        and start a new worker in its place.
+
+        """
+        elapsed = time.time() - worker.started
+        stage = worker.stage
+        item = worker.release()
+
+        log.warn('Killing worker %d (%s) at stage "%s" after %.3fs: %s' %
+                 (worker.process.pid, reason, stage, elapsed, item))
+        worker.kill()
+        index = self.__workers.index(worker)
+        self.__workers[index] = Worker(self.__initializer, self.__initargs)
+
+        if on_timeout is not None:
+            on_timeout(item, stage, reason, elapsed)
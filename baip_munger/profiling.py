@@ -0,0 +1,206 @@
+import os
+import sys
+import glob
+import time
+import pstats
+import cProfile
+import threading
+import collections
+
+from logga.log import log
+
+__all__ = ['StackSampler', 'start', 'stop', 'clean', 'merge']
+
+# Default seconds between stack samples.
+SAMPLE_INTERVAL = 0.01
+
+# File suffix of the cProfile statistics and collapsed stack samples.
+PSTATS = 'pstats'
+FOLDED = 'folded'
+
+# Profilers of the current process.
+_ACTIVE = {}
+
+
+def _write_stacks(stacks, path):
+    with open(path, 'w') as out_fh:
+        for stack, count in sorted(stacks.iteritems()):
+            out_fh.write('%s %d\n' % (stack, count))
+
+
+def _frame_name(frame):
+    code = frame.f_code
+
+    return '%s (%s:%d)' % (code.co_name,
+                           os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class StackSampler(object):
+    """Sample the Python stack of thread *thread_id* (default: the
+    calling thread) every *interval* seconds from a background thread.
+
+    Samples are counted by stack in the collapsed format understood by
+    flame graph tools: one line per distinct stack of ``;`` separated
+    frames from the outermost, followed by the sample count.
+
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        if thread_id is None:
+            thread_id = threading.current_thread().ident
+
+        self.__interval = interval
+        self.__thread_id = thread_id
+        self.__stacks = collections.Counter()
+        self.__running = False
+        self.__thread = None
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    @property
+    def stacks(self):
+        """:class:`collections.Counter` of collapsed stacks.
+
+        """
+        return self.__stacks
+
+    def sample(self):
+        """Record the current stack of the sampled thread.
+
+        """
+        frame = sys._current_frames().get(self.__thread_id)
+        if frame is None:
+            return
+
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        names.reverse()
+        self.__stacks[';'.join(names)] += 1
+
+    def _run(self):
+        while self.__running:
+            time.sleep(self.__interval)
+            self.sample()
+
+    def start(self):
+        self.__running = True
+        self.__thread = threading.Thread(target=self._run,
+                                         name='baip-stack-sampler')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def write(self, path):
+        """Write the collapsed stacks to *path*.
+
+        """
+        _write_stacks(self.__stacks, path)
+
+
+def _process_file(prefix, suffix):
+    return '%s.%d.%s' % (prefix, os.getpid(), suffix)
+
+
+def start(profile=None, sample_profile=None, interval=SAMPLE_INTERVAL):
+    """Start profiling the current process.
+
+    **Args:**
+        *profile*: path prefix of the deterministic :mod:`cProfile`
+        statistics
+
+        *sample_profile*: path prefix of the sampled collapsed stacks
+
+        *interval*: seconds between stack samples
+
+    """
+    # Profilers inherited from a forking parent belong to the parent.
+    _ACTIVE.clear()
+
+    if profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _ACTIVE['profile'] = (profiler, profile)
+
+    if sample_profile is not None:
+        sampler = StackSampler(interval)
+        sampler.start()
+        _ACTIVE['sample_profile'] = (sampler, sample_profile)
+
+
+def stop():
+    """Stop profiling the current process and write its
+    ``<prefix>.<pid>.pstats`` and ``<prefix>.<pid>.folded`` files.
+
+    """
+    if 'profile' in _ACTIVE:
+        profiler, prefix = _ACTIVE.pop('profile')
+        profiler.disable()
+        profiler.dump_stats(_process_file(prefix, PSTATS))
+
+    if 'sample_profile' in _ACTIVE:
+        sampler, prefix = _ACTIVE.pop('sample_profile')
+        sampler.stop()
+        sampler.write(_process_file(prefix, FOLDED))
+
+
+def _process_files(prefix, suffix):
+    return sorted(glob.glob('%s.[0-9]*.%s' % (prefix, suffix)))
+
+
+def clean(profile=None, sample_profile=None):
+    """Remove the per-process files left under the *profile* and
+    *sample_profile* prefixes by an earlier run.
+
+    """
+    for prefix, suffix in ((profile, PSTATS), (sample_profile, FOLDED)):
+        if prefix is None:
+            continue
+        for path in _process_files(prefix, suffix):
+            os.remove(path)
+
+
+def merge(profile=None, sample_profile=None):
+    """Combine the per-process files of a run into
+    ``<profile>.pstats`` and ``<sample_profile>.folded``.
+
+    **Returns:**
+        list of the merged file paths
+
+    """
+    merged = []
+
+    if profile is not None:
+        paths = _process_files(profile, PSTATS)
+        if paths:
+            stats = pstats.Stats(*paths)
+            path = '%s.%s' % (profile, PSTATS)
+            stats.dump_stats(path)
+            merged.append(path)
+
+    if sample_profile is not None:
+        paths = _process_files(sample_profile, FOLDED)
+        if paths:
+            stacks = collections.Counter()
+            for stack_file in paths:
+                with open(stack_file) as stack_fh:
+                    for line in stack_fh:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        stacks[stack] += int(count)
+
+            path = '%s.%s' % (sample_profile, FOLDED)
+            _write_stacks(stacks, path)
+            merged.append(path)
+
+    for path in merged:
+        log.info('Profile written to "%s"' % path)
+
+    return merged
@@ -0,0 +1,270 @@
+import os
+import re
+import json
+import lxml.etree
+
+import baip_munger.munger
+import baip_munger.xpathgen
+import baip_munger.xslt
+import baip_munger.exception
+from logga.log import log
+
+__all__ = ['Router', 'fingerprint']
+
+# Class names declared by the selectors of a stylesheet.
+CLASS = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+
+# Distinct fingerprints remembered before the route cache is reset.
+CACHE_SIZE = 1024
+
+# Template label of documents that match no template and no default.
+UNROUTED = 'unrouted'
+
+TEMPLATES = baip_munger.munger.METRICS.counter(
+    'baip_munger_template_documents_total',
+    'Documents routed to each template plan',
+    ['template'])
+
+
+def fingerprint(root, tokens=()):
+    """Cheap fingerprint of the document *root* built from its ``head``
+    alone.
+
+    **Args:**
+        *root*: :mod:`lxml.html` root element
+
+        *tokens*: strings to look for in the serialised ``head``
+
+    **Returns:**
+        tuple of the form ``(<meta>, <classes>, <tokens>)`` where
+        *meta* is a sorted tuple of ``(<name>, <content>)`` pairs of
+        the named ``meta`` elements, *classes* is the frozenset of
+        class names declared in ``style`` elements and *tokens* is the
+        tuple of *tokens* present
+
+    """
+    meta = []
+    classes = set()
+    found = ()
+
+    head = root.find('head')
+    if head is not None:
+        for element in head.iter('meta', 'style'):
+            if element.tag == 'meta':
+                name = element.get('name')
+                if name is not None:
+                    meta.append((name.lower(), element.get('content', '')))
+            elif element.text is not None:
+                classes.update(CLASS.findall(element.text))
+
+        if tokens:
+            text = lxml.etree.tostring(head, encoding='unicode')
+            found = tuple(x for x in tokens if x in text)
+
+    return (tuple(sorted(meta)), frozenset(classes), found)
+
+
+class Router(object):
+    """Compiled plan that munges each document with the plan of the
+    first template it matches.
+
+    *templates* is a list of dictionaries of the form::
+
+        {
+            'name': '<template_name>',
+            'actions': <actions>,
+            'meta': {'<meta_name>': '<content_substring>', ...},
+            'classes': ['<stylesheet_class>', ...],
+            'tokens': ['<head_substring>', ...],
+        }
+
+    where *actions* is as per
+    :meth:`baip_munger.XpathGen.parse_configuration` and each of the
+    optional *meta*, *classes* and *tokens* criteria must all hold for
+    a document to match.  Documents that match no template are munged
+    with the *default* actions, if given, or left unchanged.
+
+    The route of each distinct :func:`fingerprint` is cached so that
+    the template criteria are only checked once per fingerprint.  With
+    *backend* ``xslt`` each template's plan is compiled by
+    :class:`baip_munger.XsltGen` when first used.
+
+    """
+    def __init__(self, templates, default=None, backend='python'):
+        self.__templates = templates
+        self.__default = default
+        self.__backend = backend
+        self.__routes = {}
+        self.__plans = {}
+
+        tokens = set()
+        for template in templates:
+            tokens.update(template.get('tokens', []))
+        self.__tokens = tuple(sorted(tokens))
+
+    @property
+    def templates(self):
+        return self.__templates
+
+    @property
+    def default(self):
+        return self.__default
+
+    @property
+    def backend(self):
+        return self.__backend
+
+    @classmethod
+    def load(cls, registry_file, default=None, backend='python'):
+        """Build a :class:`Router` from the JSON *registry_file* of the
+        form::
+
+            {
+                "templates": [
+                    {
+                        "name": "<template_name>",
+                        "config": "<XpathGen config file>",
+                        "meta": {...},
+                        "classes": [...],
+                        "tokens": [...]
+                    }
+                ],
+                "default": "<XpathGen config file>"
+            }
+
+        Config paths are relative to the directory of *registry_file*.
+        The *default* config file is used if the registry does not
+        define one.
+
+        **Raises:**
+            :class:`baip_munger.exception.MungerConfigError` (1005) if
+            the registry cannot be read
+
+        """
+        try:
+            with open(registry_file) as registry_fh:
+                registry = json.load(registry_fh)
+            entries = registry['templates']
+            base = os.path.dirname(os.path.abspath(registry_file))
+
+            templates = []
+            for entry in entries:
+                template = dict((x, entry[x])
+                                for x in ('meta', 'classes', 'tokens')
+                                if x in entry)
+                template['name'] = entry['name']
+                conf_file = os.path.join(base, entry['config'])
+                conf = baip_munger.xpathgen.XpathGen(conf_file)
+                template['actions'] = conf.plan
+                templates.append(template)
+        except (IOError, ValueError, KeyError, TypeError) as err:
+            raise baip_munger.exception.MungerConfigError(1005,
+                                                          error=repr(err))
+
+        if registry.get('default') is not None:
+            default = os.path.join(base, registry['default'])
+
+        default_actions = None
+        if default is not None:
+            conf = baip_munger.xpathgen.XpathGen(default)
+            default_actions = conf.plan
+
+        log.info('Route registry "%s": %d templates' %
+                 (registry_file, len(templates)))
+
+        return cls(templates, default=default_actions, backend=backend)
+
+    @staticmethod
+    def _matches(template, key):
+        """Check if the fingerprint *key* meets the criteria of
+        *template*.
+
+        """
+        meta, classes, tokens = key
+        meta = dict(meta)
+        for name, content in template.get('meta', {}).iteritems():
+            if content not in meta.get(name.lower(), ''):
+                return False
+
+        if not classes.issuperset(template.get('classes', [])):
+            return False
+
+        return set(template.get('tokens', [])).issubset(tokens)
+
+    def route(self, root):
+        """Identify the template of the document *root*.
+
+        **Returns:**
+            the template name, ``default`` or :data:`UNROUTED`
+
+        """
+        key = fingerprint(root, self.__tokens)
+
+        name = self.__routes.get(key)
+        if name is None:
+            name = UNROUTED
+            if self.__default is not None:
+                name = 'default'
+            for template in self.__templates:
+                if self._matches(template, key):
+                    name = template['name']
+                    break
+
+            if len(self.__routes) >= CACHE_SIZE:
+                self.__routes.clear()
+            self.__routes[key] = name
+            log.debug('Fingerprint routed to template "%s"' % name)
+
+        return name
+
+    def plan(self, name):
+        """Return the plan of template *name* or ``None``.
+
+        """
+        plan = self.__plans.get(name)
+        if plan is None and name not in self.__plans:
+            if name == 'default':
+                plan = self.__default
+            else:
+                for template in self.__templates:
+                    if template['name'] == name:
+                        plan = template['actions']
+                        break
+
+            if plan is not None and self.__backend == 'xslt':
+                plan = baip_munger.xslt.XsltGen(plan)
+            self.__plans[name] = plan
+
+        return plan
+
+    def transform(self, root):
+        """Munge *root* with the plan of its template.
+
+        **Returns:**
+            the munged root element
+
+        """
+        name = self.route(root)
+        TEMPLATES.inc(template=name)
+
+        plan = self.plan(name)
+        if plan is None:
+            log.warn('Document matches no template: left unchanged')
+            return root
+
+        munger = baip_munger.munger.Munger()
+        munger.root = root
+        munger.apply(plan)
+
+        return munger.root
+
+    def counts(self):
+        """Number of documents routed to each template (including
+        ``default`` and :data:`UNROUTED`) as recorded in the metrics
+        registry.
+
+        """
+        names = [x['name'] for x in self.__templates]
+        names.extend(['default', UNROUTED])
+
+        return dict((x, int(TEMPLATES.value(template=x))) for x in names)
@@ -0,0 +1,93 @@
+import os
+import json
+
+from logga.log import log
+
+__all__ = ['CostModel']
+
+# Marks a mean rate that has not been computed since the last observation.
+_UNKNOWN = object()
+
+
+class CostModel(object):
+    """Predict the seconds needed to munge a document from earlier runs.
+
+    Documents seen before are predicted from their last observed time,
+    scaled by any change in size.  Other documents are predicted from
+    their size and the mean seconds per byte over all observations.
+    Without observations the prediction is the size in bytes, which
+    still orders documents correctly.
+
+    **Args:**
+        *path*: JSON file to load observations from and :meth:`save`
+        them to
+
+    """
+    def __init__(self, path=None):
+        self.__path = path
+        self.__documents = {}
+        self.__rate = _UNKNOWN
+
+        if path is not None and os.path.exists(path):
+            with open(path) as model_fh:
+                self.__documents = json.load(model_fh).get('documents', {})
+            log.info('Loaded %d cost model observations from "%s"' %
+                     (len(self.__documents), path))
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def documents(self):
+        return self.__documents
+
+    def _rate(self):
+        """Mean seconds per byte over all observations, or ``None``
+        without any.  Cached until the next :meth:`observe`, so that
+        ordering a batch costs one pass over the observations.
+
+        """
+        if self.__rate is not _UNKNOWN:
+            return self.__rate
+
+        size = sum(x for x, _ in self.__documents.itervalues())
+        seconds = sum(x for _, x in self.__documents.itervalues())
+        self.__rate = None
+        if size:
+            self.__rate = float(seconds) / size
+
+        return self.__rate
+
+    def observe(self, staged_file, size, seconds):
+        """Record that *staged_file* of *size* bytes took *seconds*.
+
+        """
+        self.__documents[staged_file] = [size, seconds]
+        self.__rate = _UNKNOWN
+
+    def predict(self, staged_file, size):
+        """Predicted cost of munging *staged_file* of *size* bytes.
+
+        """
+        observed = self.__documents.get(staged_file)
+        if observed is not None and observed[0]:
+            return observed[1] * float(size) / observed[0]
+
+        rate = self._rate()
+        if rate is None:
+            return size
+
+        return size * rate
+
+    def save(self, path=None):
+        """Write the observations to *path* (default :attr:`path`).
+
+        """
+        if path is None:
+            path = self.__path
+
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as model_fh:
+            json.dump({'documents': self.__documents}, model_fh)
+        os.rename(temp_path, path)
@@ -0,0 +1,126 @@
+import os
+import heapq
+import hashlib
+
+__all__ = ['METHODS', 'parse', 'select', 'merge_summaries']
+
+# Supported partitioning methods.
+METHODS = ['hash', 'size']
+
+
+def parse(value):
+    """Parse a ``I/N`` shard specification where *I* is the 1-based
+    shard index and *N* the number of shards.
+
+    **Returns:**
+        tuple of the form ``(<index>, <count>)``
+
+    """
+    try:
+        index, count = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise ValueError('Shard "%s" is not of the form I/N' % value)
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError('Shard "%s" index out of range' % value)
+
+    return (index, count)
+
+
+def _key(relpath):
+    """Stable shard key of *relpath*, independent of the host OS path
+    separator and Python hash seed.
+
+    """
+    relpath = relpath.replace(os.sep, '/')
+    if isinstance(relpath, unicode):
+        relpath = relpath.encode('utf-8')
+
+    return int(hashlib.md5(relpath).hexdigest()[:8], 16)
+
+
+def select(relpaths, index, count, method='hash', sizes=None):
+    """Return the members of *relpaths* that belong to shard *index* of
+    *count*.
+
+    With the ``hash`` method a document's shard depends only on its
+    relative path.  The ``size`` method bin packs the documents
+    largest first into the currently lightest shard so that each shard
+    holds a similar number of bytes.  Both are deterministic, so
+    independent hosts that see the same corpus cover it exactly once.
+
+    **Args:**
+        *relpaths*: document paths relative to the staging directory
+
+        *index*: 1-based shard index
+
+        *count*: number of shards
+
+        *method*: one of :data:`METHODS`
+
+        *sizes*: dictionary of *relpath* to size in bytes (``size``
+        method only)
+
+    **Returns:**
+        list of the selected *relpaths* in their original order
+
+    """
+    if method == 'hash':
+        return [x for x in relpaths if _key(x) % count == index - 1]
+
+    if method != 'size':
+        raise ValueError('Unknown shard method "%s"' % method)
+
+    bins = [(0, x) for x in range(count)]
+    selected = set()
+    for relpath in sorted(relpaths, key=lambda x: (-sizes[x], x)):
+        load, shard = heapq.heappop(bins)
+        if shard == index - 1:
+            selected.add(relpath)
+        heapq.heappush(bins, (load + sizes[relpath], shard))
+
+    return [x for x in relpaths if x in selected]
+
+
+def merge_summaries(summaries):
+    """Combine the per-shard :meth:`baip_munger.Batch.munge` summaries.
+
+    Summaries that carry a ``shard`` key of the form ``I/N`` are
+    checked for coverage and the shards not present are reported under
+    ``missing_shards``.  The ``duplicates`` groups of deduplicated
+    summaries are combined.
+
+    **Returns:**
+        the combined summary dictionary
+
+    """
+    merged = {'documents': 0,
+              'munged': 0,
+              'failed': [],
+              'quarantined': [],
+              'shards': [],
+              'missing_shards': []}
+
+    count = None
+    for summary in summaries:
+        merged['documents'] += summary.get('documents', 0)
+        merged['munged'] += summary.get('munged', 0)
+        merged['failed'].extend(summary.get('failed', []))
+        merged['quarantined'].extend(summary.get('quarantined', []))
+        if 'duplicates' in summary:
+            merged.setdefault('duplicates', [])
+            merged['duplicates'].extend(summary['duplicates'])
+
+        shard = summary.get('shard')
+        if shard is not None:
+            index, count = parse(shard)
+            merged['shards'].append(index)
+
+    if count is not None:
+        merged['missing_shards'] = sorted(set(range(1, count + 1)) -
+                                          set(merged['shards']))
+    merged['shards'].sort()
+    merged['failed'].sort()
+    merged['quarantined'].sort(key=lambda x: x['file'])
+
+    return merged
@@ -0,0 +1,221 @@
+import re
+import lxml.html
+import lxml.etree
+
+__all__ = ['scan', 'Splicer']
+
+# Markup tokens of the source document: comments, declarations,
+# processing instructions, end tags and start tags.  Quoted attribute
+# values may hold ">".
+TOKEN = re.compile(r"""<!--.*?-->
+                      |<![^>]*>
+                      |<\?[^>]*>
+                      |</[^>]*>
+                      |<([a-zA-Z][^\s/>]*)(?:[^>"']|"[^"]*"|'[^']*')*>""",
+                   re.DOTALL | re.VERBOSE)
+
+# Elements whose content is raw text rather than markup.
+RAW_TEXT = ('script', 'style')
+
+# libxml2 reports larger line numbers as this value.
+MAX_LINE = 65535
+
+# Operations (as per baip_munger.changes.OPERATIONS) that swap their
+# target node for another, so change the target's parent.
+STRUCTURAL = ('replace',)
+
+
+def scan(html):
+    """Locate the start tags, comments and processing instructions of
+    the *html* source.
+
+    **Returns:**
+        list of ``(<kind>, <name>, <offset>, <line>)`` tuples in source
+        order where *kind* is ``start``, ``comment`` or ``pi``, *name*
+        is the lower case tag name of a start tag and *line* starts at
+        1
+
+    """
+    tokens = []
+    lower = None
+    line = 1
+    last = 0
+    pos = 0
+    while True:
+        match = TOKEN.search(html, pos)
+        if match is None:
+            break
+
+        offset = match.start()
+        line += html.count('\n', last, offset)
+        last = offset
+        pos = match.end()
+
+        token = match.group(0)
+        if token.startswith('<!--'):
+            tokens.append(('comment', None, offset, line))
+        elif token.startswith('<?'):
+            tokens.append(('pi', None, offset, line))
+        elif match.group(1) is not None:
+            name = match.group(1).lower()
+            tokens.append(('start', name, offset, line))
+            if name in RAW_TEXT and not token.endswith('/>'):
+                if lower is None:
+                    lower = html.lower()
+                end = lower.find('</%s' % name, pos)
+                pos = len(html) if end < 0 else end
+
+    return tokens
+
+
+def _kind(node):
+    if isinstance(node, lxml.etree._Comment):
+        return ('comment', None)
+    if isinstance(node, lxml.etree._ProcessingInstruction):
+        return ('pi', None)
+    if isinstance(node.tag, basestring):
+        return ('start', node.tag.lower())
+
+    return (None, None)
+
+
+class Splicer(object):
+    """Serialise a munged tree by copying the unchanged byte ranges of
+    its *html* source and re-serialising only the changed nodes.
+
+    Source offsets come from :func:`scan`.  Each source token is
+    aligned to the node of the parsed tree with the same tag name and
+    source line.  Nodes that the parser implied (such as a missing
+    ``body``) have no offset.
+
+    A changed node is re-serialised together with its tail.  Its source
+    region therefore ends where its next sibling starts.  A node
+    without an offset or a next sibling with an offset is widened to
+    its parent.  The whole tree is re-serialised if no region can be
+    found.
+
+    """
+    def __init__(self, html):
+        self.__html = html
+        self.__offsets = None
+        self.__touched = []
+
+    @property
+    def html(self):
+        return self.__html
+
+    def _map(self, root):
+        """Align the source tokens with the nodes of the unchanged
+        tree of *root*.
+
+        **Returns:**
+            dictionary of nodes mapped to their ``(<start>, <end>)``
+            source region.  *end* is ``None`` if the node has no next
+            sibling with an offset
+
+        """
+        nodes = list(reversed(list(root.itersiblings(preceding=True))))
+        nodes.extend(root.iter())
+        nodes.extend(root.itersiblings())
+
+        tokens = scan(self.__html)
+        starts = {}
+        index = 0
+        for node in nodes:
+            kind = _kind(node)
+            if kind[0] is None:
+                continue
+            line = node.sourceline
+            if line is not None and line >= MAX_LINE:
+                line = None
+
+            # Skip the tokens that the parser dropped.
+            while (index < len(tokens) and line is not None and
+                   tokens[index][3] < line and tokens[index][:2] != kind):
+                index += 1
+            if index >= len(tokens):
+                break
+
+            token = tokens[index]
+            if token[:2] == kind and line in (None, token[3]):
+                starts[node] = token[2]
+                index += 1
+
+        offsets = {}
+        for node, start in starts.iteritems():
+            following = node.getnext()
+            offsets[node] = (start, starts.get(following))
+
+        return offsets
+
+    def touch(self, node, operation):
+        """Record that *operation* is about to change *node*.  Must be
+        called before the change is made.
+
+        """
+        if self.__offsets is None:
+            root = node.getroottree().getroot()
+            self.__offsets = self._map(root)
+
+        if operation in STRUCTURAL:
+            node = node.getparent()
+        self.__touched.append(node)
+
+    def _region(self, node, root):
+        """Source region of the smallest unchanged-source node that
+        holds *node*.
+
+        **Returns:**
+            tuple of the form ``(<start>, <end>, <node>)``, ``False``
+            if *node* was removed from *root* or ``None`` if no region
+            holds it
+
+        """
+        ancestor = node
+        while ancestor is not None and ancestor is not root:
+            ancestor = ancestor.getparent()
+        if ancestor is None:
+            return False
+
+        while node is not None:
+            start, end = self.__offsets.get(node, (None, None))
+            if start is not None and end is not None:
+                return (start, end, node)
+            node = node.getparent()
+
+        return None
+
+    def serialise(self, root):
+        """Serialise the munged *root*.
+
+        **Returns:**
+            the HTML document as a string
+
+        """
+        if not self.__touched:
+            return self.__html
+
+        regions = {}
+        for node in self.__touched:
+            region = self._region(node, root)
+            if region is None:
+                return lxml.html.tostring(root)
+            if region:
+                regions[region[2]] = region
+
+        # Drop the regions that lie within another.
+        spliced = []
+        for start, end, node in sorted(regions.itervalues()):
+            if spliced and start < spliced[-1][1]:
+                continue
+            spliced.append((start, end, node))
+
+        pieces = []
+        pos = 0
+        for start, end, node in spliced:
+            pieces.append(self.__html[pos:start])
+            pieces.append(lxml.html.tostring(node))
+            pos = end
+        pieces.append(self.__html[pos:])
+
+        return ''.join(pieces)
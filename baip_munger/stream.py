@@ -0,0 +1,147 @@
+import struct
+
+import baip_munger.munger
+from logga.log import log
+
+__all__ = ['FRAMINGS', 'read_frames', 'write_frame', 'munge_stream']
+
+# Supported stream framings.  "length" prefixes each document with its
+# size as a 4-byte big-endian unsigned integer.  "nul" terminates each
+# document with a NUL byte.
+FRAMINGS = ['length', 'nul']
+
+HEADER = struct.Struct('>I')
+
+# Read size used when scanning for NUL delimiters.
+CHUNK_SIZE = 65536
+
+
+def _read_exact(in_fh, size):
+    """Read exactly *size* bytes from *in_fh*.  Returns ``None`` on a
+    clean end of stream and raises ``IOError`` if the stream ends
+    part way through.
+
+    """
+    parts = []
+    remaining = size
+    while remaining:
+        data = in_fh.read(remaining)
+        if not data:
+            if remaining == size:
+                return None
+            raise IOError('Truncated frame: expected %d bytes, got %d' %
+                          (size, size - remaining))
+        parts.append(data)
+        remaining -= len(data)
+
+    return ''.join(parts)
+
+
+def read_frames(in_fh, framing='length'):
+    """Generator of the documents read from the *in_fh* stream.
+
+    **Args:**
+        *in_fh*: binary file-like object
+
+        *framing*: one of :data:`FRAMINGS`
+
+    """
+    if framing == 'length':
+        while True:
+            header = _read_exact(in_fh, HEADER.size)
+            if header is None:
+                break
+
+            size, = HEADER.unpack(header)
+            data = str()
+            if size:
+                data = _read_exact(in_fh, size)
+                if data is None:
+                    raise IOError('Truncated frame: expected %d bytes' %
+                                  size)
+            yield data
+    elif framing == 'nul':
+        parts = []
+        while True:
+            chunk = in_fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            start = 0
+            while True:
+                index = chunk.find('\0', start)
+                if index < 0:
+                    parts.append(chunk[start:])
+                    break
+
+                parts.append(chunk[start:index])
+                yield ''.join(parts)
+                parts = []
+                start = index + 1
+
+        # A final document without a trailing delimiter.
+        if any(parts):
+            yield ''.join(parts)
+    else:
+        raise ValueError('Unknown stream framing "%s"' % framing)
+
+
+def write_frame(out_fh, data, framing='length'):
+    """Write the *data* document to the *out_fh* stream with *framing*
+    and flush so that downstream pipeline stages see it immediately.
+
+    """
+    if framing == 'length':
+        out_fh.write(HEADER.pack(len(data)))
+        out_fh.write(data)
+    elif framing == 'nul':
+        out_fh.write(data)
+        out_fh.write('\0')
+    else:
+        raise ValueError('Unknown stream framing "%s"' % framing)
+
+    out_fh.flush()
+
+
+def munge_stream(actions, in_fh, out_fh, framing='length'):
+    """Munge each document read from *in_fh* and write the result to
+    *out_fh* in the same *framing*.
+
+    The *actions* plan is applied by a single
+    :class:`baip_munger.Munger` for the whole stream.  A document that
+    fails to munge is written as an empty frame so that output frames
+    stay aligned with the input.
+
+    **Returns:**
+        dictionary of the form::
+
+            {'documents': <int>, 'munged': <int>, 'failed': [...]}
+
+        where *failed* holds the zero-based stream positions of the
+        documents that could not be munged
+
+    """
+    munger = baip_munger.munger.Munger()
+
+    summary = {'documents': 0, 'munged': 0, 'failed': []}
+    for index, html in enumerate(read_frames(in_fh, framing)):
+        summary['documents'] += 1
+
+        munged = None
+        try:
+            munged = munger.munge_html(actions, html)
+        except Exception as err:
+            log.error('Munge stream document %d failed: %s' % (index, err))
+
+        if munged is None:
+            summary['failed'].append(index)
+            munged = str()
+        else:
+            summary['munged'] += 1
+
+        write_frame(out_fh, munged, framing)
+
+    log.info('Stream munge summary: %d of %d documents munged' %
+             (summary['munged'], summary['documents']))
+
+    return summary
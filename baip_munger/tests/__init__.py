@@ -2,3 +2,19 @@
 """
 from test_munger import TestMunger
 from test_xpathgen import TestXpathGen
+from test_batch import TestBatch
+from test_xslt import TestXsltGen
+from test_metrics import TestMetrics
+from test_stream import TestStream
+from test_watch import TestWatcher
+from test_jobs import TestJobQueue
+from test_shard import TestShard
+from test_schedule import TestSchedule
+from test_route import TestRoute
+from test_profiling import TestProfiling
+from test_analyse import TestAnalyse
+from test_plan import TestPlan
+from test_changes import TestChanges
+from test_splice import TestSplice
+from test_feed import TestFeed
+from test_dedupe import TestDedupe
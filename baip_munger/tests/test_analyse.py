@@ -0,0 +1,110 @@
+import unittest2
+import os
+import lxml.html
+
+import baip_munger
+import baip_munger.analyse
+
+
+class TestAnalyse(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def test_shapes(self):
+        """Identify the known slow XPath shapes.
+        """
+        shapes = baip_munger.analyse.shapes
+
+        msg = 'Leading // with contains() should be flagged'
+        received = shapes("//p[contains(@class, 'MsoListBullet')]")
+        self.assertListEqual(received, ['descendant-contains'], msg)
+
+        msg = '//* should be flagged'
+        received = shapes("//div//*[@class='x']")
+        self.assertListEqual(received, ['descendant-wildcard'], msg)
+
+        msg = 'Descendant step inside a predicate should be flagged'
+        received = shapes("//table[.//td[@class='x']]")
+        self.assertListEqual(received, ['predicate-descendant'], msg)
+
+        msg = 'Separators inside string literals should be ignored'
+        received = shapes("//a[@href='http://x/y']/span")
+        self.assertListEqual(received, [], msg)
+
+    def test_rewrites(self):
+        """Suggest rewrites from the structure of the samples.
+        """
+        # Given a sample document
+        html = """<html><body><div>
+<p class="a"><span>x</span></p><p class="ab"><span>y</span></p>
+</div></body></html>"""
+        roots = [lxml.html.fromstring(html)]
+
+        # when I rewrite the slow shapes
+        rewrites = baip_munger.analyse.rewrites
+        received = rewrites("//p[contains(@class, 'a')]", roots)
+
+        # then the leading step should be tied to its sample path
+        expected = [('exact-match', "//p[@class='a']"),
+                    ('absolute-path',
+                     "/html/body/div/p[contains(@class, 'a')]")]
+        msg = 'contains() rewrites error'
+        self.assertListEqual(received, expected, msg)
+
+        # and //* should be replaced by the single tag it matches
+        received = rewrites("//div//*[.//span]", roots)
+        expected = [('absolute-path', '/html/body/div//*[.//span]'),
+                    ('named-tag', '//div//p[.//span]'),
+                    ('child-step', '//div//*[span]')]
+        msg = 'Wildcard and predicate rewrites error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_analyse(self):
+        """Rank the config XPaths and verify the rewrites.
+        """
+        # Given a config and a sample corpus
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        actions = baip_munger.XpathGen(conf_file).parse_configuration()
+        sample = os.path.join(self._test_dir, 'list_source.html')
+        roots = baip_munger.analyse.load_samples([sample])
+
+        # when I analyse the config
+        analyser = baip_munger.analyse.Analyser(actions, repeat=1)
+        received = analyser.analyse(roots)
+
+        # then every rule XPath should be ranked, most expensive first
+        msg = 'Analysed XPath count error'
+        self.assertEqual(len(received), 7, msg)
+        seconds = [x['seconds'] for x in received]
+        msg = 'XPaths should be ranked by cost'
+        self.assertListEqual(seconds, sorted(seconds, reverse=True), msg)
+
+        # and a rewrite that loses MsoListBullet2 should be rejected
+        entry = [x for x in received
+                 if x['rules'] == ['replace_tags[0]']][0]
+        suggestions = dict((x['xpath'], x['equivalent'])
+                           for x in entry['suggestions'])
+        expected = {
+            "//p[@class='MsoListBullet']": False,
+            "/html/body/p[contains(@class, 'MsoListBullet')]": True,
+        }
+        msg = 'Rewrite equivalence error'
+        self.assertDictEqual(suggestions, expected, msg)
+
+    def test_same_nodes(self):
+        """Compare the node sets of two XPaths.
+        """
+        html = '<html><body><p>a</p><p>b</p></body></html>'
+        roots = [lxml.html.fromstring(html)]
+        same_nodes = baip_munger.analyse.Analyser.same_nodes
+
+        msg = 'Equivalent XPaths should select the same nodes'
+        self.assertTrue(same_nodes('//p', '/html/body/p', roots), msg)
+
+        msg = 'Different XPaths should not select the same nodes'
+        self.assertFalse(same_nodes('//p', '//p[1]', roots), msg)
+
+        msg = 'Invalid rewrites should not be equivalent'
+        self.assertFalse(same_nodes('//p', '//p[', roots), msg)
@@ -0,0 +1,264 @@
+import unittest2
+import os
+import shutil
+import tempfile
+
+import baip_munger
+
+
+class TestBatch(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+        config_file = os.path.join(cls._test_dir, 'baip-munger-lists.xml')
+        cls._actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+    def setUp(self):
+        self._staged_dir = tempfile.mkdtemp()
+        for test_file in ['list_source.html', 'unordered_source.html']:
+            shutil.copy(os.path.join(self._test_dir, test_file),
+                        self._staged_dir)
+        os.makedirs(os.path.join(self._staged_dir, 'nested'))
+        shutil.copy(os.path.join(self._test_dir, 'list_source.html'),
+                    os.path.join(self._staged_dir, 'nested', 'copy.htm'))
+        with open(os.path.join(self._staged_dir, 'ignore.txt'), 'w') as fh:
+            fh.write('banana')
+
+    def test_init(self):
+        """Initialise a baip_munger.Batch()
+        """
+        batch = baip_munger.Batch(self._actions)
+        msg = 'Object is not a baip_munger.Batch'
+        self.assertIsInstance(batch, baip_munger.Batch, msg)
+
+    def test_source_files(self):
+        """Source the staged documents.
+        """
+        # Given a staging directory with nested HTML and non-HTML files
+        staged_dir = self._staged_dir
+
+        # when I source the staged documents
+        batch = baip_munger.Batch(self._actions)
+        received = batch.source_files(staged_dir)
+
+        # then I should receive the relative paths to the HTML files only
+        expected = [
+            'list_source.html',
+            os.path.join('nested', 'copy.htm'),
+            'unordered_source.html',
+        ]
+        msg = 'Staged document list error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_munge(self):
+        """Batch munge a staging directory.
+        """
+        # Given a staging directory
+        staged_dir = self._staged_dir
+
+        # and a target munged directory
+        munged_dir = tempfile.mkdtemp()
+
+        # and the current munged documents metric
+        documents = baip_munger.munger.DOCUMENTS
+        munged = documents.value(status='munged')
+
+        # when I batch munge in parallel
+        batch = baip_munger.Batch(self._actions, workers=2)
+        received = batch.munge(staged_dir, munged_dir)
+
+        # then all documents should be munged
+        expected = {'documents': 3,
+                    'munged': 3,
+                    'failed': [],
+                    'quarantined': []}
+        msg = 'Batch munge summary error'
+        self.assertDictEqual(received, expected, msg)
+
+        # and the worker metrics merged into the parent registry
+        msg = 'Batch munged documents metric error'
+        self.assertEqual(documents.value(status='munged'), munged + 3, msg)
+
+        # and deposited to the same relative path
+        munged_file = os.path.join(munged_dir, 'nested', 'copy.htm')
+        msg = 'Nested munged target file not created'
+        self.assertTrue(os.path.exists(munged_file), msg)
+
+        # Clean up
+        shutil.rmtree(munged_dir)
+
+    def test_munge_releases_document(self):
+        """Batch munge a staging directory: release each munged tree.
+        """
+        # Given a staging directory
+        staged_dir = self._staged_dir
+
+        # and a target munged directory
+        munged_dir = tempfile.mkdtemp()
+
+        # when I batch munge within the current process
+        batch = baip_munger.Batch(self._actions, workers=1)
+        batch.munge(staged_dir, munged_dir)
+
+        # then the worker munger should not hold the last munged tree
+        munger = baip_munger.batch._WORKER['munger']
+        msg = 'Batch worker should release the last munged tree'
+        self.assertIsNone(munger.root, msg)
+
+        # Clean up
+        shutil.rmtree(munged_dir)
+
+    def test_munge_renditions(self):
+        """Batch munge a staging directory: several renditions.
+        """
+        # Given a staging directory
+        staged_dir = self._staged_dir
+
+        # and a target munged directory per rendition
+        munged_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+
+        # when I batch munge a plan per rendition
+        actions = [self._actions, {}]
+        batch = baip_munger.Batch(actions, workers=2)
+        received = batch.munge(staged_dir, munged_dirs)
+
+        # then all documents should be munged
+        expected = {'documents': 3,
+                    'munged': 3,
+                    'failed': [],
+                    'quarantined': []}
+        msg = 'Batch rendition munge summary error'
+        self.assertDictEqual(received, expected, msg)
+
+        # and deposited to each rendition directory
+        for munged_dir in munged_dirs:
+            munged_file = os.path.join(munged_dir, 'nested', 'copy.htm')
+            msg = 'Rendition munged target file not created'
+            self.assertTrue(os.path.exists(munged_file), msg)
+
+        # Clean up
+        for munged_dir in munged_dirs:
+            shutil.rmtree(munged_dir)
+
+    def test_dry_run(self):
+        """Batch dry run a staging directory.
+        """
+        # Given a staging directory
+        staged_dir = self._staged_dir
+
+        # and a target directory that should remain empty
+        munged_dir = tempfile.mkdtemp()
+
+        # when I batch dry run in parallel
+        batch = baip_munger.Batch(self._actions, workers=2)
+        received = batch.dry_run(staged_dir)
+
+        # then all documents should be reported on
+        msg = 'Dry run document count error'
+        self.assertEqual(received['documents'], 3, msg)
+
+        # and the rules presented in plan order including those that
+        # never matched
+        expected = [
+            'replace_tags[0]',
+            'replace_tags[1]',
+            'insert_tags[0]',
+            'insert_tags[1]',
+            'insert_tags[2]',
+            'insert_tags[3]',
+            'attributes[0]',
+        ]
+        msg = 'Dry run rule order error'
+        self.assertListEqual(received['rules'].keys(), expected, msg)
+
+        # and the match counts aggregated across the documents
+        msg = 'Dry run aggregated match count error'
+        self.assertEqual(received['rules']['replace_tags[0]']['matches'],
+                         21,
+                         msg)
+        self.assertEqual(received['rules']['replace_tags[0]']['documents'],
+                         3,
+                         msg)
+
+        # and no output written
+        msg = 'Dry run should not write output'
+        self.assertListEqual(os.listdir(munged_dir), [], msg)
+
+        # Clean up
+        os.rmdir(munged_dir)
+
+    def test_munge_rule_timeout(self):
+        """Batch munge a staging directory: quarantine a slow document.
+        """
+        # Given a staging directory with a pathological document
+        staged_dir = self._staged_dir
+        slow_file = os.path.join(staged_dir, 'slow.html')
+        with open(slow_file, 'w') as slow_fh:
+            slow_fh.write('<html><body>%s</body></html>' %
+                          ('<div class="slow"><p>x</p></div>' * 1000))
+
+        # and a rule whose cost explodes on that document
+        actions = {
+            'attributes': [
+                {
+                    'xpath': ("//div[@class='slow']"
+                              "[count(//*[count(//*) > 0]) < 0]"),
+                    'attribute': 'class',
+                    'value': None,
+                },
+            ],
+        }
+
+        # and a target munged directory
+        munged_dir = tempfile.mkdtemp()
+
+        # when I batch munge with a per-rule time budget
+        batch = baip_munger.Batch(actions, workers=2, rule_timeout=1)
+        received = batch.munge(staged_dir, munged_dir)
+
+        # then the other documents should be munged
+        msg = 'Batch munge with rule timeout munged count error'
+        self.assertEqual(received['munged'], 3, msg)
+
+        # and the slow document quarantined with the rule that was running
+        quarantined = received['quarantined']
+        received = [(x['file'], x['rule'], x['reason']) for x in quarantined]
+        expected = [(slow_file, 'attributes[0]', 'stage budget')]
+        msg = 'Batch munge quarantine report error'
+        self.assertListEqual(received, expected, msg)
+
+        # and no partial output left behind
+        msg = 'Quarantined document output should be removed'
+        self.assertFalse(os.path.exists(os.path.join(munged_dir,
+                                                     'slow.html')), msg)
+
+        # Clean up
+        shutil.rmtree(munged_dir)
+
+    def test_initargs_limited(self):
+        """Only ask pool workers for rule progress when it is enforced.
+        """
+        # Given a batch without limits
+        batch = baip_munger.Batch(self._actions, workers=2)
+
+        # then its workers should not report rule progress
+        msg = 'Unlimited batch workers should not report progress'
+        self.assertFalse(batch._initargs(False)[-1], msg)
+
+        # and given batches with a deadline or a per-rule time budget
+        for kwargs in [{'deadline': 10}, {'rule_timeout': 1}]:
+            batch = baip_munger.Batch(self._actions, workers=2, **kwargs)
+
+            # then their workers should report rule progress
+            msg = 'Limited batch workers should report progress: %s' % kwargs
+            self.assertTrue(batch._initargs(False)[-1], msg)
+
+    def tearDown(self):
+        shutil.rmtree(self._staged_dir)
+        self._staged_dir = None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
+        cls._actions = None
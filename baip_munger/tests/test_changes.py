@@ -0,0 +1,131 @@
+import unittest2
+import os
+import json
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.changes
+
+
+class TestChanges(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def test_record_changes(self):
+        """Record the tree changes of each action.
+        """
+        # Given a document
+        html = ('<html><body><p class="a"> x </p><p class="a">y</p>'
+                '<div><b>z</b></div></body></html>')
+
+        # and a munger that records its changes
+        munger = baip_munger.Munger(html, output='changes')
+
+        # when I apply each type of action
+        munger.update_element_attribute('//p', 'class', 'b')
+        munger.strip_char('//p', ' ')
+        munger.replace_tag('//div', 'span', flatten=True)
+        munger.replace_tag('//p', 'li')
+        munger.insert_tag('//li', 'ul')
+
+        # then each change should be recorded against its path
+        expected = [
+            ['set', '/html/body/p[1]', 'class', 'b'],
+            ['set', '/html/body/p[2]', 'class', 'b'],
+            ['text', '/html/body/p[1]', 'x'],
+            ['replace', '/html/body/div', 'span', [], 'z'],
+            ['rename', '/html/body/p[1]', 'li'],
+            ['rename', '/html/body/p', 'li'],
+            ['wrap', '/html/body', 0, 2, 'ul', 0],
+        ]
+        received = json.loads(json.dumps(munger.changes))
+        msg = 'Recorded changes error'
+        self.assertListEqual(received, expected, msg)
+
+        # and the change set should rebuild the munged document
+        data = baip_munger.changes.dumps(munger.changes,
+                                         baip_munger.changes.digest(html))
+        received = baip_munger.changes.apply_changes(html, data)
+        msg = 'Change set applied to the source error'
+        self.assertEqual(received, munger.dump_root(), msg)
+
+    def test_munge_changes(self):
+        """Munge a file to a change set.
+        """
+        staged_file = os.path.join(self._test_dir, 'list_source.html')
+        with open(staged_file) as html_fh:
+            html = html_fh.read()
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        plan = baip_munger.XpathGen(conf_file).plan
+
+        # Given a munged document and its change set
+        munged_file = os.path.join(self._tmpdir, 'munged.html')
+        baip_munger.Munger().munge(plan, staged_file, munged_file)
+        changes_file = os.path.join(self._tmpdir, 'changes.json')
+        munger = baip_munger.Munger(output='changes')
+        munger.munge(plan, staged_file, changes_file)
+
+        # when I apply the change set to the staged document
+        with open(changes_file) as changes_fh:
+            data = changes_fh.read()
+        received = baip_munger.changes.apply_changes(html, data)
+
+        # then it should rebuild the munged document
+        with open(munged_file) as munged_fh:
+            expected = munged_fh.read()
+        msg = 'Change set does not rebuild the munged document'
+        self.assertEqual(received, expected, msg)
+
+        # and be smaller than the munged document
+        msg = 'Change set should be smaller than the munged document'
+        self.assertLess(len(data), len(expected), msg)
+
+        # and not apply to a different document
+        self.assertRaises(ValueError,
+                          baip_munger.changes.apply_changes,
+                          html.replace('<body', '<body id="x"'),
+                          data)
+
+    def test_batch_changes(self):
+        """Batch munge to change sets.
+        """
+        # Given a staging directory
+        staged_dir = os.path.join(self._tmpdir, 'staged')
+        munged_dir = os.path.join(self._tmpdir, 'munged')
+        os.makedirs(staged_dir)
+        os.makedirs(munged_dir)
+        shutil.copy(os.path.join(self._test_dir, 'unordered_source.html'),
+                    staged_dir)
+
+        # when I batch munge with change set output
+        conf_file = os.path.join(self._test_dir,
+                                 'baip-munger-unordered-list.xml')
+        plan = baip_munger.XpathGen(conf_file).plan
+        batch = baip_munger.Batch(plan, workers=1, output='changes')
+        summary = batch.munge(staged_dir, munged_dir)
+
+        # then the munged path should hold the change set
+        msg = 'Batch change set munge failed'
+        self.assertListEqual(summary['failed'], [], msg)
+        changes_file = os.path.join(munged_dir, 'unordered_source.html')
+        with open(changes_file) as changes_fh:
+            source, changes = baip_munger.changes.loads(changes_fh.read())
+        msg = 'Batch change set should hold changes'
+        self.assertTrue(changes, msg)
+
+        # and the XSLT backend should be rejected
+        self.assertRaises(ValueError,
+                          baip_munger.Batch,
+                          plan,
+                          backend='xslt',
+                          output='changes')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        self._tmpdir = None
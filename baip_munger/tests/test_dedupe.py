@@ -0,0 +1,164 @@
+import unittest2
+import os
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.dedupe
+import baip_munger.changes
+
+
+class TestDedupe(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+        config_file = os.path.join(cls._test_dir, 'baip-munger-lists.xml')
+        cls._actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._staged_dir = os.path.join(self._tmpdir, 'staged')
+        self._munged_dir = os.path.join(self._tmpdir, 'munged')
+        os.makedirs(os.path.join(self._staged_dir, 'nested'))
+
+        source = os.path.join(self._test_dir, 'list_source.html')
+        for relpath in ['a.html', 'c.html', os.path.join('nested', 'b.htm')]:
+            shutil.copy(source, os.path.join(self._staged_dir, relpath))
+        shutil.copy(os.path.join(self._test_dir, 'unordered_source.html'),
+                    self._staged_dir)
+
+    def _path(self, directory, relpath):
+        return os.path.join(directory, *relpath.split('/'))
+
+    def test_digest_file(self):
+        """Digest a file in blocks.
+        """
+        # Given a staged file
+        staged_file = self._path(self._staged_dir, 'a.html')
+
+        # when I digest it in small blocks
+        received = baip_munger.dedupe.digest_file(staged_file, 7)
+
+        # then it should match the digest of its whole content
+        with open(staged_file) as staged_fh:
+            expected = baip_munger.changes.digest(staged_fh.read())
+        msg = 'Block file digest error'
+        self.assertEqual(received, expected, msg)
+
+    def test_group(self):
+        """Group files by the digest of their content.
+        """
+        # Given staged files of which three have the same content
+        paths = [self._path(self._staged_dir, x)
+                 for x in ['c.html',
+                           'nested/b.htm',
+                           'unordered_source.html',
+                           'a.html']]
+
+        # when I group them
+        received = baip_munger.dedupe.group(paths)
+
+        # then only the files with the same content should be grouped
+        expected = [[self._path(self._staged_dir, x)
+                     for x in ['a.html', 'c.html', 'nested/b.htm']]]
+        msg = 'Duplicate groups error'
+        self.assertListEqual(received.values(), expected, msg)
+
+        # and keyed by their digest
+        msg = 'Duplicate group digest error'
+        self.assertEqual(received.keys()[0],
+                         baip_munger.dedupe.digest_file(paths[0]),
+                         msg)
+
+    def test_clone(self):
+        """Clone a file over an existing target.
+        """
+        # Given a source file and an existing target
+        source = self._path(self._staged_dir, 'a.html')
+        target = os.path.join(self._tmpdir, 'target.html')
+        with open(target, 'w') as target_fh:
+            target_fh.write('old')
+
+        # when I clone the source
+        received = baip_munger.dedupe.clone(source, target)
+
+        # then one of the clone methods should be used
+        msg = 'Unknown clone method "%s"' % received
+        self.assertIn(received, baip_munger.dedupe.METHODS, msg)
+
+        # and the target should hold the content of the source
+        with open(source) as source_fh:
+            expected = source_fh.read()
+        with open(target) as target_fh:
+            msg = 'Cloned target content error'
+            self.assertEqual(target_fh.read(), expected, msg)
+
+        # and the temporary file should be gone
+        msg = 'Clone temporary file not removed'
+        self.assertFalse(os.path.exists(target +
+                                        baip_munger.dedupe.TEMP_SUFFIX),
+                         msg)
+
+    def test_munge_dedupe(self):
+        """Batch munge a staging directory with duplicates.
+        """
+        # Given a staging directory with three copies of a document
+        staged_dir = self._staged_dir
+
+        # and the current munged documents metric
+        documents = baip_munger.munger.DOCUMENTS
+        munged = documents.value(status='munged')
+
+        # when I batch munge it with dedupe
+        batch = baip_munger.Batch(self._actions, workers=1, dedupe=True)
+        received = batch.munge(staged_dir, self._munged_dir)
+
+        # then all documents should be reported munged
+        msg = 'Dedupe batch munge summary error'
+        self.assertEqual(received['documents'], 4, msg)
+        self.assertEqual(received['munged'], 4, msg)
+        self.assertListEqual(received['failed'], [], msg)
+
+        # and the copies grouped with the document that was munged
+        expected = [{'digest': baip_munger.dedupe.digest_file(
+                         self._path(staged_dir, 'a.html')),
+                     'file': self._path(staged_dir, 'a.html'),
+                     'copies': [self._path(staged_dir, 'c.html'),
+                                self._path(staged_dir, 'nested/b.htm')]}]
+        msg = 'Dedupe batch duplicate groups error'
+        self.assertListEqual(received['duplicates'], expected, msg)
+
+        # and only the unique documents munged
+        msg = 'Dedupe batch munged documents metric error'
+        self.assertEqual(documents.value(status='munged'), munged + 2, msg)
+
+        # and each copy should hold the munged document
+        with open(self._path(self._munged_dir, 'a.html')) as munged_fh:
+            expected = munged_fh.read()
+        for relpath in ['c.html', 'nested/b.htm']:
+            with open(self._path(self._munged_dir, relpath)) as munged_fh:
+                msg = 'Munged copy "%s" content error' % relpath
+                self.assertEqual(munged_fh.read(), expected, msg)
+
+    def test_munge_dedupe_failed(self):
+        """Batch munge duplicates of a document that fails.
+        """
+        # Given a staging directory with two empty documents
+        for relpath in ['empty.html', 'nested/empty.htm']:
+            open(self._path(self._staged_dir, relpath), 'w').close()
+
+        # when I batch munge it with dedupe
+        batch = baip_munger.Batch(self._actions, workers=1, dedupe=True)
+        received = batch.munge(self._staged_dir, self._munged_dir)
+
+        # then the empty document and its copy should both fail
+        expected = [self._path(self._staged_dir, 'empty.html'),
+                    self._path(self._staged_dir, 'nested/empty.htm')]
+        msg = 'Failed duplicate not reported'
+        self.assertListEqual(received['failed'], expected, msg)
+        self.assertEqual(received['munged'], 4, msg)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        self._tmpdir = None
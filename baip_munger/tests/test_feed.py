@@ -0,0 +1,151 @@
+import unittest2
+import os
+import shutil
+import tempfile
+import lxml.html
+import lxml.etree
+
+import baip_munger
+import baip_munger.feed
+import baip_munger.changes
+
+
+class TestFeed(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def test_parse_file(self):
+        """Feed parse a file in blocks.
+        """
+        # Given a document with scripts and conditional comments
+        html_file = os.path.join(self._test_dir,
+                                 '1134-coal-and-hydrocarbons.htm')
+        with open(html_file) as html_fh:
+            html = html_fh.read()
+        expected = lxml.html.tostring(lxml.html.fromstring(html))
+
+        # when I feed parse it with blocks that split its end tags
+        for block_size in (8, 304, 1229, baip_munger.feed.BLOCK_SIZE):
+            for use_mmap in (False, True):
+                root, size, source = baip_munger.feed.parse_file(html_file,
+                                                                 block_size,
+                                                                 use_mmap)
+
+                # then the tree should match a whole document parse
+                msg = 'Feed parse error: block size %d' % block_size
+                self.assertEqual(lxml.html.tostring(root), expected, msg)
+
+                # and the size and digest should be of the whole file
+                msg = 'Feed parse size/digest error'
+                self.assertEqual(size, len(html), msg)
+                self.assertEqual(source,
+                                 baip_munger.changes.digest(html),
+                                 msg)
+
+    def test_parse_file_fragment(self):
+        """Feed parse a fragment and an empty file.
+        """
+        # Given a fragment
+        html_file = os.path.join(self._tmpdir, 'fragment.html')
+        with open(html_file, 'w') as html_fh:
+            html_fh.write('<p class="a">x</p>')
+
+        # when I feed parse it
+        root = baip_munger.feed.parse_file(html_file, 4)[0]
+
+        # then it should parse as per lxml.html.fromstring
+        msg = 'Fragment feed parse error'
+        self.assertEqual(lxml.html.tostring(root),
+                         '<p class="a">x</p>',
+                         msg)
+
+        # and an empty file should be rejected
+        open(html_file, 'w').close()
+        self.assertRaises(lxml.etree.ParserError,
+                          baip_munger.feed.parse_file,
+                          html_file)
+
+    def test_read_ahead_error(self):
+        """Raise a reader error to the caller.
+        """
+        # Given blocks that fail after the first
+        def blocks():
+            yield 'a'
+            raise IOError('Read failed')
+
+        # when I read them ahead then the error should reach the caller
+        received = []
+        with self.assertRaises(IOError):
+            for block in baip_munger.feed.read_ahead(blocks()):
+                received.append(block)
+
+        # after the blocks read
+        msg = 'Blocks read before the error not returned'
+        self.assertListEqual(received, ['a'], msg)
+
+    def test_munge_block_size(self):
+        """Munge a file with a block feed parse.
+        """
+        staged_file = os.path.join(self._test_dir, 'list_source.html')
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        plan = baip_munger.XpathGen(conf_file).plan
+
+        # Given a munged document
+        munged_file = os.path.join(self._tmpdir, 'munged.html')
+        baip_munger.Munger().munge(plan, staged_file, munged_file)
+
+        # when I munge it with a block size
+        fed_file = os.path.join(self._tmpdir, 'fed.html')
+        munger = baip_munger.Munger(block_size=64)
+        received = munger.munge(plan, staged_file, fed_file)
+
+        # then the munged documents should match
+        msg = 'Block size munge failed'
+        self.assertTrue(received, msg)
+        with open(munged_file) as munged_fh:
+            expected = munged_fh.read()
+        with open(fed_file) as fed_fh:
+            received = fed_fh.read()
+        msg = 'Block size munge differs from a whole read munge'
+        self.assertEqual(received, expected, msg)
+
+        # and its change set should apply to the staged document
+        changes_file = os.path.join(self._tmpdir, 'changes.json')
+        munger = baip_munger.Munger(output='changes', block_size=64)
+        munger.munge(plan, staged_file, changes_file)
+        with open(staged_file) as html_fh:
+            html = html_fh.read()
+        with open(changes_file) as changes_fh:
+            received = baip_munger.changes.apply_changes(html,
+                                                         changes_fh.read())
+        msg = 'Block size change set error'
+        self.assertEqual(received, expected, msg)
+
+    def test_peak_memory(self):
+        """Measure the peak memory of a generated document parse.
+        """
+        # Given a generated document
+        html_file = os.path.join(self._tmpdir, 'generated.html')
+        with open(html_file, 'w') as html_fh:
+            written = baip_munger.feed.generate(html_fh, 64 * 1024)
+        msg = 'Generated document size error'
+        self.assertEqual(os.path.getsize(html_file), written, msg)
+        self.assertGreaterEqual(written, 64 * 1024, msg)
+
+        # when I measure its feed parse
+        received = baip_munger.feed.peak_memory(baip_munger.feed.parse_file,
+                                                html_file)
+
+        # then the elapsed time and peak memory should be reported
+        msg = 'Peak memory measurement error'
+        self.assertEqual(len(received), 2, msg)
+        self.assertGreaterEqual(received[1], 0, msg)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        self._tmpdir = None
@@ -0,0 +1,129 @@
+import unittest2
+import os
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.jobs
+
+
+class TestJobQueue(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+        config_file = os.path.join(cls._test_dir, 'baip-munger-lists.xml')
+        cls._actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._staged_dir = os.path.join(self._temp_dir, 'staged')
+        self._munged_dir = os.path.join(self._temp_dir, 'munged')
+        os.makedirs(self._staged_dir)
+        for test_file in ['list_source.html', 'unordered_source.html']:
+            shutil.copy(os.path.join(self._test_dir, test_file),
+                        self._staged_dir)
+        self._queue = baip_munger.jobs.JobQueue(os.path.join(self._temp_dir,
+                                                             'jobs.db'))
+
+    def test_claim_and_finish(self):
+        """Claim pending jobs and record the outcome.
+        """
+        # Given a queue with two documents
+        queue = self._queue
+        received = queue.add([('a.html', 'out/a.html'),
+                              ('b.html', ['r1/b.html', 'r2/b.html'])])
+        msg = 'New job count error'
+        self.assertEqual(received, 2, msg)
+
+        # and re-adding a known document
+        received = queue.add([('a.html', 'out/a.html')])
+        msg = 'Known documents should not be re-queued'
+        self.assertEqual(received, 0, msg)
+
+        # when I claim a job
+        received = queue.claim(1)
+
+        # then I should receive the first pending document
+        expected = [('a.html', 'out/a.html')]
+        msg = 'Claimed jobs error'
+        self.assertListEqual(received, expected, msg)
+
+        # and when I record it as failed
+        queue.finish('a.html', False, 0.5, 'banana')
+
+        # then the queue counts should reflect each state
+        expected = {'pending': 1, 'running': 0, 'done': 0, 'failed': 1}
+        msg = 'Queue state counts error'
+        self.assertDictEqual(queue.counts(), expected, msg)
+
+        # and the error text kept
+        received = queue.jobs('failed')[0]['error']
+        msg = 'Failed job error text error'
+        self.assertEqual(received, 'banana', msg)
+
+        # and the rendition targets preserved on claim
+        received = queue.claim(5)
+        expected = [('b.html', ['r1/b.html', 'r2/b.html'])]
+        msg = 'Claimed rendition jobs error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_release_stale(self):
+        """Release running jobs of a process that has gone.
+        """
+        # Given a job claimed by this (live) process
+        queue = self._queue
+        queue.add([('a.html', 'out/a.html')])
+        queue.claim(1)
+
+        # when I release stale jobs
+        received = queue.release_stale()
+
+        # then the live claim should be kept
+        msg = 'Live running job should not be released'
+        self.assertEqual(received, 0, msg)
+
+        # and when I retry failed jobs
+        queue.finish('a.html', False)
+        received = queue.retry_failed()
+
+        # then the failed job should be pending again
+        msg = 'Retry failed job count error'
+        self.assertEqual(received, 1, msg)
+        self.assertEqual(queue.counts()['pending'], 1, msg)
+
+    def test_batch_munge_queue(self):
+        """Batch munge from a job queue and resume.
+        """
+        # Given a queue of the staged documents
+        queue = self._queue
+        batch = baip_munger.Batch(self._actions, workers=2)
+        received = batch.enqueue(queue, self._staged_dir, self._munged_dir)
+        msg = 'Enqueued job count error'
+        self.assertEqual(received, 2, msg)
+
+        # when I munge the queue
+        received = batch.munge_queue(queue, chunk_size=1)
+
+        # then all jobs should be done
+        msg = 'Queue munge summary error'
+        self.assertEqual(received['munged'], 2, msg)
+        expected = {'pending': 0, 'running': 0, 'done': 2, 'failed': 0}
+        self.assertDictEqual(queue.counts(), expected, msg)
+
+        # and a resumed run should have nothing left to do
+        batch.enqueue(queue, self._staged_dir, self._munged_dir)
+        received = batch.munge_queue(queue)
+        msg = 'Resumed queue munge should skip done jobs'
+        self.assertEqual(received['documents'], 0, msg)
+
+    def tearDown(self):
+        self._queue.close()
+        self._queue = None
+        shutil.rmtree(self._temp_dir)
+        self._temp_dir = None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
+        cls._actions = None
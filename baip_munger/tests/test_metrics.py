@@ -0,0 +1,172 @@
+import unittest2
+import os
+import shutil
+import tempfile
+import urllib2
+
+import baip_munger
+import baip_munger.metrics
+
+
+class TestMetrics(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def test_init(self):
+        """Initialise a baip_munger.metrics.Registry()
+        """
+        registry = baip_munger.metrics.Registry()
+        msg = 'Object is not a baip_munger.metrics.Registry'
+        self.assertIsInstance(registry, baip_munger.metrics.Registry, msg)
+
+    def test_expose_counter(self):
+        """Expose a counter in Prometheus text format.
+        """
+        # Given a registry with a labelled counter
+        registry = baip_munger.metrics.Registry()
+        counter = registry.counter('docs_total', 'Documents', ['status'])
+
+        # when I increment the counter
+        counter.inc(status='munged')
+        counter.inc(2, status='munged')
+        counter.inc(status='fa"iled')
+
+        # then the exposition should present each label set
+        received = registry.expose()
+        expected = """# HELP docs_total Documents
+# TYPE docs_total counter
+docs_total{status="fa\\"iled"} 1.0
+docs_total{status="munged"} 3.0
+"""
+        msg = 'Counter exposition error'
+        self.assertEqual(received, expected, msg)
+
+    def test_expose_histogram(self):
+        """Expose a histogram in Prometheus text format.
+        """
+        # Given a registry with a histogram
+        registry = baip_munger.metrics.Registry()
+        histogram = registry.histogram('latency_seconds',
+                                       'Latency',
+                                       buckets=(0.1, 1.0))
+
+        # when I make some observations
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        # then the exposition should present cumulative buckets
+        received = registry.expose()
+        expected = """# HELP latency_seconds Latency
+# TYPE latency_seconds histogram
+latency_seconds_bucket{le="0.1"} 1.0
+latency_seconds_bucket{le="1.0"} 2.0
+latency_seconds_bucket{le="+Inf"} 3.0
+latency_seconds_sum 5.55
+latency_seconds_count 3.0
+"""
+        msg = 'Histogram exposition error'
+        self.assertEqual(received, expected, msg)
+
+    def test_snapshot_merge(self):
+        """Merge a worker registry snapshot.
+        """
+        # Given a worker registry with samples
+        worker = baip_munger.metrics.Registry()
+        worker.counter('docs_total', 'Documents').inc(2)
+        worker.histogram('latency_seconds', 'Latency').observe(0.2)
+
+        # and a parent registry with the same metrics
+        parent = baip_munger.metrics.Registry()
+        parent.counter('docs_total', 'Documents').inc()
+        parent.histogram('latency_seconds', 'Latency')
+
+        # when I snapshot and reset the worker into the parent
+        parent.merge(worker.snapshot(reset=True))
+
+        # then the parent should aggregate the samples
+        msg = 'Merged counter error'
+        self.assertEqual(parent.metrics['docs_total'].value(), 3, msg)
+        msg = 'Merged histogram error'
+        self.assertEqual(parent.metrics['latency_seconds'].count(), 1, msg)
+
+        # and the worker samples should be reset
+        msg = 'Reset worker counter error'
+        self.assertEqual(worker.metrics['docs_total'].value(), 0, msg)
+
+    def test_write_and_serve(self):
+        """Write metrics to a text file and serve over HTTP.
+        """
+        # Given a registry with a counter
+        registry = baip_munger.metrics.Registry()
+        registry.counter('docs_total', 'Documents').inc()
+
+        # when I write the metrics to a text file
+        temp_dir = tempfile.mkdtemp()
+        metrics_file = os.path.join(temp_dir, 'munger.prom')
+        registry.write(metrics_file)
+
+        # then the file should hold the exposition
+        with open(metrics_file) as metrics_fh:
+            received = metrics_fh.read()
+        msg = 'Metrics text file error'
+        self.assertEqual(received, registry.expose(), msg)
+
+        # and when I serve the metrics on an ephemeral port
+        server = registry.serve(0, address='127.0.0.1')
+        url = 'http://127.0.0.1:%d/metrics' % server.server_port
+        try:
+            received = urllib2.urlopen(url).read()
+        finally:
+            server.shutdown()
+
+        # then the response should hold the exposition
+        msg = 'Metrics HTTP endpoint error'
+        self.assertEqual(received, registry.expose(), msg)
+
+        # Clean up
+        shutil.rmtree(temp_dir)
+
+    def test_munge_metrics(self):
+        """Munge a file: record metrics.
+        """
+        # Given a file to munge
+        munge_infile = os.path.join(self._test_dir, 'list_source.html')
+        temp_dir = tempfile.mkdtemp()
+        munge_outfile = os.path.join(temp_dir, 'list_source.html')
+
+        # and a set of munging actions
+        config_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+        # and the current metric samples
+        documents = baip_munger.munger.DOCUMENTS
+        actions_seconds = baip_munger.munger.ACTION_SECONDS
+        bytes_read = baip_munger.munger.BYTES
+        munged = documents.value(status='munged')
+        insert_tags = actions_seconds.count(action='insert_tag')
+        read = bytes_read.value(direction='read')
+
+        # when I perform a munge action
+        munger = baip_munger.Munger()
+        munger.munge(actions, munge_infile, munge_outfile)
+
+        # then the document, action and byte metrics should be updated
+        msg = 'Munged documents counter error'
+        self.assertEqual(documents.value(status='munged'), munged + 1, msg)
+        msg = 'Insert tag action histogram error'
+        self.assertEqual(actions_seconds.count(action='insert_tag'),
+                         insert_tags + 4,
+                         msg)
+        msg = 'Bytes read counter error'
+        self.assertEqual(bytes_read.value(direction='read'),
+                         read + os.path.getsize(munge_infile),
+                         msg)
+
+        # Clean up
+        shutil.rmtree(temp_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
@@ -342,7 +342,7 @@ class TestMunger(unittest2.TestCase):
         self.assertEqual(received, expected, msg)
 
     def test_replace_tag(self):
-        """Replace element tag.
+        """Replace element tag: flatten.
         """
         # Given a source HTML page
         html = self._source_baip_generated_dots
@@ -353,9 +353,9 @@ class TestMunger(unittest2.TestCase):
         # and an new tag name
         new_tag = 'li'
 
-        # when I attempt to search and replace
+        # when I attempt to search and replace with a text only element
         munger = baip_munger.Munger(html)
-        munger.replace_tag(xpath, new_tag)
+        munger.replace_tag(xpath, new_tag, flatten=True)
         received = munger.dump_root()
 
         # the resultant HTML should present an updated element
@@ -367,7 +367,7 @@ class TestMunger(unittest2.TestCase):
         self.assertEqual(received, expected, msg)
 
     def test_replace_tag_and_add_new_attributes(self):
-        """Replace element tag: add new attributes.
+        """Replace element tag: flatten and add new attributes.
         """
         # Given a source HTML page
         html = self._source_baip_generated_dots
@@ -381,9 +381,9 @@ class TestMunger(unittest2.TestCase):
         # and the new tag's attributes
         new_tag_attributes = [('class', 'MsoListBullet')]
 
-        # when I attempt to search and replace
+        # when I attempt to search and replace with a text only element
         munger = baip_munger.Munger(html)
-        munger.replace_tag(xpath, new_tag, new_tag_attributes)
+        munger.replace_tag(xpath, new_tag, new_tag_attributes, flatten=True)
         received = munger.dump_root()
 
         # the resultant HTML should present an updated element with new
@@ -396,7 +396,7 @@ class TestMunger(unittest2.TestCase):
         self.assertEqual(received, expected, msg)
 
     def test_replace_tag_and_add_new_boolean_attributes(self):
-        """Replace element tag: add new boolean attributes.
+        """Replace element tag: flatten and add new boolean attributes.
         """
         # Given a source HTML page
         html = self._source_baip_generated_dots
@@ -410,9 +410,9 @@ class TestMunger(unittest2.TestCase):
         # and the new tag's boolean attributes
         new_tag_attributes = [('hidden', None)]
 
-        # when I attempt to search and replace
+        # when I attempt to search and replace with a text only element
         munger = baip_munger.Munger(html)
-        munger.replace_tag(xpath, new_tag, new_tag_attributes)
+        munger.replace_tag(xpath, new_tag, new_tag_attributes, flatten=True)
         received = munger.dump_root()
 
         # the resultant HTML should present an updated element with
@@ -424,6 +424,39 @@ class TestMunger(unittest2.TestCase):
         msg = 'Element tag replace error'
         self.assertEqual(received, expected, msg)
 
+    def test_replace_tag_in_place(self):
+        """Replace element tag: rename in place.
+        """
+        # Given a source HTML snippet with child markup and tail text
+        html = ('<div><p class="a">One <b>bold</b> <a href="#">link</a>'
+                '</p>tail<p class="a">Two</p></div>')
+
+        # and an xpath definition to target a HTML element
+        xpath = "//p[@class='a']"
+
+        # when I attempt to search and replace
+        munger = baip_munger.Munger(html)
+        munger.replace_tag(xpath, 'li')
+        received = munger.dump_root()
+
+        # then the elements should be renamed with children, attributes
+        # and tails preserved
+        expected = ('<div><li class="a">One <b>bold</b> <a href="#">link</a>'
+                    '</li>tail<li class="a">Two</li></div>')
+        msg = 'Element tag rename in place error'
+        self.assertEqual(received, expected, msg)
+
+        # and when I rename with new attributes
+        munger.replace_tag('//li', 'p', [('id', 'x'), ('hidden', None)])
+        received = munger.dump_root()
+
+        # then the existing attributes should be replaced
+        expected = ('<div><p id="x" hidden="">One <b>bold</b> '
+                    '<a href="#">link</a></p>tail<p id="x" hidden="">Two</p>'
+                    '</div>')
+        msg = 'Element tag rename in place with new attributes error'
+        self.assertEqual(received, expected, msg)
+
     def test_insert_tag(self):
         """Insert parent element tag.
         """
@@ -499,6 +532,35 @@ class TestMunger(unittest2.TestCase):
         msg = 'Element tag text strip error'
         self.assertEqual(received, expected, msg)
 
+    def test_regex_replace(self):
+        """Replace regular expression matches in element text.
+        """
+        # Given a source HTML page with nested matches
+        html = (u'<html><body><div class="x">\xb7 a\xa0\xa0b'
+                u'<div class="x">\u2018c\u2019</div>\xa0\xa0d</div>'
+                u'\xa0\xa0e</body></html>')
+
+        # when I collapse the non-breaking space runs of each match
+        munger = baip_munger.Munger(html)
+        munger.regex_replace("//div[re:test(@class, '^x$')]",
+                             u'\xa0{2,}',
+                             u'\xa0')
+        munger.regex_replace('//div', u'^\xb7\\s*')
+        munger.regex_replace('//div', u'[\u2018\u2019]', "'")
+        received = munger.dump_root()
+
+        # then the text and tails of the matched subtrees should change
+        # once and the text outside of them should not
+        expected = ('<html><body><div class="x">a&#160;b'
+                    '<div class="x">\'c\'</div>&#160;d</div>'
+                    '&#160;e</body></html>')
+        msg = 'Element text regex replace error'
+        self.assertEqual(received, expected, msg)
+
+        # and each pattern should be compiled once
+        msg = 'Regex replace pattern cache error'
+        self.assertIn(u'\xa0{2,}', baip_munger.munger.PATTERNS, msg)
+
     def test_munge(self):
         """Munge a file.
         """
@@ -650,6 +712,316 @@ class TestMunger(unittest2.TestCase):
         remove_files(get_directory_files_list(temp_dir))
         os.removedirs(temp_dir)
 
+    def test_plan_rules(self):
+        """Flatten an action plan into rule application order.
+        """
+        # Given a set of munging actions
+        config_file = os.path.join(self._test_dir,
+                                   'baip-munger-update-attr.xml')
+        conf = baip_munger.XpathGen(config_file)
+        actions = conf.parse_configuration()
+
+        # when I flatten the plan
+        received = [(x[0], x[1])
+                    for x in baip_munger.Munger.plan_rules(actions)]
+
+        # then the rules should be presented in munge order
+        expected = [
+            ('replace_tags[0]', 'replace_tag'),
+            ('insert_tags[0]', 'insert_tag'),
+            ('attributes[0]', 'update_element_attribute'),
+            ('attributes[1]', 'update_element_attribute'),
+            ('attributes[2]', 'update_element_attribute'),
+            ('attributes[3]', 'update_element_attribute'),
+            ('attributes[4]', 'update_element_attribute'),
+            ('attributes[5]', 'update_element_attribute'),
+            ('strip_chars[0]', 'strip_char'),
+        ]
+        msg = 'Flattened action plan error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_apply_guards(self):
+        """Apply actions: rules with a failed when guard are skipped.
+        """
+        # Given a document without tables
+        html = ("<html><body><p class='MsoListBullet'>one</p>"
+                "<p class='MsoListBullet'>two</p></body></html>")
+
+        # and a set of munging actions with guarded rules
+        config_file = os.path.join(self._test_dir,
+                                   'baip-munger-guards.xml')
+        conf = baip_munger.XpathGen(config_file)
+        actions = conf.parse_configuration()
+
+        # when I apply the actions
+        munger = baip_munger.Munger(html)
+        stages = []
+        munger.progress = stages.append
+        munger.apply(actions)
+        received = munger.dump_root()
+
+        # then only the rules whose guards hold should be applied
+        expected = ('<html><body id="munged"><li class="MsoListBullet">one'
+                    '</li><li class="MsoListBullet">two</li></body></html>')
+        msg = 'Guarded munge error'
+        self.assertEqual(received, expected, msg)
+        msg = 'Skipped rules should not be reported'
+        self.assertListEqual(stages,
+                             ['replace_tags[0]', 'attributes[2]'],
+                             msg)
+
+    def test_apply_context(self):
+        """Apply actions: rules relative to a shared context.
+        """
+        # Given a document with header row and plain tables
+        html = ('<html><body>'
+                '<table class="TableBAHeaderRow"><thead><tr>'
+                '<td><p class="TableHeading">H</p></td>'
+                '</tr></thead><tbody><tr><td><p>x</p></td></tr></tbody>'
+                '</table>'
+                '<table><thead><tr>'
+                '<td><p class="TableHeading">J</p></td>'
+                '</tr></thead><tbody><tr><td><p>y</p></td></tr></tbody>'
+                '</table>'
+                '</body></html>')
+
+        # and a set of munging actions with nested Sections
+        config_file = os.path.join(self._test_dir,
+                                   'baip-munger-context.xml')
+        conf = baip_munger.XpathGen(config_file)
+        actions = conf.parse_configuration()
+
+        # when I apply the actions
+        munger = baip_munger.Munger(html)
+        munger.apply(actions)
+        received = munger.dump_root()
+
+        # then only the header row table should be munged
+        expected = ('<html><body>'
+                    '<table class="TableBAHeaderRow" summary="header">'
+                    '<thead><tr>'
+                    '<td nowrap><p class="TableText">H</p></td>'
+                    '</tr></thead>'
+                    '<tbody><tr><td><span>x</span></td></tr></tbody>'
+                    '</table>'
+                    '<table><thead><tr>'
+                    '<td><p class="TableHeading">J</p></td>'
+                    '</tr></thead><tbody><tr><td><p>y</p></td></tr></tbody>'
+                    '</table>'
+                    '</body></html>')
+        msg = 'Context munge error'
+        self.assertEqual(received, expected, msg)
+
+    def test_select_context_document_order(self):
+        """Select elements relative to overlapping context matches.
+        """
+        # Given a document with nested div elements
+        html = ('<html><body><div id="a"><p id="1"></p>'
+                '<div id="b"><p id="2"></p></div><p id="3"></p>'
+                '</div></body></html>')
+        munger = baip_munger.Munger(html)
+
+        # when I select descendants of every div
+        received = [x.get('id') for x in munger.select('.//p', ['//div'])]
+
+        # then each match should be returned once in document order
+        expected = ['1', '2', '3']
+        msg = 'Context selection document order error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_dry_run(self):
+        """Dry run a file.
+        """
+        # Given a file to dry run
+        test_file = 'list_source.html'
+        munge_infile = os.path.join(self._test_dir, test_file)
+
+        # and a set of munging actions with list context
+        config_file = os.path.join(self._test_dir,
+                                   'baip-munger-lists.xml')
+        conf = baip_munger.XpathGen(config_file)
+        actions = conf.parse_configuration()
+
+        # when I perform a simulated dry run
+        munger = baip_munger.Munger()
+        received = munger.dry_run(actions, munge_infile)
+
+        # then the later rules should match the tags produced by the
+        # earlier rules
+        counts = dict((x[0], x[2]) for x in received)
+        msg = 'Dry run replace tag match count error'
+        self.assertEqual(counts['replace_tags[0]'], 7, msg)
+        msg = 'Dry run simulated insert tag match count error'
+        self.assertEqual(counts['insert_tags[0]'], 7, msg)
+
+        # and when I dry run without simulation
+        received = munger.dry_run(actions, munge_infile, simulate=False)
+
+        # then the later rules should only see the original document
+        counts = dict((x[0], x[2]) for x in received)
+        msg = 'Dry run unsimulated insert tag match count error'
+        self.assertEqual(counts['insert_tags[0]'], 0, msg)
+
+    def test_dry_run_read_by_later(self):
+        """Dry run a file: only simulate rules that later rules read.
+        """
+        # Given a file to dry run
+        munge_infile = os.path.join(self._test_dir, 'list_source.html')
+
+        # and attribute rules of which only the first is read by a
+        # later rule
+        actions = {
+            'attributes': [
+                {'xpath': '//p', 'attribute': 'data-a', 'value': 'x',
+                 'add': True},
+                {'xpath': '//p', 'attribute': 'data-b', 'value': 'y',
+                 'add': True},
+                {'xpath': "//p[@data-a='x']", 'attribute': 'class',
+                 'value': None},
+            ],
+        }
+
+        # when I perform a simulated dry run
+        munger = baip_munger.Munger()
+        received = munger.dry_run(actions, munge_infile)
+
+        # then the later rule should match the attribute that was added
+        counts = [x[2] for x in received]
+        msg = 'Dry run simulated attribute match count error'
+        self.assertGreater(counts[0], 0, msg)
+        self.assertEqual(counts[2], counts[0], msg)
+
+        # and the attribute that no later rule reads should not be added
+        msg = 'Dry run should not apply rules that no later rule reads'
+        self.assertEqual(len(munger.root.xpath('//p[@data-a]')),
+                         counts[0],
+                         msg)
+        self.assertListEqual(munger.root.xpath('//p[@data-b]'), [], msg)
+
+    def test_dry_run_missing_input_file(self):
+        """Dry run a file: missing input file.
+        """
+        # Given a set of munging actions
+        config_file = os.path.join(self._test_dir,
+                                   'baip-munger-update-attr.xml')
+        conf = baip_munger.XpathGen(config_file)
+        actions = conf.parse_configuration()
+
+        # when I perform a dry run against a missing file
+        munger = baip_munger.Munger()
+        received = munger.dry_run(actions, 'banana')
+
+        # then I should receive None
+        msg = 'Dry run (missing file) should return None'
+        self.assertIsNone(received, msg)
+
+    def test_munge_renditions(self):
+        """Munge a file: several renditions from one parse.
+        """
+        # Given a file to munge
+        test_file = 'list_source.html'
+        munge_infile = os.path.join(self._test_dir, test_file)
+
+        # and a target munged file per rendition
+        temp_dir = tempfile.mkdtemp()
+        munge_outfiles = [os.path.join(temp_dir, 'lists.html'),
+                          os.path.join(temp_dir, 'unordered.html')]
+
+        # and a set of munging actions per rendition
+        actions = []
+        for config in ['baip-munger-lists.xml',
+                       'baip-munger-unordered-list.xml']:
+            config_file = os.path.join(self._test_dir, config)
+            conf = baip_munger.XpathGen(config_file)
+            actions.append(conf.parse_configuration())
+
+        # when I perform a munge action
+        munger = baip_munger.Munger()
+        received = munger.munge(actions, munge_infile, munge_outfiles)
+
+        # then the munge should occur without error
+        msg = 'Munger UI munge (renditions) should return True'
+        self.assertTrue(received, msg)
+
+        # and each rendition should match a single plan munge
+        for rendition_actions, munge_outfile in zip(actions, munge_outfiles):
+            single = baip_munger.Munger()
+            single.munge(rendition_actions,
+                         munge_infile,
+                         os.path.join(temp_dir, 'single.html'))
+            expected = single.dump_root()
+
+            with open(munge_outfile) as munged_fh:
+                received = munged_fh.read()
+            msg = 'Rendition munge error: %s' % munge_outfile
+            self.assertEqual(received, expected, msg)
+
+        # and the parsed source should remain unmodified
+        source = baip_munger.Munger(open(munge_infile).read())
+        msg = 'Rendition munge should not modify the parsed source'
+        self.assertEqual(munger.dump_root(), source.dump_root(), msg)
+
+        # Clean up
+        remove_files(get_directory_files_list(temp_dir))
+        os.removedirs(temp_dir)
+
+    def test_munge_renditions_mismatch(self):
+        """Munge a file: fewer rendition plans than munged files.
+        """
+        # Given a file to munge
+        munge_infile = os.path.join(self._test_dir, 'list_source.html')
+
+        # and two target munged files
+        temp_dir = tempfile.mkdtemp()
+        munge_outfiles = [os.path.join(temp_dir, 'lists.html'),
+                          os.path.join(temp_dir, 'unordered.html')]
+
+        # and a single set of munging actions
+        config_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        actions = [baip_munger.XpathGen(config_file).parse_configuration()]
+
+        # when I perform a munge action
+        # then it should fail rather than drop a rendition
+        munger = baip_munger.Munger()
+        self.assertRaises(ValueError,
+                          munger.munge,
+                          actions,
+                          munge_infile,
+                          munge_outfiles)
+
+        # and no munged file should be written
+        msg = 'Mismatched rendition munge should not write output'
+        self.assertListEqual(os.listdir(temp_dir), [], msg)
+
+        # Clean up
+        os.rmdir(temp_dir)
+
+    def test_munge_html(self):
+        """Munge an in-memory document: release the munged tree.
+        """
+        # Given an HTML document
+        munge_infile = os.path.join(self._test_dir, 'list_source.html')
+        with open(munge_infile) as html_fh:
+            html = html_fh.read()
+
+        # and a set of munging actions
+        config_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+        # when I munge the document in memory
+        munger = baip_munger.Munger()
+        received = munger.munge_html(actions, html)
+
+        # then the munged document should be returned
+        expected = baip_munger.Munger(html)
+        expected.apply(actions)
+        msg = 'In-memory munge output error'
+        self.assertEqual(received, expected.dump_root(), msg)
+
+        # and the munged tree should not be kept
+        msg = 'In-memory munge should release the munged tree'
+        self.assertIsNone(munger.root, msg)
+
     def test_munge_missing_input_file(self):
         """Munge a file: missing input file.
         """
@@ -0,0 +1,204 @@
+import unittest2
+import os
+import pickle
+import multiprocessing.pool
+
+import baip_munger
+import baip_munger.plan
+
+
+class TestPlan(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def test_action(self):
+        """Build an immutable action.
+        """
+        # Given a replace tag action
+        action = baip_munger.plan.ReplaceTag("//p[@class='x']",
+                                             new_tag='li',
+                                             rule_id='replace_tags[0]',
+                                             when=['//table'])
+
+        # then its fields should be attributes
+        msg = 'Action field error'
+        self.assertEqual(action.new_tag, 'li', msg)
+        self.assertTupleEqual(action.when, ('//table',), msg)
+
+        # and its method keywords should leave out the when guard
+        expected = {'xpath': "//p[@class='x']",
+                    'new_tag': 'li',
+                    'new_tag_attributes': []}
+        msg = 'Action keywords error'
+        self.assertDictEqual(action.keywords(), expected, msg)
+
+        # and it should not be altered
+        self.assertRaises(AttributeError, setattr, action, 'new_tag', 'ol')
+        self.assertRaises(AttributeError, setattr, action, 'other', 1)
+
+        # and an equal rule should share its content hash
+        other = baip_munger.plan.ReplaceTag("//p[@class='x']",
+                                            new_tag='li',
+                                            when=['//table'])
+        msg = 'Equal rule content should share the digest'
+        self.assertEqual(action.digest, other.digest, msg)
+
+        # and so should the same rule given as unicode
+        other = baip_munger.plan.ReplaceTag(u"//p[@class='x']",
+                                            new_tag=u'li',
+                                            when=[u'//table'])
+        msg = 'Equal unicode rule content should share the digest'
+        self.assertEqual(action.digest, other.digest, msg)
+
+        # and the digest should be stable across interpreters
+        expected = 'c3a01d7f75a969a4a41023d7cbb36069d9df97fa'
+        msg = 'Rule content digest error'
+        self.assertEqual(action.digest, expected, msg)
+
+    def test_action_typo(self):
+        """Unknown and missing action keywords are rejected.
+        """
+        self.assertRaises(TypeError,
+                          baip_munger.plan.ReplaceTag,
+                          '//p',
+                          new_tga='li')
+        self.assertRaises(TypeError,
+                          baip_munger.plan.StripChars,
+                          '//p')
+        self.assertRaises(TypeError,
+                          baip_munger.Plan.from_dict,
+                          {'replace_tag': [{'xpath': '//p',
+                                            'new_tag': 'li'}]})
+
+    def test_xpathgen_plan(self):
+        """Load a configuration as a plan.
+        """
+        # Given a configuration
+        conf_file = os.path.join(self._test_dir, 'baip-munger-context.xml')
+        conf = baip_munger.XpathGen(conf_file)
+
+        # when I get its plan
+        plan = conf.plan
+
+        # then each rule should know its rule id and source section
+        received = [(x.rule_id, x.section) for x in plan]
+        expected = [('replace_tags[0]', '/Doc/Section/Section[2]'),
+                    ('attributes[0]', '/Doc/Section'),
+                    ('attributes[1]', '/Doc/Section/Section[1]'),
+                    ('attributes[2]', '/Doc/Section/Section[1]/Section')]
+        msg = 'Plan rule id and section error'
+        self.assertListEqual(received, expected, msg)
+
+        # and its dictionary form should match parse_configuration
+        msg = 'Plan dictionary form error'
+        self.assertDictEqual(plan.to_dict(),
+                             conf.parse_configuration(),
+                             msg)
+        self.assertEqual(baip_munger.Plan.from_dict(plan.to_dict()).digest,
+                         plan.digest,
+                         msg)
+
+    def test_serialise(self):
+        """Serialise a plan.
+        """
+        # Given a plan
+        conf_file = os.path.join(self._test_dir, 'baip-munger.xml')
+        conf = baip_munger.XpathGen(conf_file)
+        plan = conf.plan
+
+        # when I serialise it
+        data = plan.dumps()
+
+        # then it should load back to an equal plan
+        received = baip_munger.plan.loads(data)
+        msg = 'Plan serialisation round trip error'
+        self.assertEqual(received, plan, msg)
+        self.assertEqual(received.digest, plan.digest, msg)
+        self.assertEqual(len(set([received, plan])), 1, msg)
+
+        # and pickle to less than the dictionary form
+        pickled = pickle.dumps(plan, pickle.HIGHEST_PROTOCOL)
+        legacy = pickle.dumps(conf.parse_configuration(),
+                              pickle.HIGHEST_PROTOCOL)
+        msg = 'Pickled plan should be smaller than the dictionary form'
+        self.assertLess(len(pickled), len(legacy), msg)
+        msg = 'Unpickled plan error'
+        self.assertEqual(pickle.loads(pickled), plan, msg)
+
+        # and garbage should be rejected
+        self.assertRaises(ValueError, baip_munger.plan.loads, 'garbage')
+
+    def test_apply(self):
+        """Apply a plan with the Munger.
+        """
+        # Given a document
+        html_file = os.path.join(self._test_dir, 'list_source.html')
+        with open(html_file) as html_fh:
+            html = html_fh.read()
+
+        # and a configuration
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        conf = baip_munger.XpathGen(conf_file)
+
+        # when I apply its plan and its dictionary form
+        received = baip_munger.Munger(html)
+        received.apply(conf.plan)
+        expected = baip_munger.Munger(html)
+        expected.apply(conf.parse_configuration())
+
+        # then the munged documents should match
+        msg = 'Plan and dictionary munge differ'
+        self.assertEqual(received.dump_root(), expected.dump_root(), msg)
+
+    def test_apply_documents(self):
+        """Apply one plan to several documents at once.
+        """
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        plan = baip_munger.XpathGen(conf_file).plan
+
+        # Given several documents
+        names = ['list_source.html', 'unordered_source.html', 'source.htm']
+        sources = []
+        for name in names:
+            with open(os.path.join(self._test_dir, name)) as html_fh:
+                sources.append(html_fh.read())
+
+        # when I apply the plan to each document from its own thread
+        def munge(html):
+            with baip_munger.Document(html) as document:
+                return plan.apply(document).serialise()
+
+        pool = multiprocessing.pool.ThreadPool(len(sources))
+        try:
+            received = pool.map(munge, sources * 4)
+        finally:
+            pool.close()
+            pool.join()
+
+        # then each should match a Munger munge of the document
+        expected = []
+        for html in sources * 4:
+            munger = baip_munger.Munger(html)
+            munger.apply(plan)
+            expected.append(munger.dump_root())
+        msg = 'Concurrent plan munge differs from the Munger'
+        self.assertListEqual(received, expected, msg)
+
+    def test_document_close(self):
+        """Release a document's tree on context exit.
+        """
+        # Given a document used as a context manager
+        with baip_munger.Document('<p class="a">x</p>',
+                                  output='changes') as document:
+            document.update_element_attribute('//p', 'class', 'b')
+
+            # then changes should be tracked within the context
+            msg = 'Document changes not tracked'
+            self.assertEqual(len(document.changes), 1, msg)
+
+        # and the tree should be released on exit
+        msg = 'Document tree not released on exit'
+        self.assertIsNone(document.root, msg)
+        self.assertListEqual(document.changes, [], msg)
@@ -0,0 +1,100 @@
+import unittest2
+import os
+import glob
+import time
+import pstats
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.profiling
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestProfiling(unittest2.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def test_stack_sampler(self):
+        """Sample the stack of the current thread.
+        """
+        # Given a stack sampler
+        sampler = baip_munger.profiling.StackSampler(interval=0.002)
+
+        # when I sample a busy function
+        sampler.start()
+        _busy(0.1)
+        sampler.stop()
+
+        # then the collapsed stacks should end in the busy function
+        busy = [x for x in sampler.stacks if ';_busy (' in x]
+        msg = 'Sampled stacks should include the busy function'
+        self.assertTrue(busy, msg)
+
+        # and be written as "<stack> <count>" lines
+        path = os.path.join(self._tmpdir, 'stacks.folded')
+        sampler.write(path)
+        with open(path) as stack_fh:
+            line = stack_fh.readline().rstrip('\n')
+        msg = 'Collapsed stack line error'
+        self.assertRegexpMatches(line, r'^\S.* \d+$', msg)
+
+    def test_batch_profiling(self):
+        """Profile a batch munge across pool workers.
+        """
+        # Given a staging directory
+        test_dir = os.path.join('baip_munger', 'tests', 'files')
+        staged_dir = os.path.join(self._tmpdir, 'staged')
+        munged_dir = os.path.join(self._tmpdir, 'munged')
+        os.makedirs(staged_dir)
+        os.makedirs(munged_dir)
+        for index in range(4):
+            shutil.copy(os.path.join(test_dir, 'list_source.html'),
+                        os.path.join(staged_dir, '%d.html' % index))
+
+        # and a batch that profiles its workers
+        conf_file = os.path.join(test_dir, 'baip-munger-lists.xml')
+        actions = baip_munger.XpathGen(conf_file).parse_configuration()
+        profile = os.path.join(self._tmpdir, 'run')
+        sample_profile = os.path.join(self._tmpdir, 'samples')
+        profiling = {'profile': profile,
+                     'sample_profile': sample_profile,
+                     'interval': 0.001}
+        batch = baip_munger.Batch(actions, workers=2, profiling=profiling)
+
+        # when I munge the staging directory
+        batch.munge(staged_dir, munged_dir)
+
+        # then each worker should write its own profile
+        received = glob.glob('%s.*.pstats' % profile)
+        msg = 'Per-worker profile count error'
+        self.assertEqual(len(received), 2, msg)
+        received = glob.glob('%s.*.folded' % sample_profile)
+        msg = 'Per-worker stack sample count error'
+        self.assertEqual(len(received), 2, msg)
+
+        # and the merged run profile should cover Munger.munge
+        merged = baip_munger.profiling.merge(profile, sample_profile)
+        msg = 'Merged profile files error'
+        self.assertListEqual(merged, ['%s.pstats' % profile,
+                                      '%s.folded' % sample_profile], msg)
+        stats = pstats.Stats(merged[0])
+        munges = [y[0] for x, y in stats.stats.iteritems()
+                  if x[0].endswith('munger.py') and x[2] == 'munge']
+        msg = 'Merged profile Munger.munge call count error'
+        self.assertEqual(sum(munges), 4, msg)
+
+        # and clean should remove the per-worker files
+        baip_munger.profiling.clean(profile, sample_profile)
+        msg = 'Per-worker profiles should be removed'
+        self.assertListEqual(glob.glob('%s.*.pstats' % profile), [], msg)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        self._tmpdir = None
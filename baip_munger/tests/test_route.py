@@ -0,0 +1,175 @@
+import unittest2
+import os
+import json
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.route
+
+
+class TestRoute(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+        cls._word = ('<html><head>'
+                     '<meta name="Generator" content="Microsoft Word 14">'
+                     '<style>p.MsoListBullet, li.MsoListBullet '
+                     '{margin:0cm 0cm 0cm 18.0pt;}</style>'
+                     '</head><body><p class="MsoListBullet">one</p>'
+                     '</body></html>')
+        cls._plain = ('<html><head><title>Plain</title></head>'
+                      '<body><p class="MsoListBullet">one</p>'
+                      '</body></html>')
+
+    def _router(self, default=None):
+        templates = [
+            {
+                'name': 'word',
+                'meta': {'generator': 'Microsoft Word'},
+                'classes': ['MsoListBullet'],
+                'actions': {
+                    'replace_tags': [
+                        {
+                            'xpath': "//p[@class='MsoListBullet']",
+                            'new_tag': 'li',
+                            'new_tag_attributes': [],
+                        },
+                    ],
+                },
+            },
+            {
+                'name': 'titled',
+                'tokens': ['<title>'],
+                'actions': {
+                    'attributes': [
+                        {'xpath': '//p', 'attribute': 'class'},
+                    ],
+                },
+            },
+        ]
+
+        return baip_munger.route.Router(templates, default=default)
+
+    def test_fingerprint(self):
+        """Fingerprint a document from its head.
+        """
+        # Given a Word document
+        root = baip_munger.Munger(self._word).root
+
+        # when I fingerprint the document
+        received = baip_munger.route.fingerprint(root, tokens=('Word',
+                                                               'banana'))
+
+        # then I should receive its named meta, stylesheet classes and
+        # the tokens found in the head
+        expected = ((('generator', 'Microsoft Word 14'),),
+                    frozenset(['MsoListBullet']),
+                    ('Word',))
+        msg = 'Document fingerprint error'
+        self.assertEqual(received, expected, msg)
+
+    def test_route(self):
+        """Route documents to the plan of their template.
+        """
+        # Given a router with two templates
+        router = self._router()
+        before = router.counts()
+
+        # when I munge a Word and a titled document
+        word = baip_munger.Munger(self._word)
+        word.apply(router)
+        plain = baip_munger.Munger(self._plain)
+        plain.apply(router)
+
+        # then each should be munged by its template's plan
+        msg = 'Word template munge error'
+        self.assertIn('<li class="MsoListBullet">one</li>',
+                      word.dump_root(),
+                      msg)
+        msg = 'Titled template munge error'
+        self.assertIn('<p>one</p>', plain.dump_root(), msg)
+
+        # and an untemplated document should be left unchanged
+        html = '<html><body><p class="x">one</p></body></html>'
+        other = baip_munger.Munger(html)
+        other.apply(router)
+        msg = 'Unrouted document should be unchanged'
+        self.assertEqual(other.dump_root(), html, msg)
+
+        # and each template's count reported
+        received = dict((x, y - before[x])
+                        for x, y in router.counts().iteritems())
+        expected = {'word': 1, 'titled': 1, 'default': 0, 'unrouted': 1}
+        msg = 'Template counts error'
+        self.assertDictEqual(received, expected, msg)
+
+    def test_route_default(self):
+        """Route documents: default plan for untemplated documents.
+        """
+        # Given a router with a default plan
+        default = {
+            'attributes': [
+                {'xpath': '//body', 'attribute': 'id', 'value': 'd',
+                 'add': True},
+            ],
+        }
+        router = self._router(default=default)
+
+        # when I route an untemplated document
+        munger = baip_munger.Munger('<html><body></body></html>')
+        received = router.route(munger.root)
+
+        # then it should take the default route
+        msg = 'Default route error'
+        self.assertEqual(received, 'default', msg)
+
+    def test_load(self):
+        """Load a route registry.
+        """
+        # Given a route registry with a template and default config
+        tmpdir = tempfile.mkdtemp()
+        for conf_file in ('baip-munger-lists.xml',
+                          'baip-munger-update-attr.xml'):
+            shutil.copy(os.path.join(self._test_dir, conf_file), tmpdir)
+        registry = {
+            'templates': [
+                {
+                    'name': 'lists',
+                    'config': 'baip-munger-lists.xml',
+                    'classes': ['MsoListBullet'],
+                },
+            ],
+            'default': 'baip-munger-update-attr.xml',
+        }
+        registry_file = os.path.join(tmpdir, 'routes.json')
+        with open(registry_file, 'w') as registry_fh:
+            json.dump(registry, registry_fh)
+
+        # when I load the registry
+        router = baip_munger.route.Router.load(registry_file)
+
+        # then each template's config should be parsed
+        msg = 'Route registry templates error'
+        self.assertEqual([x['name'] for x in router.templates],
+                         ['lists'],
+                         msg)
+        self.assertIn('replace_tags', router.templates[0]['actions'], msg)
+        msg = 'Route registry default error'
+        self.assertIsNotNone(router.default, msg)
+
+        # and a registry without a template config should be rejected
+        with open(registry_file, 'w') as registry_fh:
+            json.dump({'templates': [{'name': 'x'}]}, registry_fh)
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.route.Router.load(registry_file)
+        msg = 'Route registry error code error'
+        self.assertEqual(e.exception.errno, 1005, msg)
+
+        shutil.rmtree(tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
@@ -0,0 +1,90 @@
+import unittest2
+import os
+import time
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.pool
+import baip_munger.schedule
+
+
+def _sleep_worker(item):
+    time.sleep(item * 0.05)
+
+    return item
+
+
+class TestSchedule(unittest2.TestCase):
+
+    def test_cost_model(self):
+        """Predict munge cost from earlier observations.
+        """
+        # Given a cost model with no observations
+        model = baip_munger.schedule.CostModel()
+
+        # then the prediction should fall back to the size
+        msg = 'Cost prediction without observations error'
+        self.assertEqual(model.predict('a.html', 100), 100, msg)
+
+        # and when I record observations
+        model.observe('a.html', 100, 2.0)
+        model.observe('b.html', 300, 2.0)
+
+        # then a known document should scale its observed time by size
+        msg = 'Cost prediction of a known document error'
+        self.assertEqual(model.predict('a.html', 200), 4.0, msg)
+
+        # and an unknown document should use the mean seconds per byte
+        msg = 'Cost prediction of an unknown document error'
+        self.assertEqual(model.predict('c.html', 400), 4.0, msg)
+
+        # and a new observation should change the mean seconds per byte
+        model.observe('d.html', 400, 8.0)
+        msg = 'Cost prediction after a new observation error'
+        self.assertEqual(model.predict('c.html', 400), 6.0, msg)
+
+        # and the observations should survive a save and load
+        temp_dir = tempfile.mkdtemp()
+        model_file = os.path.join(temp_dir, 'cost.json')
+        model.save(model_file)
+        received = baip_munger.schedule.CostModel(model_file)
+        msg = 'Saved cost model error'
+        self.assertEqual(received.predict('a.html', 100), 2.0, msg)
+
+        # Clean up
+        shutil.rmtree(temp_dir)
+
+    def test_batch_schedule(self):
+        """Order batch documents by decreasing predicted cost.
+        """
+        # Given a cost model that knows one small document is slow
+        model = baip_munger.schedule.CostModel()
+        model.observe('slow.html', 10, 5.0)
+        model.observe('big.html', 1000, 1.0)
+
+        # when I schedule the documents
+        batch = baip_munger.Batch({}, cost_model=model)
+        items = [('big.html', None), ('slow.html', None), ('new.html', None)]
+        sizes = {'big.html': 1000, 'slow.html': 10, 'new.html': 100}
+        received = [x[0] for x in batch._schedule(items, sizes)]
+
+        # then the slow document should be munged first
+        expected = ['slow.html', 'big.html', 'new.html']
+        msg = 'Batch cost schedule error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_small_lane(self):
+        """Reserve a worker for the smallest items.
+        """
+        # Given a worker pool with one of two workers reserved for small
+        # items
+        pool = baip_munger.pool.WorkerPool(processes=2, small_lane=1)
+
+        # when I process items ordered largest first
+        received = list(pool.imap_unordered(_sleep_worker, [5, 4, 3, 2, 1]))
+
+        # then the smallest items should complete first
+        msg = 'Small lane items should not wait behind large items'
+        self.assertListEqual(received[:2], [1, 2], msg)
+        self.assertListEqual(sorted(received), [1, 2, 3, 4, 5], msg)
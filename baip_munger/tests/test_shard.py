@@ -0,0 +1,105 @@
+import unittest2
+import os
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.shard
+
+
+class TestShard(unittest2.TestCase):
+
+    def test_parse(self):
+        """Parse a shard specification.
+        """
+        msg = 'Shard specification parse error'
+        self.assertEqual(baip_munger.shard.parse('2/4'), (2, 4), msg)
+
+        for value in ['0/4', '5/4', '1', 'a/b']:
+            self.assertRaises(ValueError, baip_munger.shard.parse, value)
+
+    def test_select_hash(self):
+        """Hash partition a corpus: every document in exactly one shard.
+        """
+        # Given a corpus of relative paths
+        relpaths = [os.path.join('dir%d' % (x % 7), 'doc%d.html' % x)
+                    for x in range(200)]
+
+        # when I select each of four shards
+        shards = [baip_munger.shard.select(relpaths, x, 4)
+                  for x in range(1, 5)]
+
+        # then the shards should cover the corpus exactly once
+        received = sorted(x for shard in shards for x in shard)
+        msg = 'Hash shards do not cover the corpus exactly once'
+        self.assertListEqual(received, sorted(relpaths), msg)
+
+        # and a document's shard should not depend on the corpus
+        received = baip_munger.shard.select(relpaths[:10], 1, 4)
+        expected = [x for x in shards[0] if x in relpaths[:10]]
+        msg = 'Hash shard membership should depend on the path only'
+        self.assertListEqual(received, expected, msg)
+
+    def test_select_size(self):
+        """Size partition a corpus: shards balanced by bytes.
+        """
+        # Given a corpus with one large and several small documents
+        sizes = {'big.html': 100, 'a.html': 40, 'b.html': 30,
+                 'c.html': 20, 'd.html': 10}
+        relpaths = sorted(sizes)
+
+        # when I select each of two shards
+        shards = [baip_munger.shard.select(relpaths, x, 2, 'size', sizes)
+                  for x in (1, 2)]
+
+        # then the large document should be packed on its own
+        expected = [['big.html'], ['a.html', 'b.html', 'c.html', 'd.html']]
+        msg = 'Size balanced shards error'
+        self.assertListEqual(shards, expected, msg)
+
+    def test_merge_summaries(self):
+        """Merge per-shard summaries and report missing shards.
+        """
+        # Given summaries from two of three shards
+        summaries = [
+            {'documents': 2, 'munged': 1, 'failed': ['b'],
+             'quarantined': [], 'shard': '3/3'},
+            {'documents': 1, 'munged': 1, 'failed': [],
+             'quarantined': [], 'shard': '1/3'},
+        ]
+
+        # when I merge them
+        received = baip_munger.shard.merge_summaries(summaries)
+
+        # then the counts should be combined and shard 2 reported missing
+        expected = {'documents': 3,
+                    'munged': 2,
+                    'failed': ['b'],
+                    'quarantined': [],
+                    'shards': [1, 3],
+                    'missing_shards': [2]}
+        msg = 'Merged summary error'
+        self.assertDictEqual(received, expected, msg)
+
+    def test_batch_shard(self):
+        """Batch source files restricted to a shard.
+        """
+        # Given a staging directory
+        staged_dir = tempfile.mkdtemp()
+        for index in range(10):
+            with open(os.path.join(staged_dir, '%d.html' % index), 'w') as fh:
+                fh.write('<p>%s</p>' % ('x' * index))
+
+        # when I source the files of each of two shards
+        received = []
+        for index in (1, 2):
+            batch = baip_munger.Batch({}, shard=(index, 2), sharding='size')
+            received.extend(batch.source_files(staged_dir))
+
+        # then the shards should cover the staged documents once
+        expected = baip_munger.Batch({}).source_files(staged_dir)
+        msg = 'Batch shards do not cover the staging directory'
+        self.assertListEqual(sorted(received), expected, msg)
+
+        # Clean up
+        shutil.rmtree(staged_dir)
@@ -0,0 +1,135 @@
+import unittest2
+import os
+import shutil
+import tempfile
+import lxml.html
+
+import baip_munger
+import baip_munger.splice
+
+
+class TestSplice(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def test_scan(self):
+        """Scan the source tokens of a document.
+        """
+        # Given a document with a comment, a script and a quoted ">"
+        html = ('<!DOCTYPE html>\n<html>\n<!-- c -->\n'
+                '<body title="a>b"><script>if (a<b) {}</script>'
+                '</body></html>')
+
+        # when I scan the document
+        received = baip_munger.splice.scan(html)
+
+        # then each start tag and comment should be located
+        expected = [('start', 'html', 16, 2),
+                    ('comment', None, 23, 3),
+                    ('start', 'body', 34, 4),
+                    ('start', 'script', 52, 4)]
+        msg = 'Scanned source tokens error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_splice_unchanged(self):
+        """Splice a document without changes.
+        """
+        # Given a document with formatting that lxml would not keep
+        html = ('<!DOCTYPE html>\n<html><body>\n<P CLASS=a>x\n'
+                '</body></html>\n')
+
+        # when I munge it without a matching rule
+        munger = baip_munger.Munger(html, output='splice')
+        munger.update_element_attribute('//div', 'class', 'b')
+
+        # then the source should be returned as is
+        msg = 'Unchanged splice should return the source'
+        self.assertEqual(munger.serialise(), html, msg)
+
+    def test_splice_changed(self):
+        """Splice a changed element into its source.
+        """
+        # Given a document
+        html = ('<!DOCTYPE html>\n<html><body>\n<P CLASS=a>x\n'
+                '<p class="a">y</p>\n<div>z</div>\n</body></html>\n')
+
+        # when I change the second paragraph
+        munger = baip_munger.Munger(html, output='splice')
+        munger.update_element_attribute('//p[2]', 'class', 'b')
+
+        # then only that element should be re-serialised
+        expected = ('<!DOCTYPE html>\n<html><body>\n<P CLASS=a>x\n'
+                    '<p class="b">y</p>\n<div>z</div>\n</body></html>\n')
+        msg = 'Spliced document error'
+        self.assertEqual(munger.serialise(), expected, msg)
+
+    def test_splice_replaced(self):
+        """Splice a replaced element by way of its parent.
+        """
+        # Given a document
+        html = ('<html><body>\n<div>\n<b>x</b>\n</div>\n'
+                '<p>y</p>\n</body></html>')
+
+        # when I flatten an element into a new tag
+        munger = baip_munger.Munger(html, output='splice')
+        munger.replace_tag('//b', 'i', flatten=True)
+
+        # then the parent of the replaced element should be spliced
+        expected = ('<html><body>\n<div>\n<i>x</i></div>\n'
+                    '<p>y</p>\n</body></html>')
+        msg = 'Spliced replacement error'
+        self.assertEqual(munger.serialise(), expected, msg)
+
+    def test_splice_no_region(self):
+        """Splice a change to the root element.
+        """
+        # Given a document
+        html = '<html><body><p>x</p></body></html>'
+
+        # when I change the root element
+        munger = baip_munger.Munger(html, output='splice')
+        munger.update_element_attribute('/html', 'lang', 'en')
+
+        # then the whole tree should be serialised
+        msg = 'Root change should serialise the whole tree'
+        self.assertEqual(munger.serialise(), munger.dump_root(), msg)
+
+    def test_munge_splice(self):
+        """Munge a file with splice output.
+        """
+        staged_file = os.path.join(self._test_dir, 'list_source.html')
+        conf_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        plan = baip_munger.XpathGen(conf_file).plan
+
+        # Given a munged document
+        munged_file = os.path.join(self._tmpdir, 'munged.html')
+        baip_munger.Munger().munge(plan, staged_file, munged_file)
+
+        # when I munge the same document with splice output
+        spliced_file = os.path.join(self._tmpdir, 'spliced.html')
+        munger = baip_munger.Munger(output='splice')
+        munger.munge(plan, staged_file, spliced_file)
+
+        # then it should parse to the munged document
+        with open(munged_file) as munged_fh:
+            expected = lxml.html.tostring(lxml.html.parse(munged_fh))
+        with open(spliced_file) as spliced_fh:
+            received = lxml.html.tostring(lxml.html.parse(spliced_fh))
+        msg = 'Spliced document does not match the munged document'
+        self.assertEqual(received, expected, msg)
+
+        # and the XSLT backend should be rejected by a batch
+        self.assertRaises(ValueError,
+                          baip_munger.Batch,
+                          plan,
+                          backend='xslt',
+                          output='splice')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        self._tmpdir = None
@@ -0,0 +1,94 @@
+import unittest2
+import os
+import struct
+import StringIO
+
+import baip_munger
+import baip_munger.stream
+
+
+class TestStream(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def test_read_frames_length(self):
+        """Read length-prefixed frames from a stream.
+        """
+        # Given a stream of length-prefixed documents
+        docs = ['<p>one</p>', '', '<p>three</p>']
+        in_fh = StringIO.StringIO(''.join(struct.pack('>I', len(x)) + x
+                                          for x in docs))
+
+        # when I read the frames
+        received = list(baip_munger.stream.read_frames(in_fh))
+
+        # then I should receive each document
+        msg = 'Length-prefixed frames error'
+        self.assertListEqual(received, docs, msg)
+
+    def test_read_frames_length_truncated(self):
+        """Read length-prefixed frames from a truncated stream.
+        """
+        # Given a stream that ends part way through a document
+        in_fh = StringIO.StringIO(struct.pack('>I', 10) + '<p>')
+
+        # when I read the frames
+        frames = baip_munger.stream.read_frames(in_fh)
+
+        # then an IOError should be raised
+        self.assertRaises(IOError, list, frames)
+
+    def test_read_frames_nul(self):
+        """Read NUL-delimited frames from a stream.
+        """
+        # Given a stream of NUL-delimited documents that spans several
+        # read chunks and has no trailing delimiter
+        docs = ['<p>%s</p>' % ('x' * 70000), '<p>two</p>', '<p>three</p>']
+        in_fh = StringIO.StringIO('\0'.join(docs))
+
+        # when I read the frames
+        received = list(baip_munger.stream.read_frames(in_fh, 'nul'))
+
+        # then I should receive each document
+        msg = 'NUL-delimited frames error'
+        self.assertListEqual(received, docs, msg)
+
+    def test_munge_stream(self):
+        """Munge a stream of documents.
+        """
+        # Given a stream holding a valid and an empty document
+        html_file = os.path.join(self._test_dir, 'list_source.html')
+        with open(html_file) as html_fh:
+            html = html_fh.read()
+        in_fh = StringIO.StringIO(html + '\0' + '\0')
+
+        # and a set of munging actions
+        config_file = os.path.join(self._test_dir, 'baip-munger-lists.xml')
+        actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+        # when I munge the stream
+        out_fh = StringIO.StringIO()
+        received = baip_munger.stream.munge_stream(actions,
+                                                   in_fh,
+                                                   out_fh,
+                                                   framing='nul')
+
+        # then the empty document should be reported as failed
+        expected = {'documents': 2, 'munged': 1, 'failed': [1]}
+        msg = 'Stream munge summary error'
+        self.assertDictEqual(received, expected, msg)
+
+        # and the output frames aligned with the input
+        out_fh.seek(0)
+        frames = list(baip_munger.stream.read_frames(out_fh, 'nul'))
+        munger = baip_munger.Munger(html)
+        munger.apply(actions)
+        expected = [munger.dump_root(), '']
+        msg = 'Stream munge output frames error'
+        self.assertListEqual(frames, expected, msg)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
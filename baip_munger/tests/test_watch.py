@@ -0,0 +1,133 @@
+import unittest2
+import os
+import shutil
+import tempfile
+
+import baip_munger
+import baip_munger.watch
+
+
+class TestWatcher(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+        config_file = os.path.join(cls._test_dir, 'baip-munger-lists.xml')
+        cls._actions = baip_munger.XpathGen(config_file).parse_configuration()
+
+    def setUp(self):
+        self._staged_dir = tempfile.mkdtemp()
+        self._munged_dir = tempfile.mkdtemp()
+        shutil.copy(os.path.join(self._test_dir, 'list_source.html'),
+                    self._staged_dir)
+
+    def _watch(self, source):
+        batch = baip_munger.Batch(self._actions, workers=1)
+
+        return baip_munger.watch.Watcher(batch,
+                                         self._staged_dir,
+                                         self._munged_dir,
+                                         settle=0,
+                                         interval=0,
+                                         source=source)
+
+    def test_poll_existing(self):
+        """Watch: munge documents staged before the watch started.
+        """
+        # Given a watcher over a staging directory with a document
+        source = baip_munger.watch.PollSource(self._staged_dir)
+        watcher = self._watch(source)
+
+        # when I poll for changes
+        received = watcher.poll()
+
+        # then the existing document should be munged
+        expected = {'documents': 1,
+                    'munged': 1,
+                    'failed': [],
+                    'quarantined': []}
+        msg = 'Watch existing document summary error'
+        self.assertDictEqual(received, expected, msg)
+
+        # and it should not be munged again
+        msg = 'Unchanged document should not be munged again'
+        self.assertIsNone(watcher.poll(), msg)
+
+    def test_poll_new_document(self):
+        """Watch: munge a document that arrives during the watch.
+        """
+        # Given a watcher over a staging directory that is up to date
+        source = baip_munger.watch.PollSource(self._staged_dir)
+        watcher = self._watch(source)
+        watcher.poll()
+
+        # when a new document lands in a nested directory
+        os.makedirs(os.path.join(self._staged_dir, 'nested'))
+        shutil.copy(os.path.join(self._test_dir, 'unordered_source.html'),
+                    os.path.join(self._staged_dir, 'nested', 'new.htm'))
+        received = watcher.poll()
+
+        # then it should be munged to the same relative path
+        msg = 'Watch new document munged count error'
+        self.assertEqual(received['munged'], 1, msg)
+        munged_file = os.path.join(self._munged_dir, 'nested', 'new.htm')
+        msg = 'Watch munged target file not created'
+        self.assertTrue(os.path.exists(munged_file), msg)
+
+    def test_settle(self):
+        """Watch: wait for a document to stop changing.
+        """
+        # Given a watcher with a settle period
+        source = baip_munger.watch.PollSource(self._staged_dir)
+        batch = baip_munger.Batch(self._actions, workers=1)
+        watcher = baip_munger.watch.Watcher(batch,
+                                            self._staged_dir,
+                                            self._munged_dir,
+                                            settle=10,
+                                            source=source)
+
+        # when I check for settled documents before the period expires
+        received = watcher.settled()
+
+        # then the document should remain pending
+        msg = 'Document should not settle before the settle period'
+        self.assertListEqual(received, [], msg)
+        self.assertListEqual(watcher.pending.keys(),
+                             ['list_source.html'],
+                             msg)
+
+        # and be released once the period has passed
+        received = watcher.settled(now=watcher.pending.values()[0][1] + 10)
+        msg = 'Document should settle after the settle period'
+        self.assertListEqual(received, ['list_source.html'], msg)
+
+    def test_inotify(self):
+        """Watch: detect a new document with inotify.
+        """
+        if not baip_munger.watch.InotifySource.available():
+            self.skipTest('inotify is not available')
+
+        # Given an inotify source over a staging directory
+        source = baip_munger.watch.InotifySource(self._staged_dir)
+
+        # when a document is written
+        new_file = os.path.join(self._staged_dir, 'new.html')
+        with open(new_file, 'w') as new_fh:
+            new_fh.write('<p>new</p>')
+
+        # then the change should be reported
+        received = source.changes(1)
+        source.close()
+        msg = 'inotify change error'
+        self.assertSetEqual(received, set(['new.html']), msg)
+
+    def tearDown(self):
+        shutil.rmtree(self._staged_dir)
+        shutil.rmtree(self._munged_dir)
+        self._staged_dir = None
+        self._munged_dir = None
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
+        cls._actions = None
@@ -144,6 +144,7 @@ class TestXpathGen(unittest2.TestCase):
                     'chars': u'\xa0\xb7 '
                 }
             ],
+            'regex_replaces': [],
             'replace_tags': [
                 {
                     'xpath': "//ul/p[@class='MsoListBullet']",
@@ -319,6 +320,34 @@ class TestXpathGen(unittest2.TestCase):
         msg = 'Replace tag config items error'
         self.assertListEqual(received, expected, msg)
 
+    def test_parse_replace_tag_flatten(self):
+        """Parse replace tag config items: flatten replace mode.
+        """
+        # Given a sectionReplaceTag configuration element that flattens
+        xpath = "//p[@class='MsoListBullet']"
+        section = lxml.etree.fromstring("""<Section>
+    <xpath>%s</xpath>
+    <sectionReplaceTag>
+        <newTag>li</newTag>
+        <replaceMode>flatten</replaceMode>
+    </sectionReplaceTag>
+</Section>""" % xpath)
+
+        # when I parse the sectionReplaceTag configuration element
+        received = baip_munger.XpathGen._parse_replace_tag(xpath, section)
+
+        # then the config item should request a flatten
+        expected = [
+            {
+                'xpath': xpath,
+                'new_tag_attributes': [],
+                'new_tag': 'li',
+                'flatten': True,
+            }
+        ]
+        msg = 'Replace tag flatten config items error'
+        self.assertListEqual(received, expected, msg)
+
     def test_parse_insert_tag(self):
         """Parse insert tag config items.
         """
@@ -377,6 +406,289 @@ class TestXpathGen(unittest2.TestCase):
         msg = 'Valid config file assignment should produce an ElementTree'
         self.assertIsInstance(expected, lxml.etree._ElementTree, msg)
 
+    def test_config_file_invalid_xpath(self):
+        """Attempt config parse file: invalid XPath expression.
+        """
+        # Given a config file with an XPath syntax error in Section 2
+        conf_file = os.path.join(self._conf_dir,
+                                 'baip-munger-invalid-xpath.xml')
+
+        # when I load the configuration
+        # then I should receive an exception that identifies the Section
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.XpathGen(conf_file)
+
+        msg = 'Invalid XPath error code error'
+        self.assertEqual(e.exception.errno, 1004, msg)
+        msg = 'Invalid XPath section error'
+        self.assertEqual(e.exception.details.get('section'), 2, msg)
+        self.assertEqual(e.exception.details.get('description'),
+                         'Insert an unordered list',
+                         msg)
+
+    def test_config_file_schema_violation(self):
+        """Attempt config parse file: sectionReplaceTag without newTag.
+        """
+        # Given a config file with a sectionReplaceTag in Section 2
+        # that does not define a newTag
+        conf_file = os.path.join(self._conf_dir,
+                                 'baip-munger-replace-tag-no-new-tag.xml')
+
+        # when I load the configuration
+        # then I should receive an exception that identifies the Section
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.XpathGen(conf_file)
+
+        msg = 'Schema violation error code error'
+        self.assertEqual(e.exception.errno, 1003, msg)
+        msg = 'Schema violation section error'
+        self.assertEqual(e.exception.details.get('section'), 2, msg)
+        self.assertEqual(e.exception.details.get('description'),
+                         'Replace tag',
+                         msg)
+
+    def test_config_file_compiled_xpaths(self):
+        """Attempt config parse file: compiled XPath expressions.
+        """
+        # Given a valid config file
+        conf_file = os.path.join(self._conf_dir, 'baip-munger-lists.xml')
+
+        # when I load the configuration
+        xpathgen = baip_munger.XpathGen(conf_file)
+
+        # then each unique XPath expression should be compiled
+        received = xpathgen.xpaths
+        msg = 'Compiled XPath expression count error'
+        self.assertEqual(len(received), 7, msg)
+        xpath = "//p[contains(@class, 'MsoListBullet')]"
+        msg = 'Compiled XPath expression type error'
+        self.assertIsInstance(received.get(xpath), lxml.etree.XPath, msg)
+
+    def test_load_single_pass(self):
+        """Load config in a single pass: plan and load time.
+        """
+        # Given a config file with many Sections
+        conf_fh = tempfile.NamedTemporaryFile(suffix='.xml')
+        sections = []
+        for index in range(500):
+            sections.append("""<Section>
+  <sectionDescription>Section %d</sectionDescription>
+  <xpath>//p[@class='Class%d']</xpath>
+  <sectionAddAttribute>
+    <attributeName>id</attributeName>
+    <attributeValue>p%d</attributeValue>
+  </sectionAddAttribute>
+  <sectionDeleteAttribute>
+    <attributeName>style</attributeName>
+  </sectionDeleteAttribute>
+  <sectionReplaceTag>
+    <newTag>li</newTag>
+    <replaceMode>flatten</replaceMode>
+  </sectionReplaceTag>
+</Section>""" % (index, index % 50, index))
+        conf_fh.write('<Doc>%s</Doc>' % ''.join(sections))
+        conf_fh.flush()
+
+        # when I load the configuration
+        xpathgen = baip_munger.XpathGen(conf_fh.name)
+        received = xpathgen.parse_configuration()
+        conf_fh.close()
+
+        # then the load time should be reported
+        msg = 'Config load time error'
+        self.assertGreater(xpathgen.load_time, 0, msg)
+
+        # and each unique XPath expression compiled once
+        msg = 'Compiled XPath expression count error'
+        self.assertEqual(len(xpathgen.xpaths), 50, msg)
+
+        # and the actions should follow Section order with the delete
+        # ahead of the add within each Section
+        msg = 'Single pass attribute actions error'
+        self.assertEqual(len(received['attributes']), 1000, msg)
+        expected = [
+            {'xpath': "//p[@class='Class1']", 'attribute': 'style'},
+            {'xpath': "//p[@class='Class1']",
+             'attribute': 'id',
+             'value': 'p1',
+             'add': True},
+        ]
+        self.assertListEqual(received['attributes'][2:4], expected, msg)
+        msg = 'Single pass replace tag actions error'
+        expected = {'xpath': "//p[@class='Class0']",
+                    'new_tag': 'li',
+                    'new_tag_attributes': [],
+                    'flatten': True}
+        self.assertDictEqual(received['replace_tags'][0], expected, msg)
+
+    def test_load_not_well_formed(self):
+        """Load config: not well-formed XML.
+        """
+        # Given a config file that is not well-formed
+        conf_fh = tempfile.NamedTemporaryFile(suffix='.xml')
+        conf_fh.write('<Doc><Section><xpath>//p</xpath></Doc>')
+        conf_fh.flush()
+
+        # when I load the configuration
+        # then I should receive a not well-formed error
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.XpathGen(conf_fh.name)
+        conf_fh.close()
+
+        msg = 'Not well-formed error code error'
+        self.assertEqual(e.exception.errno, 1002, msg)
+
+    def test_parse_configuration_copy(self):
+        """Parse configuration: returned plan is a copy.
+        """
+        # Given a loaded configuration
+        conf_file = os.path.join(self._conf_dir,
+                                 'baip-munger-update-attr.xml')
+        xpathgen = baip_munger.XpathGen(conf_file)
+
+        # when I alter the parsed action plan
+        received = xpathgen.parse_configuration()
+        received['attributes'][0]['attribute'] = 'banana'
+        del received['strip_chars'][:]
+
+        # then a second parse should be unaffected
+        received = xpathgen.parse_configuration()
+        msg = 'Parsed configuration should not share state'
+        self.assertEqual(received['attributes'][0]['attribute'], 'class', msg)
+        self.assertEqual(len(received['strip_chars']), 1, msg)
+
+    def test_load_guards(self):
+        """Load config: SectionGroup and Section when guards.
+        """
+        # Given a config file with guarded Sections
+        conf_file = os.path.join(self._conf_dir, 'baip-munger-guards.xml')
+
+        # when I parse the configuration
+        xpathgen = baip_munger.XpathGen(conf_file)
+        received = xpathgen.parse_configuration()
+
+        # then each action should hold the guards of its group and
+        # Section
+        group = "//p[@class='MsoListBullet']"
+        expected = [
+            [group, '//table'],
+            ["//meta[@name='Template'][@content='Report']"],
+            None,
+        ]
+        msg = 'Guarded attribute actions error'
+        self.assertListEqual([x.get('when') for x in received['attributes']],
+                             expected,
+                             msg)
+        msg = 'Guarded replace tag action error'
+        self.assertListEqual(received['replace_tags'][0]['when'], [group], msg)
+
+    def test_load_invalid_guard(self):
+        """Load config: invalid when guard expression.
+        """
+        # Given a config file with an XPath syntax error in a guard
+        conf_fh = tempfile.NamedTemporaryFile(suffix='.xml')
+        conf_fh.write("""<Doc>
+  <Section>
+    <sectionDescription>Bad guard</sectionDescription>
+    <xpath>//p</xpath>
+    <when>//meta[@name='Template'</when>
+    <sectionStripChars><stripChars>x</stripChars></sectionStripChars>
+  </Section>
+</Doc>""")
+        conf_fh.flush()
+
+        # when I load the configuration
+        # then I should receive an exception that identifies the Section
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.XpathGen(conf_fh.name)
+        conf_fh.close()
+
+        msg = 'Invalid guard error code error'
+        self.assertEqual(e.exception.errno, 1004, msg)
+        msg = 'Invalid guard section error'
+        self.assertEqual(e.exception.details.get('description'),
+                         'Bad guard',
+                         msg)
+
+    def test_load_context(self):
+        """Load config: nested Sections relative to a context.
+        """
+        # Given a config file with nested Sections
+        conf_file = os.path.join(self._conf_dir, 'baip-munger-context.xml')
+
+        # when I parse the configuration
+        xpathgen = baip_munger.XpathGen(conf_file)
+        received = xpathgen.parse_configuration()
+
+        # then the nested Section actions should hold the chain of
+        # enclosing Section XPath expressions
+        table = "//table[@class='TableBAHeaderRow']"
+        expected = [None, [table], [table, 'thead/tr/td']]
+        msg = 'Nested Section context error'
+        self.assertListEqual([x.get('context')
+                              for x in received['attributes']],
+                             expected,
+                             msg)
+        msg = 'Nested Section relative XPath error'
+        self.assertEqual(received['attributes'][2]['xpath'],
+                         "p[@class='TableHeading']",
+                         msg)
+        self.assertListEqual(received['replace_tags'][0]['context'],
+                             [table],
+                             msg)
+
+    def test_load_regex_replace(self):
+        """Load config: regex replace actions.
+        """
+        # Given a config file with regex replace actions
+        conf_file = os.path.join(self._conf_dir, 'baip-munger-regex.xml')
+
+        # when I parse the configuration
+        received = baip_munger.XpathGen(conf_file).parse_configuration()
+
+        # then each action should hold its pattern and replacement
+        expected = [
+            {
+                'xpath': "//p[re:test(@class, '^MsoList')]",
+                'pattern': u'^\\s*\xb7\\s*',
+                'replacement': '',
+            },
+            {
+                'xpath': '/html/body',
+                'pattern': u'\xa0{2,}',
+                'replacement': u'\xa0',
+            },
+            {
+                'xpath': '/html/body',
+                'pattern': u'[\u2018\u2019]',
+                'replacement': "'",
+            },
+            {
+                'xpath': '/html/body',
+                'pattern': u'[\u201c\u201d]',
+                'replacement': '"',
+            },
+        ]
+        msg = 'Regex replace config item error'
+        self.assertListEqual(received['regex_replaces'], expected, msg)
+
+    def test_config_file_invalid_regex(self):
+        """Attempt config parse file: invalid regular expression.
+        """
+        # Given a config file with an unbalanced pattern in Section 2
+        conf_file = os.path.join(self._conf_dir,
+                                 'baip-munger-invalid-regex.xml')
+
+        # when I load the configuration
+        # then I should receive an exception that identifies the Section
+        with self.assertRaises(baip_munger.exception.MungerConfigError) as e:
+            baip_munger.XpathGen(conf_file)
+
+        msg = 'Invalid regex error code error'
+        self.assertEqual(e.exception.errno, 1006, msg)
+        msg = 'Invalid regex section error'
+        self.assertEqual(e.exception.details.get('section'), 2, msg)
+
     @classmethod
     def tearDownClass(cls):
         cls._conf_dir = None
@@ -0,0 +1,397 @@
+import unittest2
+import os
+
+import baip_munger
+import baip_munger.xslt
+
+
+class TestXsltGen(unittest2.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._test_dir = os.path.join('baip_munger', 'tests', 'files')
+
+    def _actions(self, conf_file):
+        conf_file = os.path.join(self._test_dir, conf_file)
+
+        return baip_munger.XpathGen(conf_file).parse_configuration()
+
+    def _source(self, html_file):
+        html_fh = open(os.path.join(self._test_dir, html_file))
+        html = html_fh.read()
+        html_fh.close()
+
+        return html
+
+    def test_init(self):
+        """Initialise a baip_munger.XsltGen()
+        """
+        xsltgen = baip_munger.XsltGen({})
+        msg = 'Object is not a baip_munger.XsltGen'
+        self.assertIsInstance(xsltgen, baip_munger.XsltGen, msg)
+
+    def test_is_pattern(self):
+        """Check XPath expressions that can be XSLT match patterns.
+        """
+        # Given a set of XPath expressions
+        xpaths = [
+            "//table[@class='TableBAHeaderRow']/thead/tr/td/p",
+            "//p[contains(@class, 'MsoListBullet')]",
+            "p[@class='MsoListBullet']",
+            "(//p)[1]",
+            "//p/..",
+            "//p[re:test(@class, '^MsoList')]",
+        ]
+
+        # when I check if each can be expressed as a match pattern
+        received = [baip_munger.XsltGen.is_pattern(x) for x in xpaths]
+
+        # then only absolute, pattern compatible expressions should pass
+        expected = [True, True, False, False, False, False]
+        msg = 'XSLT match pattern check error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_segments(self):
+        """Compile an action plan into XSLT and Python segments.
+        """
+        # Given a set of munging actions that includes an insert tag
+        actions = self._actions('baip-munger-update-attr.xml')
+
+        # when I compile the plan
+        xsltgen = baip_munger.XsltGen(actions)
+        received = [(x[0], x[2]) for x in xsltgen.segments]
+
+        # then insert tag should fall back to the Python engine between
+        # the XSLT stylesheets
+        expected = [
+            ('xslt', ['replace_tags[0]']),
+            ('python', actions['insert_tags'][0]),
+            ('xslt', ['attributes[0]',
+                      'attributes[1]',
+                      'attributes[2]',
+                      'attributes[3]',
+                      'attributes[4]',
+                      'attributes[5]',
+                      'strip_chars[0]']),
+        ]
+        msg = 'XSLT segments error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_transform_matches_python_engine(self):
+        """Transform fixtures: XSLT output matches the Python engine.
+        """
+        # Given a set of configurations and source HTML documents
+        fixtures = [
+            ('baip-munger-update-attr.xml', '1123-climate.htm'),
+            ('baip-munger-update-attr.xml',
+             'BA-NSB-GLO-1.1-combined_clean.html'),
+            ('baip-munger-ordered-list.xml',
+             'BA-LEB-GAL-261-1-SWReview-v00_clean.html'),
+            ('baip-munger-lists.xml', 'list_source.html'),
+            ('baip-munger-unordered-list.xml', 'unordered_source.html'),
+            ('baip-munger-regex.xml', '1134-coal-and-hydrocarbons.htm'),
+        ]
+
+        for conf_file, html_file in fixtures:
+            actions = self._actions(conf_file)
+            html = self._source(html_file)
+
+            # when I apply the plan with the Python engine
+            munger = baip_munger.Munger(html)
+            munger.apply(actions)
+            expected = munger.dump_root()
+
+            # and with the compiled XSLT plan
+            munger = baip_munger.Munger(html)
+            munger.apply(baip_munger.XsltGen(actions))
+            received = munger.dump_root()
+
+            # then the munged documents should be the same
+            msg = 'XSLT output error: %s|%s' % (conf_file, html_file)
+            self.assertEqual(received, expected, msg)
+
+    def test_transform_replace_tag_flatten(self):
+        """Transform: flatten replace tag matches the Python engine.
+        """
+        # Given a source HTML document with list item markup
+        html = self._source('1134-coal-and-hydrocarbons.htm')
+
+        for flatten in (False, True):
+            # and a replace tag rule
+            actions = {
+                'replace_tags': [
+                    {
+                        'xpath': "//p[@class='MsoListBullet']",
+                        'new_tag': 'li',
+                        'new_tag_attributes': [],
+                        'flatten': flatten,
+                    },
+                ],
+            }
+
+            # when I apply the plan with the Python engine
+            munger = baip_munger.Munger(html)
+            munger.apply(actions)
+            expected = munger.dump_root()
+
+            # and with the compiled XSLT plan
+            munger = baip_munger.Munger(html)
+            munger.apply(baip_munger.XsltGen(actions))
+            received = munger.dump_root()
+
+            # then the munged documents should be the same
+            msg = 'XSLT replace tag error (flatten: %s)' % flatten
+            self.assertEqual(received, expected, msg)
+
+    def test_transform_guards(self):
+        """Transform: guarded rules match the Python engine.
+        """
+        # Given a source HTML document with list item markup
+        html = self._source('1134-coal-and-hydrocarbons.htm')
+
+        # and a plan with a passing and a failing guard
+        actions = {
+            'replace_tags': [
+                {
+                    'xpath': "//p[@class='MsoListBullet']",
+                    'new_tag': 'li',
+                    'new_tag_attributes': [],
+                    'when': ["//p[@class='MsoListBullet']"],
+                },
+            ],
+            'attributes': [
+                {
+                    'xpath': '//li',
+                    'attribute': 'class',
+                    'when': ["//meta[@content='Banana']"],
+                },
+                {
+                    'xpath': '//body',
+                    'attribute': 'id',
+                    'value': 'munged',
+                    'add': True,
+                },
+            ],
+        }
+
+        # when I apply the plan with the Python engine
+        munger = baip_munger.Munger(html)
+        munger.apply(actions)
+        expected = munger.dump_root()
+
+        # and with the compiled XSLT plan
+        munger = baip_munger.Munger(html)
+        munger.apply(baip_munger.XsltGen(actions))
+        received = munger.dump_root()
+
+        # then the munged documents should be the same
+        msg = 'XSLT guarded transform error'
+        self.assertEqual(received, expected, msg)
+        msg = 'Failed guard should leave the class attributes'
+        self.assertIn('<li class="MsoListBullet">', received, msg)
+
+    def test_segments_context(self):
+        """Compile an action plan: context rules use the Python engine.
+        """
+        # Given an action plan with a rule relative to a context
+        actions = {
+            'attributes': [
+                {
+                    'xpath': 'td',
+                    'attribute': 'nowrap',
+                    'add': True,
+                    'context': ['//tr'],
+                },
+                {
+                    'xpath': '//td',
+                    'attribute': 'width',
+                    'value': '68',
+                    'add': True,
+                },
+            ],
+        }
+
+        # when I compile the plan
+        xsltgen = baip_munger.XsltGen(actions)
+        received = [x[0] for x in xsltgen.segments]
+
+        # then the context rule should fall back to the Python engine
+        expected = ['python', 'xslt']
+        msg = 'Context rule segments error'
+        self.assertListEqual(received, expected, msg)
+
+    def test_transform_strip_char(self):
+        """Transform: strip characters from text and tails.
+        """
+        # Given a source HTML document with bullet glyphs
+        html = self._source('1134-coal-and-hydrocarbons.htm')
+
+        # and a strip chars rule
+        actions = {
+            'strip_chars': [
+                {
+                    'xpath': "//p[@class='MsoListBullet']",
+                    'chars': u'\xb7 ',
+                },
+            ],
+        }
+
+        # when I transform with the compiled XSLT plan
+        munger = baip_munger.Munger(html)
+        munger.apply(baip_munger.XsltGen(actions))
+        received = munger.dump_root()
+
+        # then the result should match the strip text fixture
+        result_file = os.path.join('baip_munger',
+                                   'tests',
+                                   'results',
+                                   '1134-coal-and-hydrocarbons-strip-text.htm')
+        result_fh = open(result_file)
+        expected = result_fh.read().rstrip()
+        result_fh.close()
+        msg = 'XSLT strip chars error'
+        self.assertEqual(received, expected, msg)
+
+    def test_passes(self):
+        """Group attribute rules into passes.
+        """
+        # Given attribute rules where the last reads an attribute that
+        # an earlier rule changes
+        actions = {
+            'attributes': [
+                {'xpath': '//td', 'attribute': 'style', 'value': 'a',
+                 'add': True},
+                {'xpath': '//p', 'attribute': 'class'},
+                {'xpath': '//td', 'attribute': 'width', 'value': '68',
+                 'when': ["//meta[@content='Banana']"]},
+                {'xpath': '//td/p', 'attribute': 'valign',
+                 'value': 'middle', 'old_value': 'top'},
+                {'xpath': '//p', 'attribute': 'class', 'value': 'x',
+                 'add': True},
+                {'xpath': "//p[@class='x']", 'attribute': 'id',
+                 'value': 'y', 'add': True},
+            ],
+            'strip_chars': [
+                {'xpath': '//p', 'chars': ' '},
+            ],
+        }
+
+        # when I compile the plan
+        xsltgen = baip_munger.XsltGen(actions)
+
+        # then the independent rules should share a pass
+        expected = [[[1, 2, 3, 4, 5], [6], [7]]]
+        msg = 'XSLT passes error'
+        self.assertListEqual(xsltgen.passes, expected, msg)
+
+        # and the transform should match the Python engine
+        for html_file in ('1123-climate.htm',
+                          'BA-NSB-GLO-1.1-combined_clean.html'):
+            html = self._source(html_file)
+            munger = baip_munger.Munger(html)
+            munger.apply(actions)
+            expected = munger.dump_root()
+            munger = baip_munger.Munger(html)
+            munger.apply(xsltgen)
+            received = munger.dump_root()
+            msg = 'XSLT grouped pass error: %s' % html_file
+            self.assertEqual(received, expected, msg)
+
+    def test_segments_min_pass_rules(self):
+        """Compile an action plan: opt in to the Python engine for small
+        passes.
+        """
+        # Given a set of munging actions
+        actions = self._actions('baip-munger-update-attr.xml')
+
+        # when I compile the plan by default
+        xsltgen = baip_munger.XsltGen(actions)
+
+        # then the passes of the supported rules should use libxslt
+        received = [x[0] for x in xsltgen.segments]
+        msg = 'Default passes should use libxslt'
+        self.assertListEqual(received, ['xslt', 'python', 'xslt'], msg)
+
+        # and when I compile the plan with the measured crossover
+        crossover = baip_munger.xslt.CROSSOVER_RULES
+        xsltgen = baip_munger.XsltGen(actions, min_pass_rules=crossover)
+
+        # then each small pass should fall back to the Python engine
+        received = set(x[0] for x in xsltgen.segments)
+        msg = 'Small passes should use the Python engine'
+        self.assertSetEqual(received, set(['python']), msg)
+
+    def test_compiled_cache(self):
+        """Compile an action plan: bounded cache of compiled plans.
+        """
+        # Given more distinct plans than the compiled plan cache holds
+        size = baip_munger.xslt.CACHE_SIZE
+        plans = [baip_munger.Plan.from_dict({
+                     'attributes': [{'xpath': '//p',
+                                     'attribute': 'id',
+                                     'value': 'p%d' % x,
+                                     'add': True}]})
+                 for x in range(size + 1)]
+
+        # when I compile each of them
+        compiled = [baip_munger.XsltGen(x).segments for x in plans]
+
+        # then the first plan should have been dropped from the cache
+        msg = 'Least recently used compiled plan should be dropped'
+        received = baip_munger.XsltGen(plans[0]).segments
+        self.assertIsNot(received, compiled[0], msg)
+
+        # and the last plan should still be shared
+        msg = 'Recently used compiled plan should be shared'
+        received = baip_munger.XsltGen(plans[-1]).segments
+        self.assertIs(received, compiled[-1], msg)
+
+    def test_transform_regex_xpath(self):
+        """Transform: EXSLT regex XPath rules use the Python engine.
+        """
+        # Given a source HTML document with list item markup
+        html = self._source('1134-coal-and-hydrocarbons.htm')
+
+        # and rules that select with an EXSLT regular expression
+        actions = {
+            'replace_tags': [
+                {
+                    'xpath': "//p[re:test(@class, '^MsoListBullet$')]",
+                    'new_tag': 'li',
+                    'new_tag_attributes': [],
+                },
+            ],
+            'attributes': [
+                {
+                    'xpath': "//li[re:test(@class, 'Bullet')]",
+                    'attribute': 'id',
+                    'value': 'bullet',
+                    'add': True,
+                },
+            ],
+        }
+
+        # when I compile the plan
+        xsltgen = baip_munger.XsltGen(actions)
+
+        # then the rules should fall back to the Python engine
+        received = [x[0] for x in xsltgen.segments]
+        expected = ['python', 'python']
+        msg = 'Regex XPath rule segments error'
+        self.assertListEqual(received, expected, msg)
+
+        # and the transform should match the Python engine
+        munger = baip_munger.Munger(html)
+        munger.apply(actions)
+        expected = munger.dump_root()
+        munger = baip_munger.Munger(html)
+        munger.apply(xsltgen)
+        received = munger.dump_root()
+        msg = 'XSLT regex XPath transform error'
+        self.assertEqual(received, expected, msg)
+        msg = 'Regex XPath rule not applied'
+        self.assertIn('<li class="MsoListBullet" id="bullet">', received, msg)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._test_dir = None
@@ -0,0 +1,320 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from logga.log import log
+
+__all__ = ['Watcher', 'InotifySource', 'PollSource']
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT = struct.Struct('iIII')
+
+
+def _libc():
+    """Return the C library if it provides inotify.  ``None`` otherwise.
+
+    """
+    libc = None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        libc = None
+
+    return libc
+
+
+class InotifySource(object):
+    """Report files changed under *staged_dir* via Linux inotify.
+
+    Sub-directories are watched recursively, including those created
+    after the watch starts.
+
+    """
+    def __init__(self, staged_dir):
+        self.__libc = _libc()
+        if self.__libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self.__staged_dir = staged_dir
+        self.__dirs = {}
+        self.__fd = self.__libc.inotify_init()
+        if self.__fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        for dirpath, dirnames, filenames in os.walk(staged_dir):
+            self._add_watch(dirpath)
+
+    @classmethod
+    def available(cls):
+        return _libc() is not None
+
+    def _add_watch(self, path):
+        wd = self.__libc.inotify_add_watch(self.__fd,
+                                           path.encode('utf-8'),
+                                           WATCH_MASK)
+        if wd < 0:
+            log.warn('Unable to watch "%s": %s' %
+                     (path, os.strerror(ctypes.get_errno())))
+        else:
+            self.__dirs[wd] = path
+
+    def changes(self, timeout):
+        """Wait up to *timeout* seconds for file events.
+
+        **Returns:**
+            set of changed file paths relative to the staged directory.
+            ``None`` if events were lost and a full rescan is required
+
+        """
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self.__fd, 65536)
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, size = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + size].rstrip('\0')
+            offset += size
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+
+            dirpath = self.__dirs.get(wd)
+            if dirpath is None or not name:
+                continue
+
+            path = os.path.join(dirpath, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for subdir, dirnames, filenames in os.walk(path):
+                        self._add_watch(subdir)
+                        for filename in filenames:
+                            changed.add(os.path.join(subdir, filename))
+            else:
+                changed.add(path)
+
+        return set(os.path.relpath(x, self.__staged_dir) for x in changed)
+
+    def close(self):
+        os.close(self.__fd)
+
+
+class PollSource(object):
+    """Report files changed under *staged_dir* by comparing the size and
+    modification time of each file between scans.
+
+    """
+    def __init__(self, staged_dir):
+        self.__staged_dir = staged_dir
+        self.__snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for dirpath, dirnames, filenames in os.walk(self.__staged_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                relpath = os.path.relpath(path, self.__staged_dir)
+                snapshot[relpath] = (stat.st_size, stat.st_mtime)
+
+        return snapshot
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+
+        snapshot = self._scan()
+        changed = set(x for x, y in snapshot.iteritems()
+                      if self.__snapshot.get(x) != y)
+        self.__snapshot = snapshot
+
+        return changed
+
+    def close(self):
+        pass
+
+
+class Watcher(object):
+    """Munge documents as they land under *staged_dir*.
+
+    A changed document is only munged once its size and modification
+    time have been stable for *settle* seconds so that files still
+    being written are left alone.  On start, documents with a missing
+    or older munged counterpart under *munged_dir* are queued.
+
+    Documents are munged by *batch* (a :class:`baip_munger.Batch`)
+    which should be entered as a context manager by the caller to keep
+    its worker pool warm.
+
+    **Args:**
+        *batch*: :class:`baip_munger.Batch` with the compiled plan
+
+        *staged_dir*: top level directory of the staged documents
+
+        *munged_dir*: top level directory of the munged documents
+
+        *settle*: seconds a file must be unchanged before munging
+
+        *interval*: seconds between change checks
+
+        *source*: change source with a ``changes(timeout)`` method.
+        Defaults to :class:`InotifySource` where available, otherwise
+        :class:`PollSource`
+
+    """
+    def __init__(self,
+                 batch,
+                 staged_dir,
+                 munged_dir,
+                 settle=2.0,
+                 interval=1.0,
+                 source=None):
+        self.__batch = batch
+        self.__staged_dir = staged_dir
+        self.__munged_dir = munged_dir
+        self.__settle = settle
+        self.__interval = interval
+        self.__pending = {}
+
+        if source is None:
+            if InotifySource.available():
+                source = InotifySource(staged_dir)
+            else:
+                log.info('inotify not available: polling "%s"' %
+                         staged_dir)
+                source = PollSource(staged_dir)
+        self.__source = source
+
+        for relpath in self._stale():
+            self._track(relpath)
+
+    @property
+    def batch(self):
+        return self.__batch
+
+    @property
+    def source(self):
+        return self.__source
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    def _stale(self):
+        """Staged documents whose munged counterpart is missing or
+        older.
+
+        """
+        stale = []
+        for relpath in self.batch.source_files(self.__staged_dir):
+            staged_file = os.path.join(self.__staged_dir, relpath)
+            munged_file = os.path.join(self.__munged_dir, relpath)
+            try:
+                if (os.path.getmtime(munged_file) >=
+                        os.path.getmtime(staged_file)):
+                    continue
+            except OSError:
+                pass
+            stale.append(relpath)
+
+        return stale
+
+    def _track(self, relpath):
+        if not self.batch.matches(os.path.basename(relpath)):
+            return
+
+        try:
+            stat = os.stat(os.path.join(self.__staged_dir, relpath))
+        except OSError:
+            self.__pending.pop(relpath, None)
+            return
+
+        signature = (stat.st_size, stat.st_mtime)
+        current = self.__pending.get(relpath)
+        if current is None or current[0] != signature:
+            self.__pending[relpath] = (signature, time.time())
+
+    def settled(self, now=None):
+        """Return the sorted pending documents that have been stable
+        for the settle period and stop tracking them.
+
+        """
+        if now is None:
+            now = time.time()
+
+        for relpath in list(self.__pending):
+            self._track(relpath)
+
+        ready = sorted(x for x, (_, y) in self.__pending.iteritems()
+                       if now - y >= self.__settle)
+        for relpath in ready:
+            del self.__pending[relpath]
+
+        return ready
+
+    def poll(self):
+        """Wait for changes, then munge the settled documents.
+
+        **Returns:**
+            the :meth:`baip_munger.Batch.munge_files` summary or
+            ``None`` if no documents were ready
+
+        """
+        changed = self.source.changes(self.__interval)
+        if changed is None:
+            log.warn('Watch events lost: rescanning "%s"' %
+                     self.__staged_dir)
+            changed = self.batch.source_files(self.__staged_dir)
+
+        for relpath in changed:
+            self._track(relpath)
+
+        ready = self.settled()
+        if not ready:
+            return None
+
+        items = []
+        for relpath in ready:
+            munged_file = os.path.join(self.__munged_dir, relpath)
+            munged_path = os.path.dirname(munged_file)
+            if not os.path.isdir(munged_path):
+                os.makedirs(munged_path)
+            items.append((os.path.join(self.__staged_dir, relpath),
+                          munged_file))
+
+        return self.batch.munge_files(items)
+
+    def run(self):
+        """Munge documents as they arrive until interrupted.
+
+        """
+        log.info('Watching "%s"' % self.__staged_dir)
+        try:
+            while True:
+                self.poll()
+        except KeyboardInterrupt:
+            log.info('Watch interrupted')
+        finally:
+            self.source.close()
@@ -1,17 +1,44 @@
 import lxml.etree
 import os
+import re
+import time
 
 import baip_munger.exception
+import baip_munger.metrics
+import baip_munger.munger
+import baip_munger.plan
 from logga.log import log
 
 
-__all__ = ['XpathGen']
+__all__ = ['XpathGen', 'SCHEMA']
+
+SCHEMA = os.path.join(os.path.dirname(__file__), 'conf', 'munger.rng')
+
+# Order in which each Section's actions are added to the action plan.
+ACTION_ORDER = [
+    ('sectionDeleteAttribute', 'attributes'),
+    ('sectionUpdateAttribute', 'attributes'),
+    ('sectionAddAttribute', 'attributes'),
+    ('sectionStripChars', 'strip_chars'),
+    ('sectionRegexReplace', 'regex_replaces'),
+    ('sectionReplaceTag', 'replace_tags'),
+    ('sectionInsertTag', 'insert_tags'),
+]
+
+CONFIG_SECONDS = baip_munger.metrics.REGISTRY.gauge(
+    'baip_munger_config_load_seconds',
+    'Time taken to load, validate and compile the last XpathGen config')
 
 
 class XpathGen(object):
+    __schema = None
+
     def __init__(self, conf_file=None):
         self.__conf_file = conf_file
         self.__root = None
+        self.__xpaths = {}
+        self.__plan = None
+        self.__load_time = None
 
         if conf_file is not None:
             self.root = conf_file
@@ -32,10 +59,255 @@ class XpathGen(object):
     def root(self, value):
         if value is not None:
             if os.path.exists(value):
-                self.__root = lxml.etree.parse(value)
+                self.load(value)
             else:
                 raise baip_munger.exception.MungerConfigError(1000)
 
+    @property
+    def xpaths(self):
+        """Dictionary of the configuration's XPath expressions mapped
+        to their compiled :class:`lxml.etree.XPath` objects.
+
+        """
+        return self.__xpaths
+
+    @property
+    def plan(self):
+        """:class:`baip_munger.Plan` of the loaded configuration.
+
+        """
+        if self.__plan is None:
+            raise baip_munger.exception.MungerConfigError(1001)
+
+        return self.__plan
+
+    @property
+    def load_time(self):
+        """Seconds taken by the last :meth:`load`.
+
+        """
+        return self.__load_time
+
+    @classmethod
+    def schema(cls):
+        """Return the :class:`lxml.etree.RelaxNG` validator built from
+        :data:`SCHEMA`.  The validator is built once per process.
+
+        """
+        if cls.__schema is None:
+            cls.__schema = lxml.etree.RelaxNG(lxml.etree.parse(SCHEMA))
+
+        return cls.__schema
+
+    @staticmethod
+    def _locate_section(tree, line):
+        """Identify the ``Section`` element of *tree* that encloses
+        source *line*.
+
+        **Returns:**
+            tuple of the form ``(<section_number>, <description>)``
+            where *section_number* starts at 1.  ``(None, None)`` if
+            *line* precedes the first ``Section``
+
+        """
+        located = (None, None)
+
+        for index, section in enumerate(tree.iter('Section'), 1):
+            if section.sourceline > line:
+                break
+            located = (index, section.findtext('sectionDescription'))
+
+        return located
+
+    def validate(self, tree):
+        """Validate configuration *tree* against :data:`SCHEMA` and
+        compile each ``Section`` XPath expression, ``when`` guard and
+        ``sectionRegexReplace`` pattern.
+
+        XPath expressions are also evaluated once against an empty
+        document so that unknown functions are trapped at load time.
+        Schema violations are reported ahead of the first ``Section``
+        (in document order) with an invalid expression.
+
+        **Args:**
+            *tree*: :mod:`lxml.etree._ElementTree` structure
+
+        **Returns:**
+            dictionary of ``Section`` XPath expressions mapped to their
+            compiled :class:`lxml.etree.XPath` objects
+
+        **Raises:**
+            :class:`baip_munger.exception.MungerConfigError` (1003) on
+            schema violation, (1004) on invalid XPath expression and
+            (1006) on invalid ``sectionRegexReplace`` pattern
+
+        """
+        self._validate_schema(tree)
+
+        xpaths = {}
+        checked = {}
+        for index, section in enumerate(tree.iter('Section'), 1):
+            code, err = 1004, None
+
+            xpath = section.findtext('xpath')
+            if xpath is not None and xpath not in xpaths:
+                err = self._compile(xpath, xpaths)
+
+            guards = [x.text for x in section.iterchildren('when')]
+            parent = section.getparent()
+            if parent is not None and parent.tag == 'SectionGroup':
+                guards.append(parent.findtext('when'))
+            for guard in guards:
+                if err is None and guard and guard not in checked:
+                    err = self._compile(guard, checked)
+
+            for pattern in section.iterfind('sectionRegexReplace/'
+                                            'regexPattern'):
+                if err is None and pattern.text is not None:
+                    code = 1006
+                    err = self._compile_pattern(pattern.text)
+
+            if err is not None:
+                desc = section.findtext('sectionDescription')
+                raise baip_munger.exception.MungerConfigError(code,
+                                                              section=index,
+                                                              description=desc,
+                                                              error=err)
+
+        log.debug('Config validated: %d unique XPath expressions' %
+                  len(xpaths))
+
+        return xpaths
+
+    def _validate_schema(self, tree):
+        """Validate configuration *tree* against :data:`SCHEMA`.
+
+        **Raises:**
+            :class:`baip_munger.exception.MungerConfigError` (1003) on
+            schema violation
+
+        """
+        schema = self.schema()
+        if not schema.validate(tree):
+            errors = list(schema.error_log)
+            error = max(errors, key=lambda x: len(x.path or ''))
+            index, desc = self._locate_section(tree, error.line)
+            raise baip_munger.exception.MungerConfigError(1003,
+                                                          section=index,
+                                                          description=desc,
+                                                          error=error.message)
+
+    @staticmethod
+    def _compile(xpath, xpaths):
+        """Compile *xpath* into *xpaths* and evaluate it once against
+        an empty document so that unknown functions are trapped.
+
+        **Returns:**
+            ``None`` on success or the error text
+
+        """
+        try:
+            namespaces = baip_munger.munger.NAMESPACES
+            xpaths[xpath] = lxml.etree.XPath(xpath, namespaces=namespaces)
+            xpaths[xpath](lxml.etree.Element('html'))
+        except lxml.etree.XPathError as err:
+            xpaths.pop(xpath, None)
+            return '"%s" %s' % (xpath, err)
+
+        return None
+
+    @staticmethod
+    def _compile_pattern(pattern):
+        """Compile the regular expression *pattern* as per
+        :func:`baip_munger.munger.compile_pattern`.
+
+        **Returns:**
+            ``None`` on success or the error text
+
+        """
+        try:
+            baip_munger.munger.compile_pattern(pattern)
+        except re.error as err:
+            return '"%s" %s' % (pattern, err)
+
+        return None
+
+    def load(self, conf_file):
+        """Parse *conf_file* once, :meth:`validate` it and build the
+        action plan.
+
+        Each top level ``Section`` (or ``Section`` of a top level
+        ``SectionGroup``) is turned into its actions by walking the
+        section's children directly rather than running XPath queries
+        over the configuration.  Nested ``Section`` elements follow
+        their enclosing section and their XPath is relative to the
+        enclosing section's matches.  The parsed tree is kept as
+        :attr:`root`.
+
+        **Raises:**
+            :class:`baip_munger.exception.MungerConfigError` (1002) if
+            *conf_file* is not well-formed, or as per :meth:`validate`
+
+        """
+        start = time.time()
+
+        try:
+            tree = lxml.etree.parse(conf_file)
+        except lxml.etree.XMLSyntaxError as err:
+            raise baip_munger.exception.MungerConfigError(1002, error=err)
+
+        xpaths = self.validate(tree)
+
+        plan = dict((x, []) for _, x in ACTION_ORDER)
+        sections = 0
+
+        top = []
+        for child in tree.getroot().iterchildren(tag=lxml.etree.Element):
+            if child.tag == 'Section':
+                top.append((child, []))
+            elif child.tag == 'SectionGroup':
+                guards = []
+                if child.findtext('when'):
+                    guards.append(child.findtext('when'))
+                for section in child.iterchildren('Section'):
+                    top.append((section, list(guards)))
+
+        for section, guards in top:
+            # Nested Sections are taken in document order after their
+            # enclosing Section.
+            stack = [(section, guards, [])]
+            while stack:
+                section, guards, scope = stack.pop()
+                sections += 1
+
+                xpath, actions, nested = self._section_actions(section,
+                                                               guards,
+                                                               scope)
+                if xpath is None:
+                    continue
+
+                location = tree.getpath(section)
+                for key, items in actions:
+                    action_type = baip_munger.plan.ACTION_TYPES[key]
+                    for item in items:
+                        rule_id = '%s[%d]' % (key, len(plan[key]))
+                        plan[key].append(action_type(rule_id=rule_id,
+                                                     section=location,
+                                                     **item))
+
+                for child in reversed(nested):
+                    stack.append((child, list(guards), scope + [xpath]))
+
+        self.__root = tree
+        self.__xpaths = xpaths
+        self.__plan = baip_munger.plan.Plan(plan)
+        self.__load_time = time.time() - start
+        CONFIG_SECONDS.set(self.__load_time)
+
+        log.info('Config "%s" loaded: %d sections, %d unique XPath '
+                 'expressions in %.3fs' %
+                 (conf_file, sections, len(xpaths), self.__load_time))
+
     def extract_xpath(self, conf_file=None):
         """Wrapper method around the XPath generation facility.
 
@@ -114,182 +386,192 @@ class XpathGen(object):
                     }
                 ]
 
+            Actions of guarded sections also hold a ``when`` list of
+            the XPath expressions that must all hold for a document
+            before the action is applied.  Actions of nested sections
+            hold a ``context`` list of the enclosing section XPath
+            expressions (outermost first)
+
+        This is the plain dictionary form of :attr:`plan`, kept for
+        compatibility.  Each call builds a new copy.
+
         """
         if self.root is None:
             raise baip_munger.exception.MungerConfigError(1001)
 
-        config_items = {'attributes': [],
-                        'strip_chars': [],
-                        'replace_tags': [],
-                        'insert_tags': []}
-
-        for section in self.root.xpath('//Doc/Section'):
-            xpath = section.xpath('xpath/text()')
-
-            if not len(xpath):
-                continue
-
-            delete_attrs = self._parse_delete_attributes(xpath[0], section)
-            config_items.get('attributes').extend(delete_attrs)
-
-            update_attrs = self._parse_update_attributes(xpath[0], section)
-            config_items.get('attributes').extend(update_attrs)
-
-            add_attrs = self._parse_add_attributes(xpath[0], section)
-            config_items.get('attributes').extend(add_attrs)
+        return self.__plan.to_dict()
 
-            chars = self._parse_strip_chars(xpath[0], section)
-            config_items.get('strip_chars').extend(chars)
+    @classmethod
+    def _section_actions(cls, section, guards=None, context=None):
+        """Build the actions of *section* from a single walk over its
+        child elements.
 
-            replace_tags = self._parse_replace_tag(xpath[0], section)
-            config_items.get('replace_tags').extend(replace_tags)
+        The section's ``when`` guard is appended to the enclosing
+        *guards* list and each action is given a ``when`` list of
+        the expressions that must all hold for it to apply.  Actions
+        of a nested section are given the *context* list of enclosing
+        section XPath expressions (outermost first).
 
-            insert_tags = self._parse_insert_tag(xpath[0], section)
-            config_items.get('insert_tags').extend(insert_tags)
+        **Returns:**
+            tuple of the form ``(<xpath>, <actions>, <nested>)`` where
+            *actions* is a list of ``(<plan_key>, <config_items>)`` in
+            :data:`ACTION_ORDER` and *nested* is the list of child
+            ``Section`` elements.  *xpath* is ``None`` if the section
+            has no ``xpath``
 
-        return config_items
+        """
+        if guards is None:
+            guards = []
+
+        xpath = None
+        found = {}
+        nested = []
+        for child in section.iterchildren(tag=lxml.etree.Element):
+            if child.tag == 'xpath':
+                if xpath is None:
+                    xpath = child.text
+            elif child.tag == 'when':
+                if child.text:
+                    guards.append(child.text)
+            elif child.tag == 'Section':
+                nested.append(child)
+            else:
+                found.setdefault(child.tag, []).append(child)
+
+        actions = []
+        if xpath is not None:
+            for tag, key in ACTION_ORDER:
+                items = []
+                for action in found.get(tag, []):
+                    conf_item = cls._action(tag, xpath, action)
+                    if conf_item is not None:
+                        if guards:
+                            conf_item['when'] = list(guards)
+                        if context:
+                            conf_item['context'] = list(context)
+                        items.append(conf_item)
+                if items:
+                    actions.append((key, items))
+
+        return (xpath, actions, nested)
 
     @staticmethod
-    def _parse_delete_attributes(xpath, section):
-        """Parse ``sectionDeleteAttribute`` element configuration items
+    def _child_texts(element):
+        """Map each child tag of *element* to the text of its first
+        occurrence.  Children without text are left out.
 
         """
-        config_items = []
-
-        for action in section.xpath('sectionDeleteAttribute'):
-            conf_item = {'xpath': xpath}
-            attr = action.xpath('attributeName/text()')
-            if len(attr):
-                conf_item['attribute'] = attr[0]
+        texts = {}
+        for child in element.iterchildren(tag=lxml.etree.Element):
+            if child.tag not in texts and child.text is not None:
+                texts[child.tag] = child.text
 
-                config_items.append(conf_item)
+        return texts
 
-        return config_items
+    @classmethod
+    def _action(cls, tag, xpath, action):
+        """Build the config item of the *tag* element *action*.
 
-    @staticmethod
-    def _parse_update_attributes(xpath, section):
-        """Parse ``sectionUpdateAttribute`` config items.
+        **Returns:**
+            config item dictionary or ``None`` if *action* is incomplete
 
         """
-        config_items = []
-
-        for action in section.xpath('sectionUpdateAttribute'):
-            conf_item = {'xpath': xpath}
-            attr = action.xpath('attributeName/text()')
-            value = action.xpath('attributeValue/text()')
-            old_value = action.xpath('attributeOldValue/text()')
-            if len(attr):
-                conf_item['attribute'] = attr[0]
-                if len(value):
-                    conf_item['value'] = value[0]
-
-                if len(old_value):
-                    conf_item['old_value'] = old_value[0]
+        texts = cls._child_texts(action)
+        conf_item = {'xpath': xpath}
+
+        if tag == 'sectionStripChars':
+            if 'stripChars' not in texts:
+                return None
+            conf_item['chars'] = texts['stripChars']
+        elif tag == 'sectionRegexReplace':
+            if 'regexPattern' not in texts:
+                return None
+            conf_item['pattern'] = texts['regexPattern']
+            conf_item['replacement'] = texts.get('regexReplacement', '')
+        elif tag in ('sectionReplaceTag', 'sectionInsertTag'):
+            if 'newTag' not in texts:
+                return None
+            conf_item['new_tag'] = texts['newTag']
+            if tag == 'sectionReplaceTag':
+                new_tag_attributes = []
+                for new_attr in action.iterchildren(tag='newTagAttribute'):
+                    attr = cls._child_texts(new_attr)
+                    if 'attributeName' in attr:
+                        new_tag_attributes.append((attr['attributeName'],
+                                                   attr.get('attributeValue')))
+                conf_item['new_tag_attributes'] = new_tag_attributes
 
-                config_items.append(conf_item)
+                # Renaming in place is the default replace mode.
+                if texts.get('replaceMode', '').strip() == 'flatten':
+                    conf_item['flatten'] = True
+        else:
+            if 'attributeName' not in texts:
+                return None
+            conf_item['attribute'] = texts['attributeName']
+            if (tag != 'sectionDeleteAttribute' and
+                    'attributeValue' in texts):
+                conf_item['value'] = texts['attributeValue']
+            if (tag == 'sectionUpdateAttribute' and
+                    'attributeOldValue' in texts):
+                conf_item['old_value'] = texts['attributeOldValue']
+            if tag == 'sectionAddAttribute':
+                conf_item['add'] = True
 
-        return config_items
+        return conf_item
 
-    @staticmethod
-    def _parse_add_attributes(xpath, section):
-        """Parse ``sectionAddAttribute`` config items.
+    @classmethod
+    def _parse_actions(cls, tag, xpath, section):
+        """Parse the *tag* action elements of *section*.
 
         """
         config_items = []
 
-        for action in section.xpath('sectionAddAttribute'):
-            conf_item = {'xpath': xpath}
-            attr = action.xpath('attributeName/text()')
-            value = action.xpath('attributeValue/text()')
-            log.debug('sectionAddAttribute attr|value: "%s|%s"' %
-                      (attr, value))
-
-            if len(attr):
-                conf_item['attribute'] = attr[0]
-                if len(value):
-                    conf_item['value'] = value[0]
-                conf_item['add'] = True
-
+        for action in section.iterchildren(tag=tag):
+            conf_item = cls._action(tag, xpath, action)
+            log.debug('%s config item: "%s"' % (tag, conf_item))
+            if conf_item is not None:
                 config_items.append(conf_item)
 
         return config_items
 
-    @staticmethod
-    def _parse_strip_chars(xpath, section):
-        """Parse ``sectionStripChars`` config items.
+    @classmethod
+    def _parse_delete_attributes(cls, xpath, section):
+        """Parse ``sectionDeleteAttribute`` element configuration items
 
         """
-        config_items = []
+        return cls._parse_actions('sectionDeleteAttribute', xpath, section)
 
-        for action in section.xpath('sectionStripChars'):
-            conf_item = {'xpath': xpath}
-            chars = action.xpath('stripChars/text()')
-            log.debug('sectionStripChars value: "%s"' % chars)
+    @classmethod
+    def _parse_update_attributes(cls, xpath, section):
+        """Parse ``sectionUpdateAttribute`` config items.
 
-            if len(chars):
-                conf_item['chars'] = chars[0]
+        """
+        return cls._parse_actions('sectionUpdateAttribute', xpath, section)
 
-                config_items.append(conf_item)
+    @classmethod
+    def _parse_add_attributes(cls, xpath, section):
+        """Parse ``sectionAddAttribute`` config items.
 
-        return config_items
+        """
+        return cls._parse_actions('sectionAddAttribute', xpath, section)
 
-    @staticmethod
-    def _parse_replace_tag(xpath, section):
-        """Parse ``sectionReplaceTag`` config items.
+    @classmethod
+    def _parse_strip_chars(cls, xpath, section):
+        """Parse ``sectionStripChars`` config items.
 
         """
-        config_items = []
-
-        for action in section.xpath('sectionReplaceTag'):
-            conf_item = {'xpath': xpath}
-            new_tag = action.xpath('newTag/text()')
-            log.debug('sectionReplaceTag value: "%s"' % new_tag)
-
-            # Check for attributes.
-            new_tag_attr = 'newTagAttribute'
-            new_attrs = action.xpath(new_tag_attr)
-            new_tag_attributes = []
-            for new_attr in new_attrs:
-                log.debug('newTagAttribute element found')
-
-                names = new_attr.xpath('attributeName/text()')
-                attr_name = None
-                if len(names):
-                    attr_name = names[0]
-
-                values = new_attr.xpath('attributeValue/text()')
-                attr_value = None
-                if len(values):
-                    attr_value = values[0]
-
-                if attr_name is not None:
-                    new_tag_attributes.append((attr_name, attr_value))
-                    log.debug('sectionReplaceTag attribute "%s"' %
-                              (new_tag_attributes[-1], ))
-
-            if len(new_tag):
-                conf_item['new_tag'] = new_tag[0]
-                conf_item['new_tag_attributes'] = new_tag_attributes
+        return cls._parse_actions('sectionStripChars', xpath, section)
 
-                config_items.append(conf_item)
+    @classmethod
+    def _parse_replace_tag(cls, xpath, section):
+        """Parse ``sectionReplaceTag`` config items.
 
-        return config_items
+        """
+        return cls._parse_actions('sectionReplaceTag', xpath, section)
 
-    @staticmethod
-    def _parse_insert_tag(xpath, section):
+    @classmethod
+    def _parse_insert_tag(cls, xpath, section):
         """Parse ``sectionInsertTag`` config items.
 
         """
-        config_items = []
-
-        for action in section.xpath('sectionInsertTag'):
-            conf_item = {'xpath': xpath}
-            new_tag = action.xpath('newTag/text()')
-            log.debug('sectionInsertTag value: "%s"' % new_tag)
-
-            if len(new_tag):
-                conf_item['new_tag'] = new_tag[0]
-
-                config_items.append(conf_item)
-
-        return config_items
+        return cls._parse_actions('sectionInsertTag', xpath, section)
@@ -0,0 +1,654 @@
+import re
+import collections
+import lxml.etree
+
+import baip_munger.munger
+import baip_munger.plan
+from logga.log import log
+
+__all__ = ['XsltGen']
+
+XSL_NS = 'http://www.w3.org/1999/XSL/Transform'
+
+# Namespace prefixes (as per baip_munger.munger.NAMESPACES) that the
+# generated stylesheets do not declare.
+PREFIXED = re.compile(r'(?<![\w.-])(?:%s):(?!:)' %
+                      '|'.join(baip_munger.munger.NAMESPACES))
+
+# Smallest number of rules in a pass that is applied by libxslt.  By
+# default every rule that can be expressed in XSLT is.
+MIN_PASS_RULES = 1
+
+# Smallest number of rules in a pass for which the libxslt pass (a copy
+# of the whole tree plus a key lookup per rule that can match each
+# element) was measured to cost less than the XPath searches of the
+# Python engine (see the measure-backends command).  Pass it as
+# *min_pass_rules* to opt in to the cheaper engine per pass.
+CROSSOVER_RULES = 1024
+
+# Compiled plans shared between XsltGen instances before the least
+# recently used is dropped.
+CACHE_SIZE = 16
+
+# Named templates that emulate Python's unicode.strip(chars).  The
+# left strip locates the first character not in $chars via translate().
+# The right strip halves the string on each call so that recursion
+# depth is bound by log(n) rather than the length of the stripped run.
+STRIP_TEMPLATES = """
+<xsl:stylesheet version="1.0" xmlns:xsl="%s">
+    <xsl:template name="baip-strip">
+        <xsl:param name="s"/>
+        <xsl:param name="chars"/>
+        <xsl:variable name="first"
+                      select="substring(translate($s, $chars, ''), 1, 1)"/>
+        <xsl:if test="$first != ''">
+            <xsl:call-template name="baip-rstrip">
+                <xsl:with-param name="s"
+                                select="concat($first,
+                                               substring-after($s, $first))"/>
+                <xsl:with-param name="chars" select="$chars"/>
+            </xsl:call-template>
+        </xsl:if>
+    </xsl:template>
+    <xsl:template name="baip-rstrip">
+        <xsl:param name="s"/>
+        <xsl:param name="chars"/>
+        <xsl:variable name="n" select="string-length($s)"/>
+        <xsl:variable name="h" select="floor($n div 2)"/>
+        <xsl:choose>
+            <xsl:when test="not(contains($chars, substring($s, $n)))">
+                <xsl:value-of select="$s"/>
+            </xsl:when>
+            <xsl:when test="translate(substring($s, $h + 1),
+                                      $chars, '') = ''">
+                <xsl:call-template name="baip-rstrip">
+                    <xsl:with-param name="s" select="substring($s, 1, $h)"/>
+                    <xsl:with-param name="chars" select="$chars"/>
+                </xsl:call-template>
+            </xsl:when>
+            <xsl:otherwise>
+                <xsl:value-of select="substring($s, 1, $h)"/>
+                <xsl:call-template name="baip-rstrip">
+                    <xsl:with-param name="s" select="substring($s, $h + 1)"/>
+                    <xsl:with-param name="chars" select="$chars"/>
+                </xsl:call-template>
+            </xsl:otherwise>
+        </xsl:choose>
+    </xsl:template>
+</xsl:stylesheet>
+""" % XSL_NS
+
+
+def _xsl(parent, tag, **attrs):
+    """Add an XSLT instruction *tag* as a child of *parent*.
+
+    """
+    element = lxml.etree.SubElement(parent, '{%s}%s' % (XSL_NS, tag))
+    for name, value in attrs.iteritems():
+        element.set(name.replace('_', '-'), value)
+
+    return element
+
+
+def _literal(value):
+    """Return *value* as an XPath 1.0 string literal.
+
+    """
+    if "'" not in value:
+        return "'%s'" % value
+
+    if '"' not in value:
+        return '"%s"' % value
+
+    return 'concat(%s)' % ', "\'", '.join("'%s'" % x
+                                          for x in value.split("'"))
+
+
+def _avt(value):
+    """Escape *value* for use in an attribute value template.
+
+    """
+    return value.replace('{', '{{').replace('}', '}}')
+
+
+def _last_step(xpath):
+    """Return the lower case element name of the last location step of
+    *xpath* or ``*`` if it can select any element.
+
+    """
+    steps = []
+    depth = 0
+    quote = None
+    for char in xpath:
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '[(':
+            depth += 1
+        elif char in '])':
+            depth -= 1
+        elif not depth:
+            steps.append(char)
+
+    step = ''.join(steps)
+    if '|' in step:
+        return '*'
+
+    name = step.rsplit('/', 1)[-1].strip()
+    if re.match(r'^[A-Za-z_][\w.-]*$', name) is None:
+        return '*'
+
+    return name.lower()
+
+
+class XsltGen(object):
+    """Compile an action plan as generated by
+    :meth:`baip_munger.XpathGen.parse_configuration` into
+    :class:`lxml.etree.XSLT` stylesheets.
+
+    Consecutive rules that can be expressed in XSLT are compiled into
+    a single stylesheet of passes.  Each pass is a separate mode
+    selected by the ``rule`` stylesheet parameter and is applied to the
+    result of the previous pass.  Consecutive ``update_element_attribute``
+    rules share a pass unless one reads an attribute that an earlier
+    rule of the pass changes (see :meth:`group`).  Every pass copies
+    the whole tree, which costs more than the XPath searches of a few
+    rules.  Passes of fewer than *min_pass_rules* rules are applied by
+    the Python engine instead (:data:`CROSSOVER_RULES` is the measured
+    break even).  Passes are not chained
+    within the stylesheet via ``exsl:node-set()`` as that copies the
+    tree just the same.  Rules that cannot be
+    expressed (``insert_tag`` grouping, ``regex_replace``, rules
+    relative to a context or XPath expressions that are not absolute
+    XSLT patterns, such as those that use EXSLT ``re:``) are applied
+    by the Python :class:`baip_munger.Munger` engine between the
+    stylesheets.
+
+    Rule ``when`` guards are evaluated once per document before the
+    first pass and the passes of rules with a failed guard are skipped.
+
+    The stylesheets of the last :data:`CACHE_SIZE` distinct
+    :class:`baip_munger.Plan` objects are shared by every
+    :class:`XsltGen` of an equal plan.
+
+    """
+    __patterns = {}
+    __compiled = collections.OrderedDict()
+
+    def __init__(self, actions, min_pass_rules=MIN_PASS_RULES):
+        self.__actions = actions
+        self.__min_pass_rules = min_pass_rules
+        self.__guards = []
+        self.__passes = []
+
+        compiled = None
+        key = (actions, min_pass_rules)
+        if isinstance(actions, baip_munger.plan.Plan):
+            compiled = self.__compiled.pop(key, None)
+        if compiled is None:
+            self.__segments = self.compile(actions)
+            compiled = (self.__segments, self.__guards, self.__passes)
+            if isinstance(actions, baip_munger.plan.Plan):
+                if len(self.__compiled) >= CACHE_SIZE:
+                    self.__compiled.popitem(last=False)
+                self.__compiled[key] = compiled
+        else:
+            self.__compiled[key] = compiled
+            self.__segments, self.__guards, self.__passes = compiled
+
+    @property
+    def actions(self):
+        return self.__actions
+
+    @property
+    def segments(self):
+        """List of tuples of the form ``('xslt', <XSLT>, [<rule_id>,
+        ...])`` or ``('python', <method_name>, <rule>)`` in plan order.
+
+        """
+        return self.__segments
+
+    @property
+    def min_pass_rules(self):
+        return self.__min_pass_rules
+
+    @property
+    def guards(self):
+        """List that matches :attr:`segments` of the ``when`` guard
+        tuples of each rule in the segment.
+
+        """
+        return self.__guards
+
+    @property
+    def passes(self):
+        """List that matches :attr:`segments` of the passes of each
+        segment.  A pass is a list of the 1-based positions of its rules
+        within the segment.
+
+        """
+        return self.__passes
+
+    @classmethod
+    def is_pattern(cls, xpath):
+        """Check if *xpath* is an absolute expression that is also a
+        valid XSLT match pattern.  Expressions that use a namespace
+        prefix of :data:`baip_munger.munger.NAMESPACES` (such as the
+        EXSLT ``re:`` functions) are not.
+
+        """
+        valid = cls.__patterns.get(xpath)
+
+        if valid is None:
+            valid = False
+            if xpath.startswith('/') and not PREFIXED.search(xpath):
+                stylesheet = lxml.etree.Element('{%s}stylesheet' % XSL_NS,
+                                                version='1.0')
+                _xsl(stylesheet, 'template', match=xpath)
+                try:
+                    lxml.etree.XSLT(stylesheet)
+                    valid = True
+                except lxml.etree.XSLTParseError:
+                    pass
+            cls.__patterns[xpath] = valid
+
+        return valid
+
+    def compile(self, actions):
+        """Build the :attr:`segments` from *actions*.
+
+        """
+        segments = []
+        rules = []
+        self.__guards = []
+        self.__passes = []
+
+        plan = baip_munger.munger.Munger.plan_steps(actions)
+        for rule_id, method, rule, guards in plan:
+            builder = getattr(self, '_xsl_%s' % method, None)
+            if (builder is not None and 'context' not in rule and
+                    self.is_pattern(rule.get('xpath'))):
+                rules.append((rule_id, method, rule, guards))
+                continue
+
+            log.debug('XSLT fallback to Python engine for rule %s' % rule_id)
+            segments.extend(self._build_segments(rules))
+            rules = []
+            segments.append(('python', method, rule))
+            self.__guards.append([guards])
+            self.__passes.append([[1]])
+
+        segments.extend(self._build_segments(rules))
+
+        return segments
+
+    def _build_segments(self, rules):
+        """Build the segments of consecutive XSLT *rules*.  Runs of
+        passes of at least :attr:`min_pass_rules` rules share a
+        stylesheet and the rules of the other passes are applied by the
+        Python engine.
+
+        """
+        segments = []
+        run = []
+        passes = []
+
+        def flush():
+            if run:
+                segments.append(self._build_segment(run, passes))
+                del run[:], passes[:]
+
+        for indices in self.group(rules):
+            pass_rules = [rules[x - 1] for x in indices]
+            if len(indices) >= self.min_pass_rules:
+                passes.append(range(len(run) + 1,
+                                    len(run) + len(indices) + 1))
+                run.extend(pass_rules)
+                continue
+
+            flush()
+            for rule_id, method, rule, guards in pass_rules:
+                log.debug('Python engine cheaper for rule %s' % rule_id)
+                segments.append(('python', method, rule))
+                self.__guards.append([guards])
+                self.__passes.append([[1]])
+
+        flush()
+
+        return segments
+
+    def _build_segment(self, rules, passes):
+        self.__guards.append([x[3] for x in rules])
+        self.__passes.append([list(x) for x in passes])
+        rules = [(x[0], getattr(self, '_xsl_%s' % x[1]), x[2])
+                 for x in rules]
+        stylesheet = self.build_stylesheet(rules, passes)
+        rule_ids = [x[0] for x in rules]
+        log.debug('XSLT stylesheet compiled for rules: %s' % rule_ids)
+
+        return ('xslt', lxml.etree.XSLT(stylesheet), rule_ids)
+
+    @staticmethod
+    def group(rules):
+        """Split *rules* into passes.  Consecutive
+        ``update_element_attribute`` rules share a pass unless a rule
+        reads an attribute (in its XPath or as the attribute it
+        updates or deletes) that an earlier rule of the pass changes.
+
+        **Args:**
+            *rules*: list of tuples that start ``(<rule_id>,
+            <method>, <rule>)``
+
+        **Returns:**
+            list of passes, each a list of 1-based positions in *rules*
+
+        """
+        passes = []
+        changed = None
+        for index, rule in enumerate(rules, 1):
+            method, rule = rule[1], rule[2]
+            if method != 'update_element_attribute':
+                passes.append([index])
+                changed = None
+                continue
+
+            attribute = rule['attribute'].lower()
+            reads = baip_munger.munger.read_attributes(rule['xpath'])
+            if not rule.get('add'):
+                reads.add(attribute)
+
+            if changed is None or changed & reads or '*' in reads:
+                passes.append([])
+                changed = set()
+            passes[-1].append(index)
+            changed.add(attribute)
+
+        return passes
+
+    def build_stylesheet(self, rules, passes=None):
+        """Generate the XSLT stylesheet document for *rules*.
+
+        **Args:**
+            *rules*: list of tuples of the form ``(<rule_id>,
+            <builder>, <rule>)``
+
+            *passes*: list of passes as per :attr:`passes`.  Defaults
+            to one pass per rule
+
+        **Returns:**
+            :class:`lxml.etree._Element` stylesheet root
+
+        """
+        if passes is None:
+            passes = [[x] for x in range(1, len(rules) + 1)]
+
+        stylesheet = lxml.etree.Element('{%s}stylesheet' % XSL_NS,
+                                        nsmap={'xsl': XSL_NS},
+                                        version='1.0')
+
+        _xsl(stylesheet, 'param', name='rule', select='1')
+        choose = _xsl(_xsl(stylesheet, 'template', match='/'), 'choose')
+        for indices in passes:
+            mode = 'r%d' % indices[0]
+
+            for index in indices:
+                _xsl(stylesheet, 'key', name='r%d' % index,
+                     match=rules[index - 1][2].get('xpath'),
+                     use='generate-id()')
+            identity = _xsl(stylesheet, 'template', match='@*|node()',
+                            mode=mode)
+            _xsl(_xsl(identity, 'copy'), 'apply-templates',
+                 select='@*|node()', mode=mode)
+
+            if len(indices) == 1:
+                rule_id, builder, rule = rules[indices[0] - 1]
+                builder(stylesheet, mode, **rule)
+            else:
+                for index in indices:
+                    _xsl(stylesheet, 'param', name='r%d' % index, select='1')
+                self._xsl_attribute_pass(stylesheet,
+                                         mode,
+                                         [(x, rules[x - 1][2])
+                                          for x in indices])
+
+            when = _xsl(choose, 'when', test='$rule = %d' % indices[0])
+            _xsl(when, 'apply-templates', mode=mode)
+
+        for template in lxml.etree.XML(STRIP_TEMPLATES):
+            stylesheet.append(template)
+
+        return stylesheet
+
+    @staticmethod
+    def _xsl_replace_tag(stylesheet, mode, xpath, new_tag,
+                         new_tag_attributes=None, flatten=False):
+        """Emulate :meth:`baip_munger.Munger.replace_tag`.  If
+        *flatten* is set the new element holds the string value of the
+        match and the tail is dropped.
+
+        """
+        template = _xsl(stylesheet, 'template', match=xpath, mode=mode,
+                        priority='1')
+        element = _xsl(template, 'element', name=_avt(new_tag))
+        if new_tag_attributes:
+            for name, value in new_tag_attributes:
+                attribute = _xsl(element, 'attribute', name=_avt(name))
+                if value:
+                    _xsl(attribute, 'text').text = value
+        else:
+            _xsl(element, 'copy-of', select='@*')
+
+        if not flatten:
+            _xsl(element, 'apply-templates', select='node()', mode=mode)
+            return
+
+        _xsl(element, 'value-of', select='.')
+
+        tail = "text()[key('%s', generate-id(preceding-sibling::node()[1]))]"
+        _xsl(stylesheet, 'template', match=tail % mode, mode=mode,
+             priority='1')
+
+    @staticmethod
+    def _xsl_update_element_attribute(stylesheet, mode, xpath, attribute,
+                                      value=None, old_value=None, add=False):
+        """Emulate :meth:`baip_munger.Munger.update_element_attribute`.
+
+        """
+        name = _literal(attribute)
+
+        if value is None and not add:
+            template = _xsl(stylesheet, 'template', match=xpath, mode=mode,
+                            priority='1')
+            copy = _xsl(template, 'copy')
+            _xsl(copy, 'copy-of',
+                 select="@*[not(name() = %s and . != '')]" % name)
+            _xsl(copy, 'apply-templates', select='node()', mode=mode)
+            return
+
+        if add:
+            match = xpath
+        else:
+            # Recursive update of the match and its ancestors that
+            # define the attribute.
+            condition = '@*[name() = %s]' % name
+            if old_value is not None:
+                condition += ' = %s' % _literal(old_value)
+            match = ("*[%s][descendant-or-self::*[key('%s', generate-id())]]" %
+                     (condition, mode))
+
+        template = _xsl(stylesheet, 'template', match=match, mode=mode,
+                        priority='1')
+        copy = _xsl(template, 'copy')
+        _xsl(copy, 'copy-of', select='@*')
+        new_attribute = _xsl(copy, 'attribute', name=_avt(attribute))
+        if value:
+            _xsl(new_attribute, 'text').text = value
+        _xsl(copy, 'apply-templates', select='node()', mode=mode)
+
+    @staticmethod
+    def _xsl_attribute_pass(stylesheet, mode, rules):
+        """Emulate a pass of
+        :meth:`baip_munger.Munger.update_element_attribute` *rules* (a
+        list of ``(<index>, <rule>)`` tuples).  Each rule
+        selects the elements it changes with its own template.  The
+        template calls the named template of the rule's element name,
+        which applies every rule that can change such an element in
+        plan order.  The ``r<index>`` stylesheet parameter of a rule
+        with a failed guard is ``0``.
+
+        """
+        effects = []
+        for index, rule in rules:
+            key = 'r%d' % index
+            name = _last_step(rule['xpath'])
+            match = rule['xpath']
+            test = "key('%s', $id)" % key
+            if rule.get('value') is not None and not rule.get('add'):
+                name = '*'
+                condition = '@*[name() = %s]' % _literal(rule['attribute'])
+                if rule.get('old_value') is not None:
+                    condition += ' = %s' % _literal(rule['old_value'])
+                within = ("descendant-or-self::*[key('%s', generate-id())]" %
+                          key)
+                match = '*[%s][%s]' % (condition, within)
+                test = '%s and %s' % (condition, within)
+            effects.append((index, rule, name, match, test))
+
+        names = []
+        for effect in effects:
+            if effect[2] not in names:
+                names.append(effect[2])
+
+        for name in names:
+            template = _xsl(stylesheet, 'template',
+                            name='%s-%s' % (mode, name.replace('*', 'any')))
+            _xsl(template, 'variable', name='id', select='generate-id()')
+            copy = _xsl(template, 'copy')
+
+            deleted = []
+            applied = []
+            for index, rule, effect_name, match, test in effects:
+                if name != '*' and effect_name not in (name, '*'):
+                    continue
+                if rule.get('value') is None and not rule.get('add'):
+                    deleted.append("(name() = %s and . != '' and $r%d = 1 "
+                                   "and %s)" % (_literal(rule['attribute']),
+                                                index,
+                                                test))
+                else:
+                    applied.append((index, rule, test))
+
+            select = '@*'
+            if deleted:
+                select = '@*[not(%s)]' % ' or '.join(deleted)
+            _xsl(copy, 'copy-of', select=select)
+
+            for index, rule, test in applied:
+                check = _xsl(copy, 'if',
+                             test='$r%d = 1 and %s' % (index, test))
+                attribute = _xsl(check, 'attribute',
+                                 name=_avt(rule['attribute']))
+                if rule.get('value'):
+                    _xsl(attribute, 'text').text = rule['value']
+
+            _xsl(copy, 'apply-templates', select='node()', mode=mode)
+
+        for index, rule, name, match, test in effects:
+            template = _xsl(stylesheet, 'template', match=match, mode=mode,
+                            priority='1')
+            _xsl(template, 'call-template',
+                 name='%s-%s' % (mode, name.replace('*', 'any')))
+
+    @staticmethod
+    def _xsl_strip_char(stylesheet, mode, xpath, chars):
+        """Emulate :meth:`baip_munger.Munger.strip_char`.  Text within
+        the matched subtree is stripped in the ``<mode>-in`` mode.  The
+        tail of an element (or comment) is only stripped if the element
+        has text of its own.
+
+        """
+        inner = '%s-in' % mode
+        _xsl(stylesheet, 'variable', name='%s-chars' % mode,
+             select=_literal(chars))
+
+        template = _xsl(stylesheet, 'template', match=xpath, mode=mode,
+                        priority='1')
+        _xsl(template, 'apply-templates', select='.', mode=inner)
+
+        identity = _xsl(stylesheet, 'template', match='@*|node()', mode=inner)
+        _xsl(_xsl(identity, 'copy'), 'apply-templates', select='@*|node()',
+             mode=inner)
+
+        def strip(parent, select):
+            call = _xsl(parent, 'call-template', name='baip-strip')
+            _xsl(call, 'with-param', name='s', select=select)
+            _xsl(call, 'with-param', name='chars', select='$%s-chars' % mode)
+
+        has_text = ('preceding-sibling::node()[1][self::comment() or '
+                    'self::processing-instruction() or '
+                    'node()[1][self::text()]]')
+        text = _xsl(stylesheet, 'template',
+                    match='text()[not(preceding-sibling::node()) or %s]' %
+                    has_text,
+                    mode=inner)
+        strip(text, '.')
+
+        comment = _xsl(stylesheet, 'template', match='comment()', mode=inner,
+                       priority='1')
+        strip(_xsl(comment, 'comment'), '.')
+
+        instruction = _xsl(stylesheet, 'template',
+                           match='processing-instruction()', mode=inner,
+                           priority='1')
+        strip(_xsl(instruction, 'processing-instruction', name='{name()}'),
+              '.')
+
+        tail = ("text()[key('%s', generate-id(preceding-sibling::node()[1]))]"
+                "[%s]" % (mode, has_text))
+        strip(_xsl(stylesheet, 'template', match=tail, mode=mode,
+                   priority='1'), '.')
+
+    def transform(self, root):
+        """Apply the compiled plan to *root*.
+
+        **Args:**
+            *root*: :mod:`lxml.html` root element
+
+        **Returns:**
+            the transformed root element
+
+        """
+        passed = baip_munger.munger.evaluate_guards(root,
+                                                    sum(self.guards, []))
+
+        document = None
+        for (kind, segment, rules), guards, passes in zip(self.segments,
+                                                          self.guards,
+                                                          self.passes):
+            checks = [all(passed[x] for x in y) for y in guards]
+            baip_munger.munger.SKIPPED.inc(checks.count(False))
+            if not any(checks):
+                log.debug('Segment skipped: guards failed')
+                continue
+
+            if kind == 'xslt':
+                log.debug('Applying XSLT for rules: %s' % rules)
+                for indices in passes:
+                    enabled = [checks[x - 1] for x in indices]
+                    if not any(enabled):
+                        continue
+
+                    params = {'rule': str(indices[0])}
+                    if len(indices) > 1:
+                        for index, check in zip(indices, enabled):
+                            params['r%d' % index] = '1' if check else '0'
+                    root = segment(root, **params).getroot()
+                    document = None
+            else:
+                if document is None:
+                    document = baip_munger.munger.Document(root)
+                getattr(document, segment)(**rules)
+
+        return root
@@ -67,4 +67,5 @@ setup(name='python-baip-munger',
       scripts=['baip_munger/bin/baip-munger'],
       packages=['baip_munger',
                 'baip_munger.exception'],
-      package_data={'baip_munger': ['conf/*.xml.[0-9]*.[0-9]*.[0-9]*']})
+      package_data={'baip_munger': ['conf/*.xml.[0-9]*.[0-9]*.[0-9]*',
+                                    'conf/*.rng']})